@@ -0,0 +1,39 @@
+"""Add the materialized patient risk state table
+
+Revision ID: 2e6a8c0b4f73
+Revises: 9c1f3e5a7d20
+Create Date: 2026-10-17 16:21:08.557412
+
+Populate it afterwards with `python -m app.risk`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '2e6a8c0b4f73'
+down_revision = '9c1f3e5a7d20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'patient_risk_states',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('last_entry_date', sa.DateTime(), nullable=True),
+        sa.Column('last_self_harm_at', sa.DateTime(), nullable=True),
+        sa.Column('last_suicidal_thoughts_at', sa.DateTime(), nullable=True),
+        sa.Column('needs_attention_until', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+    op.create_index(
+        'ix_patient_risk_states_attention', 'patient_risk_states', ['needs_attention_until'],
+        postgresql_where=sa.text('needs_attention_until IS NOT NULL'),
+        sqlite_where=sa.text('needs_attention_until IS NOT NULL'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_patient_risk_states_attention', table_name='patient_risk_states')
+    op.drop_table('patient_risk_states')
@@ -0,0 +1,28 @@
+"""Add composite (user_id, date, id) index on diary_entries
+
+Revision ID: 3f9a1c7d2b64
+Revises: c25cc1cb8418
+Create Date: 2026-10-17 09:12:05.318214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '3f9a1c7d2b64'
+down_revision = 'c25cc1cb8418'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_diary_entries_user_date_id',
+        'diary_entries',
+        ['user_id', 'date', 'id'],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_diary_entries_user_date_id', table_name='diary_entries')
@@ -0,0 +1,43 @@
+"""Add the emotion vocabulary and normalized per-entry emotions
+
+Revision ID: 4b8e2d6a9c31
+Revises: 7a3d5f9b1e26
+Create Date: 2026-10-17 19:12:05.884213
+
+Backfill it from diary_entries.emotions afterwards with `python -m app.emotions`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '4b8e2d6a9c31'
+down_revision = '7a3d5f9b1e26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'emotions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name'),
+    )
+    op.create_table(
+        'diary_entry_emotions',
+        sa.Column('entry_id', sa.Integer(), sa.ForeignKey('diary_entries.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('emotion_id', sa.Integer(), sa.ForeignKey('emotions.id'), nullable=False),
+        sa.Column('intensity', sa.Float(), nullable=True),
+        sa.PrimaryKeyConstraint('entry_id', 'emotion_id'),
+        sqlite_with_rowid=False,
+    )
+    op.create_index(
+        'ix_diary_entry_emotions_emotion_entry', 'diary_entry_emotions', ['emotion_id', 'entry_id', 'intensity']
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_diary_entry_emotions_emotion_entry', table_name='diary_entry_emotions')
+    op.drop_table('diary_entry_emotions')
+    op.drop_table('emotions')
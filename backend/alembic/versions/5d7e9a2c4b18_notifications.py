@@ -0,0 +1,51 @@
+"""Add notification and notification settings tables
+
+Revision ID: 5d7e9a2c4b18
+Revises: 8b2e4d6f1a90
+Create Date: 2026-10-17 14:05:12.418306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '5d7e9a2c4b18'
+down_revision = '8b2e4d6f1a90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'notification_settings',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('reminder_time', sa.String(length=5), nullable=True),
+        sa.Column('email_notifications', sa.Boolean(), nullable=True),
+        sa.Column('push_notifications', sa.Boolean(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id'),
+    )
+    op.create_index(op.f('ix_notification_settings_id'), 'notification_settings', ['id'], unique=False)
+    op.create_index('ix_notification_settings_reminder_time', 'notification_settings', ['reminder_time'], unique=False)
+    op.create_table(
+        'notifications',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.Column('message', sa.String(), nullable=False),
+        sa.Column('is_read', sa.Boolean(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_notifications_id'), 'notifications', ['id'], unique=False)
+    op.create_index('ix_notifications_user_read_created', 'notifications', ['user_id', 'is_read', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_notifications_user_read_created', table_name='notifications')
+    op.drop_index(op.f('ix_notifications_id'), table_name='notifications')
+    op.drop_table('notifications')
+    op.drop_index('ix_notification_settings_reminder_time', table_name='notification_settings')
+    op.drop_index(op.f('ix_notification_settings_id'), table_name='notification_settings')
+    op.drop_table('notification_settings')
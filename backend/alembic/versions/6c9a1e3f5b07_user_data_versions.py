@@ -0,0 +1,27 @@
+"""Add per-user data versions
+
+Revision ID: 6c9a1e3f5b07
+Revises: 4b8e2d6a9c31
+Create Date: 2026-10-17 20:05:37.129604
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '6c9a1e3f5b07'
+down_revision = '4b8e2d6a9c31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'user_data_versions',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('user_data_versions')
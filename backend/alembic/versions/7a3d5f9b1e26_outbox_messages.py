@@ -0,0 +1,40 @@
+"""Add the email outbox table
+
+Revision ID: 7a3d5f9b1e26
+Revises: 2e6a8c0b4f73
+Create Date: 2026-10-17 18:02:44.310958
+
+Messages are delivered by `python -m app.outbox`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '7a3d5f9b1e26'
+down_revision = '2e6a8c0b4f73'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'outbox_messages',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('recipient', sa.String(), nullable=False),
+        sa.Column('subject', sa.String(), nullable=False),
+        sa.Column('html', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('available_at', sa.DateTime(), nullable=False),
+        sa.Column('locked_until', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_outbox_messages_status_available', 'outbox_messages', ['status', 'available_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_outbox_messages_status_available', table_name='outbox_messages')
+    op.drop_table('outbox_messages')
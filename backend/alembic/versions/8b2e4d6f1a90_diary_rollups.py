@@ -0,0 +1,61 @@
+"""Add diary mood column and daily/weekly rollup tables
+
+Revision ID: 8b2e4d6f1a90
+Revises: 3f9a1c7d2b64
+Create Date: 2026-10-17 11:40:27.902113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '8b2e4d6f1a90'
+down_revision = '3f9a1c7d2b64'
+branch_labels = None
+depends_on = None
+
+
+def _stats_columns():
+    return [
+        sa.Column('entry_count', sa.Integer(), nullable=False),
+        sa.Column('mood_count', sa.Integer(), nullable=False),
+        sa.Column('mood_sum', sa.Integer(), nullable=False),
+        sa.Column('mood_min', sa.Integer(), nullable=True),
+        sa.Column('mood_max', sa.Integer(), nullable=True),
+        sa.Column('emotion_counts', sa.JSON(), nullable=False),
+        sa.Column('emotion_intensity', sa.JSON(), nullable=False),
+        sa.Column('self_harm_count', sa.Integer(), nullable=False),
+        sa.Column('suicidal_thoughts_count', sa.Integer(), nullable=False),
+        sa.Column('stressful_events_count', sa.Integer(), nullable=False),
+        sa.Column('medications_taken_count', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+    ]
+
+
+def upgrade() -> None:
+    op.add_column('diary_entries', sa.Column('mood', sa.Integer(), nullable=True))
+    op.create_table(
+        'daily_rollups',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        *_stats_columns(),
+        sa.PrimaryKeyConstraint('user_id', 'day')
+    )
+    op.create_table(
+        'weekly_rollups',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('iso_year', sa.Integer(), nullable=False),
+        sa.Column('iso_week', sa.Integer(), nullable=False),
+        sa.Column('week_start', sa.Date(), nullable=False),
+        *_stats_columns(),
+        sa.PrimaryKeyConstraint('user_id', 'iso_year', 'iso_week')
+    )
+    op.create_index('ix_weekly_rollups_user_week_start', 'weekly_rollups', ['user_id', 'week_start'])
+    # Populate the new tables afterwards with `python -m app.rollups`.
+
+
+def downgrade() -> None:
+    op.drop_index('ix_weekly_rollups_user_week_start', table_name='weekly_rollups')
+    op.drop_table('weekly_rollups')
+    op.drop_table('daily_rollups')
+    op.drop_column('diary_entries', 'mood')
@@ -0,0 +1,32 @@
+"""Add the diary full-text search index
+
+Revision ID: 9c1f3e5a7d20
+Revises: 5d7e9a2c4b18
+Create Date: 2026-10-17 15:02:44.130587
+
+Creates an FTS5 table on SQLite or a tsvector table with a GIN index on
+PostgreSQL. Populate it afterwards with `python -m app.search`.
+"""
+from alembic import op
+
+
+revision = '9c1f3e5a7d20'
+down_revision = '5d7e9a2c4b18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(
+            "CREATE TABLE diary_search ("
+            " entry_id INTEGER PRIMARY KEY REFERENCES diary_entries(id) ON DELETE CASCADE,"
+            " terms TSVECTOR NOT NULL)"
+        )
+        op.execute("CREATE INDEX ix_diary_search_terms ON diary_search USING GIN (terms)")
+    else:
+        op.execute("CREATE VIRTUAL TABLE diary_search USING fts5(terms, tokenize='unicode61')")
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE diary_search")
@@ -0,0 +1,31 @@
+"""Add per-user unread notification counts
+
+Revision ID: a4d2f6b8c1e9
+Revises: 6c9a1e3f5b07
+Create Date: 2026-10-17 21:42:18.503117
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'a4d2f6b8c1e9'
+down_revision = '6c9a1e3f5b07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'unread_notification_counts',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('unread', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+    op.execute(
+        "INSERT INTO unread_notification_counts (user_id, unread) "
+        "SELECT user_id, COUNT(*) FROM notifications WHERE is_read = false GROUP BY user_id"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('unread_notification_counts')
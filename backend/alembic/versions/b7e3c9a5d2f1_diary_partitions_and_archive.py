@@ -0,0 +1,115 @@
+"""Partition diary_entries by month and add the diary archive
+
+Revision ID: b7e3c9a5d2f1
+Revises: a4d2f6b8c1e9
+Create Date: 2026-10-17 23:05:37.614209
+
+Creates diary_archives on every database. On PostgreSQL diary_entries is
+also rebuilt as a table partitioned by RANGE (date): one partition per month
+from the oldest entry to three months ahead, plus a default partition. The
+primary key becomes (id, date), since a partitioned table's unique keys must
+include the partition key, and the foreign keys of diary_entry_emotions and
+diary_search to diary_entries.id are dropped (bulk deletes remove those rows
+explicitly). The rows are copied once, so run it in a maintenance window.
+"""
+from datetime import date, datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'b7e3c9a5d2f1'
+down_revision = 'a4d2f6b8c1e9'
+branch_labels = None
+depends_on = None
+
+MONTHS_AHEAD = 3
+
+
+def _next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _partition(month: date) -> str:
+    return (
+        f"CREATE TABLE diary_entries_{month:%Y_%m} PARTITION OF diary_entries "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')"
+    )
+
+
+def upgrade() -> None:
+    op.create_table(
+        'diary_archives',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('month', sa.Date(), nullable=False),
+        sa.Column('entry_count', sa.Integer(), nullable=False),
+        sa.Column('first_id', sa.Integer(), nullable=False),
+        sa.Column('last_id', sa.Integer(), nullable=False),
+        sa.Column('first_date', sa.DateTime(), nullable=False),
+        sa.Column('last_date', sa.DateTime(), nullable=False),
+        sa.Column('latest', sa.JSON(), nullable=False),
+        sa.Column('emotion_totals', sa.JSON(), nullable=False),
+        sa.Column('entries', sa.LargeBinary(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('user_id', 'month'),
+    )
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute("ALTER TABLE diary_entry_emotions DROP CONSTRAINT IF EXISTS diary_entry_emotions_entry_id_fkey")
+    op.execute("ALTER TABLE diary_search DROP CONSTRAINT IF EXISTS diary_search_entry_id_fkey")
+    op.execute("UPDATE diary_entries SET date = COALESCE(created_at, now()) WHERE date IS NULL")
+    op.execute("ALTER TABLE diary_entries RENAME TO diary_entries_unpartitioned")
+    # The sequence would otherwise be dropped with the old table
+    op.execute("ALTER SEQUENCE diary_entries_id_seq OWNED BY NONE")
+    op.execute(
+        "CREATE TABLE diary_entries (LIKE diary_entries_unpartitioned INCLUDING DEFAULTS) "
+        "PARTITION BY RANGE (date)"
+    )
+
+    oldest = op.get_bind().execute(sa.text("SELECT min(date) FROM diary_entries_unpartitioned")).scalar()
+    today = datetime.now()
+    month = date((oldest or today).year, (oldest or today).month, 1)
+    last = date(today.year, today.month, 1)
+    for _ in range(MONTHS_AHEAD):
+        last = _next_month(last)
+    while month <= last:
+        op.execute(_partition(month))
+        month = _next_month(month)
+    op.execute("CREATE TABLE diary_entries_default PARTITION OF diary_entries DEFAULT")
+
+    op.execute("INSERT INTO diary_entries SELECT * FROM diary_entries_unpartitioned")
+    op.execute("DROP TABLE diary_entries_unpartitioned")
+    op.execute("ALTER SEQUENCE diary_entries_id_seq OWNED BY diary_entries.id")
+    op.execute("ALTER TABLE diary_entries ADD PRIMARY KEY (id, date)")
+    op.execute("ALTER TABLE diary_entries ADD FOREIGN KEY (user_id) REFERENCES users (id)")
+    op.create_index('ix_diary_entries_id', 'diary_entries', ['id'])
+    op.create_index('ix_diary_entries_user_date_id', 'diary_entries', ['user_id', 'date', 'id'])
+
+
+def downgrade() -> None:
+    if op.get_bind().execute(sa.text("SELECT EXISTS (SELECT 1 FROM diary_archives)")).scalar():
+        raise RuntimeError("Restore archived entries first: python -m app.archive restore")
+    op.drop_table('diary_archives')
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute("ALTER TABLE diary_entries RENAME TO diary_entries_partitioned")
+    op.execute("ALTER SEQUENCE diary_entries_id_seq OWNED BY NONE")
+    op.execute("CREATE TABLE diary_entries (LIKE diary_entries_partitioned INCLUDING DEFAULTS)")
+    op.execute("INSERT INTO diary_entries SELECT * FROM diary_entries_partitioned")
+    op.execute("DROP TABLE diary_entries_partitioned")
+    op.execute("ALTER SEQUENCE diary_entries_id_seq OWNED BY diary_entries.id")
+    op.execute("ALTER TABLE diary_entries ADD PRIMARY KEY (id)")
+    op.execute("ALTER TABLE diary_entries ALTER COLUMN date DROP NOT NULL")
+    op.execute("ALTER TABLE diary_entries ADD FOREIGN KEY (user_id) REFERENCES users (id)")
+    op.create_index('ix_diary_entries_id', 'diary_entries', ['id'])
+    op.create_index('ix_diary_entries_user_date_id', 'diary_entries', ['user_id', 'date', 'id'])
+    op.execute("DELETE FROM diary_entry_emotions WHERE entry_id NOT IN (SELECT id FROM diary_entries)")
+    op.execute("DELETE FROM diary_search WHERE entry_id NOT IN (SELECT id FROM diary_entries)")
+    op.execute(
+        "ALTER TABLE diary_entry_emotions ADD FOREIGN KEY (entry_id) REFERENCES diary_entries (id) ON DELETE CASCADE"
+    )
+    op.execute(
+        "ALTER TABLE diary_search ADD FOREIGN KEY (entry_id) REFERENCES diary_entries (id) ON DELETE CASCADE"
+    )
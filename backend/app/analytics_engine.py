@@ -0,0 +1,308 @@
+"""Vectorized emotion and behavior trends, and mood correlations.
+
+A user's daily rollups are read once into NumPy arrays (one row per day, one
+column per emotion or behavior) and every transformation after that -
+resampling to days, weeks or months, gap filling and smoothing, lagged
+correlations with mood - runs as array operations instead of Python loops
+over ORM rows.
+
+All series share the same date axis: every bucket between the first and last
+requested day is present, and buckets without entries hold None unless a
+smoothing method carries a value across them.
+"""
+from datetime import date
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from . import models
+from .rollups import BEHAVIORS
+
+RESOLUTIONS = ("day", "week", "month")
+SMOOTHING = ("none", "rolling", "ewma")
+
+# Largest factor the block-wise EWMA lets the decay weights grow by before
+# starting a new block, which keeps the cumulative sums finite.
+_MAX_SCALE = 1e100
+
+# Day pairs a correlation or conditional mean needs before it is reported
+MIN_PAIRS = 5
+
+
+class DailyColumns:
+    """Columnar copy of a user's daily rollups."""
+
+    def __init__(self, days: np.ndarray, emotions: List[str], intensity: np.ndarray,
+                 counts: np.ndarray, behaviors: np.ndarray, mood: Optional[np.ndarray] = None):
+        self.days = days              # datetime64[D], ascending
+        self.emotions = emotions
+        self.intensity = intensity    # days x emotions, summed intensity
+        self.counts = counts          # days x emotions, entries mentioning the emotion
+        self.behaviors = behaviors    # days x BEHAVIORS, entries reporting the behavior
+        # Mean mood per day, NaN on days whose entries left it blank
+        self.mood = np.full(len(days), np.nan) if mood is None else mood
+
+    @classmethod
+    def load(cls, db: Session, user_id: int, start: Optional[date] = None, end: Optional[date] = None):
+        query = db.query(
+            models.DailyRollup.day,
+            models.DailyRollup.emotion_counts,
+            models.DailyRollup.emotion_intensity,
+            models.DailyRollup.mood_sum,
+            models.DailyRollup.mood_count,
+            *(getattr(models.DailyRollup, f"{behavior}_count") for behavior in BEHAVIORS)
+        ).filter(models.DailyRollup.user_id == user_id)
+        if start:
+            query = query.filter(models.DailyRollup.day >= start)
+        if end:
+            query = query.filter(models.DailyRollup.day <= end)
+        rows = query.order_by(models.DailyRollup.day).all()
+
+        emotions = sorted({emotion for row in rows for emotion in row.emotion_counts})
+        column = {emotion: index for index, emotion in enumerate(emotions)}
+        cells = [
+            (index, column[emotion], count, row.emotion_intensity.get(emotion, 0))
+            for index, row in enumerate(rows)
+            for emotion, count in row.emotion_counts.items()
+        ]
+        intensity = np.zeros((len(rows), len(emotions)))
+        counts = np.zeros((len(rows), len(emotions)))
+        if cells:
+            row_index, column_index, cell_counts, cell_intensity = zip(*cells)
+            counts[row_index, column_index] = cell_counts
+            intensity[row_index, column_index] = cell_intensity
+
+        days = np.array([row.day for row in rows], dtype="datetime64[D]")
+        behaviors = np.array([row[5:] for row in rows], dtype=float).reshape(len(rows), len(BEHAVIORS))
+        mood_sum = np.array([row.mood_sum for row in rows], dtype=float)
+        mood_count = np.array([row.mood_count for row in rows], dtype=float)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mood = np.where(mood_count > 0, mood_sum / mood_count, np.nan)
+        return cls(days, emotions, intensity, counts, behaviors, mood)
+
+
+def _bucket_keys(days: np.ndarray, resolution: str) -> np.ndarray:
+    """Map days to an integer bucket key that is contiguous across the range."""
+    if resolution == "month":
+        return days.astype("datetime64[M]").astype(np.int64)
+    ordinal = days.astype(np.int64)
+    if resolution == "week":
+        # 1970-01-01 was a Thursday; shifting by 3 makes weeks start on Monday.
+        return (ordinal + 3) // 7
+    return ordinal
+
+
+def _bucket_labels(keys: np.ndarray, resolution: str) -> List[date]:
+    if resolution == "month":
+        labels = keys.astype("datetime64[M]").astype("datetime64[D]")
+    elif resolution == "week":
+        labels = (keys * 7 - 3).astype("datetime64[D]")
+    else:
+        labels = keys.astype("datetime64[D]")
+    return labels.astype(object).tolist()
+
+
+def _rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """Trailing mean over `window` buckets that skips missing (NaN) buckets."""
+    present = ~np.isnan(values)
+    sums = np.cumsum(np.where(present, values, 0.0), axis=0)
+    counts = np.cumsum(present, axis=0).astype(float)
+    sums[window:] = sums[window:] - sums[:-window]
+    counts[window:] = counts[window:] - counts[:-window]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def _decayed_cumsum(values: np.ndarray, decay: float) -> np.ndarray:
+    """Compute s[t] = decay * s[t-1] + values[t] along the first axis.
+
+    Within a block the recurrence is a cumulative sum of values scaled by
+    decay**-k; blocks are kept short enough that the scale stays finite and
+    the last state is carried into the next block.
+    """
+    if decay == 0:
+        return values.copy()
+    block = max(1, int(np.log(_MAX_SCALE) / -np.log(decay)))
+    out = np.empty_like(values)
+    carry = np.zeros(values.shape[1:])
+    for start in range(0, len(values), block):
+        chunk = values[start:start + block]
+        powers = decay ** np.arange(len(chunk))[:, None]
+        state = np.cumsum(chunk / powers, axis=0) * powers + carry * powers * decay
+        out[start:start + len(chunk)] = state
+        carry = state[-1]
+    return out
+
+
+def _ewma(values: np.ndarray, alpha: float) -> np.ndarray:
+    """Exponentially weighted mean that re-normalises over missing buckets."""
+    present = ~np.isnan(values)
+    decay = 1.0 - alpha
+    weighted = _decayed_cumsum(np.where(present, values, 0.0), decay)
+    weights = _decayed_cumsum(present.astype(float), decay)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(weights > 0, weighted / weights, np.nan)
+
+
+def _to_json(values: np.ndarray, missing: np.ndarray) -> list:
+    """Convert a column to a JSON-ready list with None where `missing` is set."""
+    result = values.astype(object)
+    result[missing] = None
+    return result.tolist()
+
+
+def emotion_trends(
+    columns: DailyColumns,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    resolution: str = "day",
+    smoothing: str = "none",
+    window: int = 7,
+    alpha: float = 0.3,
+) -> Dict:
+    """Resample `columns` and return aligned series ready for the API.
+
+    Returns {"dates", "emotions", "behaviors"}: one label per bucket, the
+    mean intensity of each emotion per bucket and, per behavior, whether any
+    entry in the bucket reported it.
+    """
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Unknown resolution: {resolution}")
+    if smoothing not in SMOOTHING:
+        raise ValueError(f"Unknown smoothing: {smoothing}")
+
+    if not len(columns.days) and (start is None or end is None):
+        return {"dates": [], "emotions": {}, "behaviors": {behavior: [] for behavior in BEHAVIORS}}
+
+    first = np.datetime64(start, "D") if start else columns.days[0]
+    last = np.datetime64(end, "D") if end else columns.days[-1]
+    first_key, last_key = _bucket_keys(np.array([first, last]), resolution)
+    keys = np.arange(first_key, last_key + 1)
+    slots = _bucket_keys(columns.days, resolution) - first_key
+    inside = (slots >= 0) & (slots < len(keys))
+    slots = slots[inside]
+
+    intensity = np.zeros((len(keys), len(columns.emotions)))
+    counts = np.zeros_like(intensity)
+    behaviors = np.zeros((len(keys), len(BEHAVIORS)))
+    entries = np.zeros(len(keys))
+    np.add.at(intensity, slots, columns.intensity[inside])
+    np.add.at(counts, slots, columns.counts[inside])
+    np.add.at(behaviors, slots, columns.behaviors[inside])
+    np.add.at(entries, slots, 1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(counts > 0, intensity / counts, np.nan)
+    if smoothing == "rolling":
+        means = _rolling_mean(means, window)
+    elif smoothing == "ewma":
+        means = _ewma(means, alpha)
+
+    means = means.round(4)
+    missing = np.isnan(means)
+    no_entries = entries == 0
+    return {
+        "dates": _bucket_labels(keys, resolution),
+        "emotions": {
+            emotion: _to_json(means[:, index], missing[:, index])
+            for index, emotion in enumerate(columns.emotions)
+        },
+        "behaviors": {
+            behavior: _to_json(behaviors[:, index] > 0, no_entries)
+            for index, behavior in enumerate(BEHAVIORS)
+        },
+    }
+
+
+def _measured(values: np.ndarray, support: np.ndarray) -> list:
+    """Round `values` for JSON, with None where fewer than MIN_PAIRS days back them."""
+    values = values.round(4)
+    return _to_json(values, (support < MIN_PAIRS) | ~np.isfinite(values))
+
+
+def mood_correlations(
+    columns: DailyColumns,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    max_lag: int = 3,
+) -> Dict:
+    """Relate each behavior and emotion on a day to mood that day and up to `max_lag` days later.
+
+    A factor is 1 on a day when any entry reported the behavior or mentioned
+    the emotion, and 0 on other days with entries. For each lag k it is
+    paired with the mean mood k days later, over the days where both are
+    known. Per factor and lag the result holds the Pearson correlation and
+    the mean later mood on days with and without the factor; values backed
+    by fewer than MIN_PAIRS days are None.
+
+    Every factor is known on the same days, so all the sums come from two
+    matrix products of the (lags x days) mood pairs with the (days x factors)
+    indicators.
+    """
+    lags = np.arange(max_lag + 1)
+    if not len(columns.days) and (start is None or end is None):
+        unknown = [None] * len(lags)
+        return {
+            "lags": lags.tolist(), "pairs": [0] * len(lags), "average_mood": None,
+            "behaviors": {
+                behavior: {"days": 0, "correlation": unknown, "mood_with": unknown, "mood_without": unknown}
+                for behavior in BEHAVIORS
+            },
+            "emotions": {},
+        }
+
+    first = np.datetime64(start, "D") if start else columns.days[0]
+    last = np.datetime64(end, "D") if end else columns.days[-1]
+    length = max(int((last - first).astype(np.int64)) + 1, 0)
+    slots = (columns.days - first).astype(np.int64)
+    inside = (slots >= 0) & (slots < length)
+    slots = slots[inside]
+
+    reported = np.zeros(length, dtype=bool)
+    reported[slots] = True
+    mood = np.full(length, np.nan)
+    mood[slots] = columns.mood[inside]
+    factors = np.zeros((length, len(BEHAVIORS) + len(columns.emotions)))
+    factors[slots] = np.concatenate([columns.behaviors, columns.counts], axis=1)[inside] > 0
+
+    # later[k, d] = mood on day d + k
+    ahead = np.arange(length)[None, :] + lags[:, None]
+    later = np.where(ahead < length, mood[np.minimum(ahead, max(length - 1, 0))], np.nan)
+    paired = reported[None, :] & ~np.isnan(later)
+    moods = np.where(paired, later, 0.0)
+
+    pairs = paired.sum(axis=1).astype(float)[:, None]      # lags x 1
+    with_factor = paired.astype(float) @ factors            # lags x factors
+    mood_total = moods.sum(axis=1)[:, None]
+    mood_squares = (moods * moods).sum(axis=1)[:, None]
+    mood_with_factor = moods @ factors
+    without_factor = pairs - with_factor
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_factor = with_factor / pairs
+        mean_mood = mood_total / pairs
+        covariance = mood_with_factor / pairs - mean_factor * mean_mood
+        spread = (mean_factor - mean_factor ** 2) * (mood_squares / pairs - mean_mood ** 2)
+        correlation = np.where(spread > 1e-12, covariance / np.sqrt(spread), np.nan).clip(-1, 1)
+        mood_with = mood_with_factor / with_factor
+        mood_without = (mood_total - mood_with_factor) / without_factor
+
+    def factor(index: int) -> dict:
+        return {
+            "days": int(factors[:, index].sum()),
+            "correlation": _measured(correlation[:, index], np.broadcast_to(pairs[:, 0], len(lags))),
+            "mood_with": _measured(mood_with[:, index], with_factor[:, index]),
+            "mood_without": _measured(mood_without[:, index], without_factor[:, index]),
+        }
+
+    known_mood = ~np.isnan(mood)
+    return {
+        "lags": lags.tolist(),
+        "pairs": pairs[:, 0].astype(int).tolist(),
+        "average_mood": round(float(mood[known_mood].mean()), 4) if known_mood.any() else None,
+        "behaviors": {behavior: factor(index) for index, behavior in enumerate(BEHAVIORS)},
+        "emotions": {
+            emotion: factor(len(BEHAVIORS) + index) for index, emotion in enumerate(columns.emotions)
+        },
+    }
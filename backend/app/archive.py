@@ -0,0 +1,390 @@
+"""Cold archive of old diary entries.
+
+Entries older than DIARY_ARCHIVE_AFTER_DAYS are moved out of diary_entries
+a calendar month at a time into diary_archives: one row per (user, month)
+holding the month's entries as zlib-compressed JSON, next to what readers
+need without decompressing them (entry id and date bounds, the latest date
+of each behavior, per-emotion totals). On PostgreSQL the partitions of the
+archived months are then empty and are dropped (see app.partitions).
+
+Nothing derived from the entries changes: the daily and weekly rollups that
+every analytics endpoint reads keep covering archived days, and
+rollups.rebuild() reads archived months back in. Diary readers merge
+archived rows wherever a request reaches them:
+
+* GET /diary/entries pages through hot and archived entries as one list;
+* GET /diary/entries/{id} falls back to the archive;
+* exports interleave archived entries in date order;
+* the emotion vocabulary and risk state fold in the stored summaries.
+
+Full-text search covers hot entries only; GET /search/entries says so in
+its response (archived_entries_excluded, archived_through, see coverage()).
+
+Archived months are read-only. A write to one (a new entry, editing or
+deleting an archived entry, an import) first restores the whole month to
+diary_entries; the next run archives it again. Run the job periodically,
+e.g. nightly from cron:
+
+    python -m app.archive [--user-id ID] [--older-than-days DAYS]
+    python -m app.archive restore [--user-id ID]
+"""
+import argparse
+import os
+import zlib
+from collections import defaultdict, namedtuple
+from datetime import date, datetime, time, timedelta
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import orjson
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import data_version, emotions, models, partitions, search
+from .partitions import month_start
+from .rollups import BEHAVIORS, iter_emotions
+
+load_dotenv()
+
+DIARY_ARCHIVE_AFTER_DAYS = int(os.getenv("DIARY_ARCHIVE_AFTER_DAYS", 365))
+DIARY_ARCHIVE_COMPRESSION_LEVEL = int(os.getenv("DIARY_ARCHIVE_COMPRESSION_LEVEL", 6))
+
+# Stored per entry, in this order; the user is the archive row's
+COLUMNS = (
+    "id",
+    "date",
+    "mood",
+    "emotions",
+    "medications_taken",
+    "medications_notes",
+    "self_harm",
+    "suicidal_thoughts",
+    "stressful_events",
+    "notes",
+    "created_at",
+)
+
+ArchivedEntry = namedtuple("ArchivedEntry", ("user_id",) + COLUMNS)
+
+_entries = models.DiaryEntry.__table__
+_archives = models.DiaryArchive.__table__
+_DATE = COLUMNS.index("date")
+_CREATED_AT = COLUMNS.index("created_at")
+
+
+def cutoff(older_than_days: int = DIARY_ARCHIVE_AFTER_DAYS, now: Optional[datetime] = None) -> datetime:
+    """Start of the month `older_than_days` ago: entries dated before it are archived."""
+    return datetime.combine(month_start((now or datetime.now()) - timedelta(days=older_than_days)), time.min)
+
+
+def _encode(entries: Sequence[ArchivedEntry]) -> bytes:
+    return zlib.compress(orjson.dumps([entry[1:] for entry in entries]), DIARY_ARCHIVE_COMPRESSION_LEVEL)
+
+
+def _decode(user_id: int, blob: bytes) -> List[ArchivedEntry]:
+    entries = []
+    for values in orjson.loads(zlib.decompress(blob)):
+        values[_DATE] = datetime.fromisoformat(values[_DATE])
+        if values[_CREATED_AT] is not None:
+            values[_CREATED_AT] = datetime.fromisoformat(values[_CREATED_AT])
+        entries.append(ArchivedEntry(user_id, *values))
+    return entries
+
+
+def _order(entry) -> Tuple[datetime, int]:
+    return entry.date, entry.id
+
+
+def _archive_row(user_id: int, month: date, entries: Sequence[ArchivedEntry]) -> dict:
+    latest = {"date": entries[-1].date.isoformat()}
+    totals: Dict[str, List] = defaultdict(lambda: [0, 0.0, 0])  # entries, intensity sum, rated entries
+    for entry in entries:
+        for behavior in BEHAVIORS:
+            if getattr(entry, behavior):
+                latest[behavior] = entry.date.isoformat()
+        # As in diary_entry_emotions: one per name and entry, the last intensity wins
+        reported = {str(name).strip(): intensity for name, intensity in iter_emotions(entry.emotions)}
+        for name, intensity in reported.items():
+            if name:
+                total = totals[name]
+                total[0] += 1
+                if intensity is not None:
+                    total[1] += intensity
+                    total[2] += 1
+    return {
+        "user_id": user_id,
+        "month": month,
+        "entry_count": len(entries),
+        "first_id": min(entry.id for entry in entries),
+        "last_id": max(entry.id for entry in entries),
+        "first_date": entries[0].date,
+        "last_date": entries[-1].date,
+        "latest": latest,
+        "emotion_totals": dict(totals),
+        "entries": _encode(entries),
+        "created_at": datetime.utcnow(),
+    }
+
+
+# Archiving and restoring
+
+def archive(db: Session, user_id: int, before: datetime) -> int:
+    """Move `user_id`'s entries dated before `before` into the archive, in the caller's transaction.
+
+    `before` should be the start of a month. Returns the number of entries moved.
+    """
+    db.flush()
+    connection = db.connection()
+    old = (_entries.c.user_id == user_id) & (_entries.c.date < before)
+    rows = connection.execute(
+        select(*(_entries.c[column] for column in COLUMNS)).where(old).order_by(_entries.c.date, _entries.c.id)
+    ).all()
+    if not rows:
+        return 0
+
+    months = defaultdict(list)
+    for row in rows:
+        months[month_start(row.date)].append(ArchivedEntry(user_id, *row))
+    archived = dict(connection.execute(
+        select(_archives.c.month, _archives.c.entries).where(
+            _archives.c.user_id == user_id, _archives.c.month.in_(list(months))
+        )
+    ).all())
+    if archived:
+        # Hot entries left in an archived month, e.g. written while it was being restored
+        for month, blob in archived.items():
+            months[month] = sorted(_decode(user_id, blob) + months[month], key=_order)
+        connection.execute(delete(_archives).where(
+            _archives.c.user_id == user_id, _archives.c.month.in_(list(archived))
+        ))
+    connection.execute(insert(_archives), [_archive_row(user_id, month, entries) for month, entries in months.items()])
+
+    # Bulk delete: the derived tables' ORM events do not fire
+    ids = select(_entries.c.id).where(old)
+    connection.execute(emotions.uncode(ids))
+    search.unindex(connection, ids)
+    connection.execute(delete(_entries).where(old))
+    data_version.bump(connection, user_id)
+    return len(rows)
+
+
+def restore(db: Session, user_id: int, months: Optional[Iterable[date]] = None) -> int:
+    """Move `user_id`'s archived `months` (or all of them) back into diary_entries.
+
+    Runs in the caller's transaction. Returns the number of entries restored.
+    """
+    db.flush()
+    connection = db.connection()
+    query = select(_archives.c.month, _archives.c.entries).where(_archives.c.user_id == user_id)
+    if months is not None:
+        query = query.where(_archives.c.month.in_(list(months)))
+    archived = connection.execute(query).all()
+    if not archived:
+        return 0
+
+    restored = 0
+    for month, blob in archived:
+        entries = _decode(user_id, blob)
+        connection.execute(insert(_entries), [entry._asdict() for entry in entries])
+        restored += len(entries)
+    connection.execute(delete(_archives).where(
+        _archives.c.user_id == user_id, _archives.c.month.in_([month for month, _ in archived])
+    ))
+    emotions.reindex(db, user_id)
+    search.reindex(db, user_id)
+    data_version.bump(connection, user_id)
+    return restored
+
+
+def restore_dates(db: Session, user_id: int, dates: Iterable[Optional[datetime]]) -> int:
+    """Restore the archived months of `user_id` containing any of `dates`, before writing to them.
+
+    One primary key probe when none is archived. Returns the number of entries restored.
+    """
+    months = {month_start(value) for value in dates if value is not None}
+    if not months:
+        return 0
+    archived = db.scalars(
+        select(_archives.c.month).where(_archives.c.user_id == user_id, _archives.c.month.in_(list(months)))
+    ).all()
+    return restore(db, user_id, archived) if archived else 0
+
+
+def restore_entry(db: Session, user_id: int, entry_id: int) -> bool:
+    """Restore the archived month holding `user_id`'s entry `entry_id`, if any. Returns whether it did."""
+    found = entry(db, user_id, entry_id)
+    if found is None:
+        return False
+    restore(db, user_id, [month_start(found.date)])
+    return True
+
+
+def run(db: Session, before: datetime, user_id: Optional[int] = None) -> Tuple[int, int]:
+    """Archive every user's (or `user_id`'s) entries before `before`, committing per user.
+
+    Then creates the coming partitions and drops the emptied ones. Returns
+    (entries archived, partitions dropped).
+    """
+    owners = select(_entries.c.user_id).where(_entries.c.date < before).distinct()
+    if user_id is not None:
+        owners = owners.where(_entries.c.user_id == user_id)
+    archived = 0
+    for owner in db.scalars(owners).all():
+        archived += archive(db, owner, before)
+        db.commit()
+    connection = db.connection()
+    partitions.ensure(connection)
+    dropped = partitions.drop_empty(connection, month_start(before))
+    db.commit()
+    return archived, len(dropped)
+
+
+# Reading
+
+def _months(db: Session, user_id: Optional[int], start: Optional[datetime], end: Optional[datetime], descending: bool = False):
+    query = select(_archives.c.user_id, _archives.c.month)
+    if user_id is not None:
+        query = query.where(_archives.c.user_id == user_id)
+    if start is not None:
+        query = query.where(_archives.c.last_date >= start)
+    if end is not None:
+        query = query.where(_archives.c.first_date <= end)
+    month = _archives.c.month.desc() if descending else _archives.c.month
+    return query.order_by(_archives.c.user_id, month)
+
+
+def _load(db: Session, user_id: int, month: date) -> List[ArchivedEntry]:
+    blob = db.scalar(select(_archives.c.entries).where(_archives.c.user_id == user_id, _archives.c.month == month))
+    return _decode(user_id, blob)
+
+
+def entry(db: Session, user_id: int, entry_id: int) -> Optional[ArchivedEntry]:
+    """`user_id`'s archived entry `entry_id`, or None."""
+    for month, blob in db.execute(
+        select(_archives.c.month, _archives.c.entries).where(
+            _archives.c.user_id == user_id, _archives.c.first_id <= entry_id, _archives.c.last_id >= entry_id
+        )
+    ):
+        for archived in _decode(user_id, blob):
+            if archived.id == entry_id:
+                return archived
+    return None
+
+
+def _blobs(db, user_id: Optional[int], start: Optional[datetime], end: Optional[datetime]):
+    months = _months(db, user_id, start, end).subquery()
+    return select(_archives.c.user_id, _archives.c.entries).join(
+        months, (months.c.user_id == _archives.c.user_id) & (months.c.month == _archives.c.month)
+    ).order_by(_archives.c.user_id, _archives.c.month)
+
+
+def _within(archived: ArchivedEntry, start: Optional[datetime], end: Optional[datetime]) -> bool:
+    return (start is None or archived.date >= start) and (end is None or archived.date <= end)
+
+
+def entries(db: Session, user_id: Optional[int] = None, start: Optional[datetime] = None,
+            end: Optional[datetime] = None) -> List[ArchivedEntry]:
+    """Archived entries of `user_id` (or everyone) dated `start`..`end` inclusive, oldest first per user."""
+    return [
+        archived
+        for owner, blob in db.execute(_blobs(db, user_id, start, end))
+        for archived in _decode(owner, blob)
+        if _within(archived, start, end)
+    ]
+
+
+async def stream_entries(db: AsyncSession, user_id: int, start: Optional[datetime] = None,
+                         end: Optional[datetime] = None) -> AsyncIterator[ArchivedEntry]:
+    """Like entries() for one user, but reads and decompresses one month at a time."""
+    result = await db.stream(_blobs(db, user_id, start, end).execution_options(yield_per=1))
+    async for owner, blob in result:
+        for archived in _decode(owner, blob):
+            if _within(archived, start, end):
+                yield archived
+
+
+def coverage(db: Session, user_ids: Sequence[int]) -> Tuple[int, Optional[datetime]]:
+    """How many of `user_ids`' entries are archived, and the date of the latest one."""
+    if not user_ids:
+        return 0, None
+    count, latest = db.execute(
+        select(func.coalesce(func.sum(_archives.c.entry_count), 0), func.max(_archives.c.last_date)).where(
+            _archives.c.user_id.in_(list(user_ids))
+        )
+    ).one()
+    return count, latest
+
+
+def _reports(archived: ArchivedEntry, name: str, min_intensity: Optional[float]) -> bool:
+    for reported, intensity in iter_emotions(archived.emotions):
+        if str(reported).strip() == name and (
+            min_intensity is None or (intensity is not None and intensity >= min_intensity)
+        ):
+            return True
+    return False
+
+
+def page(db: Session, user_id: int, fields: Sequence[str], count: int,
+         lower: Optional[Tuple[datetime, int]] = None, upper: Optional[Tuple[datetime, int]] = None,
+         newest_first: bool = True, start: Optional[datetime] = None, end: Optional[datetime] = None,
+         emotion: Optional[str] = None, min_intensity: Optional[float] = None) -> list:
+    """Up to `count` archived entries for a keyset page, as rows of `fields`.
+
+    Fits pagination.keyset_page's `extra`: entries strictly between the
+    (date, id) positions `lower` and `upper`, and like the hot listing dated
+    `start`..`end` and optionally reporting `emotion`. Only the months that
+    can hold the page are decompressed.
+    """
+    first = max(filter(None, (start, lower and lower[0])), default=None)
+    last = min(filter(None, (end, upper and upper[0])), default=None)
+    Row = namedtuple("ArchivedRow", fields)
+    rows = []
+    for _, month in db.execute(_months(db, user_id, first, last, descending=newest_first)).all():
+        matches = [
+            archived for archived in _load(db, user_id, month)
+            if (start is None or archived.date >= start)
+            and (end is None or archived.date <= end)
+            and (lower is None or _order(archived) > lower)
+            and (upper is None or _order(archived) < upper)
+            and (emotion is None or _reports(archived, emotion.strip(), min_intensity))
+        ]
+        matches.sort(key=_order, reverse=newest_first)
+        rows.extend(Row(*(getattr(archived, field) for field in fields)) for archived in matches)
+        # Months hold disjoint date ranges, so later months only follow these rows
+        if len(rows) >= count:
+            break
+    return rows[:count]
+
+
+def main():
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Archive old diary entries, or restore archived ones")
+    parser.add_argument("command", nargs="?", choices=("archive", "restore"), default="archive")
+    parser.add_argument("--user-id", type=int, default=None, help="only this user's entries")
+    parser.add_argument("--older-than-days", type=int, default=DIARY_ARCHIVE_AFTER_DAYS,
+                        help="archive the months that ended at least this many days ago")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.command == "restore":
+            owners = [args.user_id] if args.user_id is not None else db.scalars(
+                select(_archives.c.user_id).distinct()
+            ).all()
+            restored = 0
+            for owner in owners:
+                restored += restore(db, owner)
+                db.commit()
+            print(f"Restored {restored} entries")
+        else:
+            before = cutoff(args.older_than_days)
+            archived, dropped = run(db, before, args.user_id)
+            print(f"Archived {archived} entries dated before {before.date()}, dropped {dropped} empty partitions")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
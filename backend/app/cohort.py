@@ -0,0 +1,250 @@
+"""Metrics for a therapist's whole roster, one row per patient.
+
+Everything comes from the daily rollups in two queries, whatever the roster
+size:
+
+* a grouped aggregate per patient: entries, days with entries, mean mood,
+  medication adherence and stressful event rates, last entry day;
+* the per-day series (day, mean mood, stressful events, medication) of every
+  patient, from which statistics that SQL expresses poorly are computed with
+  NumPy for all patients at once: mood trend and volatility, the longest
+  gap between entries, the next-day mood change after stressful days and
+  the same-day correlation between medication and mood.
+
+The series statistics can run on a process pool (COHORT_PROCESSES > 0) in
+chunks of COHORT_CHUNK_SIZE patients, for very large rosters or long
+windows; the pool is started on first use.
+"""
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from multiprocessing import get_context
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from . import models
+
+load_dotenv()
+
+# Processes computing series statistics; 0 computes them in the request
+COHORT_PROCESSES = int(os.getenv("COHORT_PROCESSES", 0))
+COHORT_CHUNK_SIZE = int(os.getenv("COHORT_CHUNK_SIZE", 100))
+
+# Days a statistic needs before it is reported
+MIN_DAYS = 5
+
+COLUMNS = (
+    "patient_id",
+    "name",
+    "entries",
+    "days_with_entries",
+    "entry_frequency",
+    "average_mood",
+    "mood_trend",
+    "mood_volatility",
+    "adherence_rate",
+    "stressful_event_rate",
+    "stress_mood_change",
+    "adherence_mood_correlation",
+    "longest_gap_days",
+    "last_entry_day",
+)
+SERIES_STATISTICS = (
+    "mood_trend",
+    "mood_volatility",
+    "stress_mood_change",
+    "adherence_mood_correlation",
+    "longest_gap_days",
+)
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _roster(therapist_id: int):
+    return select(models.TherapistPatient.patient_id).where(
+        models.TherapistPatient.therapist_id == therapist_id
+    ).scalar_subquery()
+
+
+def load(db: Session, therapist_id: int, start: date, end: date):
+    """Read the roster's aggregates and per-day series for `start`..`end`.
+
+    Returns (aggregate rows, series rows), both ordered by patient id and
+    the series then by day.
+    """
+    days = models.DailyRollup
+    in_window = (days.user_id == models.User.id) & (days.day >= start) & (days.day <= end)
+    aggregates = db.execute(
+        select(
+            models.User.id.label("patient_id"),
+            models.User.first_name,
+            models.User.last_name,
+            func.coalesce(func.sum(days.entry_count), 0).label("entries"),
+            func.count(days.day).label("days_with_entries"),
+            func.sum(days.mood_sum).label("mood_sum"),
+            func.sum(days.mood_count).label("mood_count"),
+            func.sum(days.medications_taken_count).label("medications_taken"),
+            func.sum(days.stressful_events_count).label("stressful_events"),
+            func.max(days.day).label("last_entry_day"),
+        ).outerjoin(days, in_window).where(
+            models.User.id.in_(_roster(therapist_id))
+        ).group_by(
+            models.User.id, models.User.first_name, models.User.last_name
+        ).order_by(models.User.id)
+    ).all()
+    # Core rows: the ORM result machinery is most of the cost for this many rows
+    series = db.connection().execute(
+        select(
+            days.user_id, days.day, days.mood_sum, days.mood_count,
+            days.stressful_events_count, days.medications_taken_count,
+        ).where(
+            days.user_id.in_(_roster(therapist_id)), days.day >= start, days.day <= end
+        ).order_by(days.user_id, days.day)
+    ).all()
+    return aggregates, series
+
+
+def _per_patient(patients: int, group: np.ndarray, values: np.ndarray) -> np.ndarray:
+    return np.bincount(group, weights=values, minlength=patients)
+
+
+def series_statistics(patients: int, group: np.ndarray, day: np.ndarray, mood: np.ndarray,
+                      stressed: np.ndarray, medicated: np.ndarray) -> Dict[str, np.ndarray]:
+    """SERIES_STATISTICS for `patients` patients from their concatenated daily series.
+
+    `group` is each day's patient index (ascending), `day` its ordinal
+    (ascending within a patient), `mood` the day's mean mood (NaN if none
+    was given), `stressed` and `medicated` whether any entry reported it.
+    Returns one array per statistic, NaN where a patient has too few days.
+    """
+    rated = ~np.isnan(mood)
+    y = np.where(rated, mood, 0.0)
+    rated_days = _per_patient(patients, group, rated.astype(float))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # Least-squares slope of daily mood against the day, per week
+        x = np.where(rated, day, 0.0).astype(float)
+        mean_x = _per_patient(patients, group, x) / rated_days
+        mean_y = _per_patient(patients, group, y) / rated_days
+        centered_x = np.where(rated, x - mean_x[group], 0.0)
+        centered_y = np.where(rated, y - mean_y[group], 0.0)
+        spread_x = _per_patient(patients, group, centered_x ** 2)
+        spread_y = _per_patient(patients, group, centered_y ** 2)
+        trend = np.where(spread_x > 0, _per_patient(patients, group, centered_x * centered_y) / spread_x * 7, np.nan)
+        volatility = np.sqrt(spread_y / rated_days)
+
+        # Same-day Pearson correlation of medication and mood
+        taken = np.where(rated, medicated, 0.0).astype(float)
+        centered_taken = np.where(rated, taken - (_per_patient(patients, group, taken) / rated_days)[group], 0.0)
+        spread_taken = _per_patient(patients, group, centered_taken ** 2)
+        adherence = _per_patient(patients, group, centered_taken * centered_y) / np.sqrt(spread_taken * spread_y)
+        adherence = np.where((spread_taken > 0) & (spread_y > 1e-12), adherence, np.nan)
+
+        # Mood on the following day, after days with and without stressful events
+        follows = (group[1:] == group[:-1]) & (day[1:] == day[:-1] + 1) & rated[1:]
+        after_group, next_mood, after_stress = group[:-1][follows], y[1:][follows], stressed[:-1][follows]
+        stress_days = np.bincount(after_group, weights=after_stress.astype(float), minlength=patients)
+        calm_days = np.bincount(after_group, weights=(~after_stress).astype(float), minlength=patients)
+        after_stress_mood = np.bincount(after_group, weights=np.where(after_stress, next_mood, 0.0), minlength=patients) / stress_days
+        after_calm_mood = np.bincount(after_group, weights=np.where(after_stress, 0.0, next_mood), minlength=patients) / calm_days
+        stress_change = np.where(
+            (stress_days >= MIN_DAYS) & (calm_days >= MIN_DAYS), after_stress_mood - after_calm_mood, np.nan
+        )
+
+    # Days without entries between two consecutive days with entries
+    same_patient = group[1:] == group[:-1]
+    longest_gap = np.zeros(patients)
+    np.maximum.at(longest_gap, group[1:][same_patient], (day[1:] - day[:-1] - 1)[same_patient])
+
+    enough = rated_days >= MIN_DAYS
+    return {
+        "mood_trend": np.where(enough, trend, np.nan),
+        "mood_volatility": np.where(enough, volatility, np.nan),
+        "stress_mood_change": stress_change,
+        "adherence_mood_correlation": np.where(enough, adherence, np.nan),
+        "longest_gap_days": longest_gap,
+    }
+
+
+def _series_arrays(series, patient_ids: List[int]):
+    if not series:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0), empty.astype(bool), empty.astype(bool)
+    user_ids, days, mood_sum, mood_count, stressful, medicated = zip(*series)
+    group = np.searchsorted(np.asarray(patient_ids), np.asarray(user_ids))
+    # Far faster than converting the date objects with np.array(..., "datetime64[D]")
+    day = np.fromiter((value.toordinal() for value in days), dtype=np.int64, count=len(days))
+    mood_count = np.asarray(mood_count, dtype=float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mood = np.where(mood_count > 0, np.asarray(mood_sum, dtype=float) / mood_count, np.nan)
+    return group, day, mood, np.asarray(stressful) > 0, np.asarray(medicated) > 0
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: forking a process that runs an event loop and pooled connections is unsafe
+        _pool = ProcessPoolExecutor(max_workers=COHORT_PROCESSES, mp_context=get_context("spawn"))
+    return _pool
+
+
+async def compute_statistics(series, patient_ids: List[int]) -> Dict[str, np.ndarray]:
+    """series_statistics for `patient_ids`, on the process pool when enabled and worthwhile."""
+    group, day, mood, stressed, medicated = _series_arrays(series, patient_ids)
+    patients = len(patient_ids)
+    if COHORT_PROCESSES <= 0 or patients <= COHORT_CHUNK_SIZE:
+        return series_statistics(patients, group, day, mood, stressed, medicated)
+
+    loop = asyncio.get_running_loop()
+    bounds = list(range(0, patients, COHORT_CHUNK_SIZE))
+    # Rows of patients [first, first + size) are contiguous since the series are ordered by patient
+    cuts = np.searchsorted(group, bounds + [patients])
+    chunks = await asyncio.gather(*(
+        loop.run_in_executor(
+            _get_pool(), series_statistics, min(COHORT_CHUNK_SIZE, patients - first),
+            group[low:high] - first, day[low:high], mood[low:high], stressed[low:high], medicated[low:high],
+        )
+        for first, low, high in zip(bounds, cuts[:-1], cuts[1:])
+    ))
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in SERIES_STATISTICS}
+
+
+def _ratio(numerator, denominator) -> Optional[float]:
+    return round(numerator / denominator, 4) if denominator else None
+
+
+def _value(number) -> Optional[float]:
+    return None if np.isnan(number) else round(float(number), 4)
+
+
+def table(aggregates, statistics: Dict[str, np.ndarray], window_days: int) -> List[dict]:
+    """One row per patient (in `aggregates` order) with every column in COLUMNS."""
+    rows = []
+    for position, row in enumerate(aggregates):
+        series = {name: _value(statistics[name][position]) for name in SERIES_STATISTICS}
+        series["longest_gap_days"] = int(statistics["longest_gap_days"][position]) if row.days_with_entries else None
+        rows.append({
+            "patient_id": row.patient_id,
+            "name": f"{row.first_name or ''} {row.last_name or ''}".strip(),
+            "entries": row.entries,
+            "days_with_entries": row.days_with_entries,
+            "entry_frequency": _ratio(row.days_with_entries, window_days),
+            "average_mood": _ratio(row.mood_sum, row.mood_count),
+            "adherence_rate": _ratio(row.medications_taken, row.entries),
+            "stressful_event_rate": _ratio(row.stressful_events, row.entries),
+            "last_entry_day": row.last_entry_day,
+            **series,
+        })
+    return rows
+
+
+def sort_rows(rows: List[dict], column: str, descending: bool = False) -> List[dict]:
+    """Sort by `column`, keeping rows without a value last in either direction."""
+    known = [row for row in rows if row[column] is not None]
+    unknown = [row for row in rows if row[column] is None]
+    return sorted(known, key=lambda row: row[column], reverse=descending) + unknown
@@ -1,22 +1,59 @@
+from sqlalchemy import and_, func
 from sqlalchemy.orm import Session
-from . import models, schemas
+from typing import Optional
+from . import archive, models, risk, rollups, schemas
+from .pagination import DEFAULT_PAGE_SIZE, keyset_page
 from datetime import datetime
 
-def get_diary_entries(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.DiaryEntry).filter(models.DiaryEntry.user_id == user_id)\
-        .order_by(models.DiaryEntry.created_at.desc())\
-        .offset(skip).limit(limit).all()
+def get_diary_entries(db: Session, user_id: int, limit: int = DEFAULT_PAGE_SIZE,
+                      after: Optional[str] = None, before: Optional[str] = None):
+    """Return (entries, next_cursor, prev_cursor), newest entry first."""
+    query = db.query(models.DiaryEntry).filter(models.DiaryEntry.user_id == user_id)
+
+    def archived(lower, upper, count, newest_first):
+        return archive.page(db, user_id, list(schemas.DiaryEntry.model_fields), count, lower, upper, newest_first)
+
+    return keyset_page(query, models.DiaryEntry.date, models.DiaryEntry.id,
+                       limit=limit, after=after, before=before, extra=archived)
+
+def get_patients_summary(db: Session, therapist_id: int, since: datetime):
+    """Summarize the therapist's whole roster from materialized state.
+
+    Returns one row per patient with the latest entry date, the number of
+    entries on days since `since` (from the daily rollups) and the patient's
+    stored risk state. No diary entries are read.
+    """
+    risk_state = models.PatientRiskState
+    recent_days = models.DailyRollup
+    return db.query(
+        models.User.id.label("patient_id"),
+        models.User.first_name,
+        models.User.last_name,
+        risk_state.last_entry_date,
+        risk_state.last_self_harm_at,
+        risk_state.last_suicidal_thoughts_at,
+        risk_state.needs_attention_until,
+        func.coalesce(func.sum(recent_days.entry_count), 0).label("entries_last_week"),
+    ).join(
+        models.TherapistPatient, models.TherapistPatient.patient_id == models.User.id
+    ).outerjoin(
+        risk_state, risk_state.user_id == models.User.id
+    ).outerjoin(
+        recent_days, and_(recent_days.user_id == models.User.id, recent_days.day >= since.date())
+    ).filter(
+        models.TherapistPatient.therapist_id == therapist_id
+    ).group_by(
+        models.User.id, models.User.first_name, models.User.last_name,
+        risk_state.last_entry_date, risk_state.last_self_harm_at,
+        risk_state.last_suicidal_thoughts_at, risk_state.needs_attention_until
+    ).all()
 
 def create_diary_entry(db: Session, diary_entry: schemas.DiaryEntryCreate, user_id: int):
-    db_diary_entry = models.DiaryEntry(
-        user_id=user_id,
-        mood=diary_entry.mood,
-        content=diary_entry.content,
-        activities=diary_entry.activities,
-        thoughts=diary_entry.thoughts,
-        emotions=diary_entry.emotions
-    )
+    archive.restore_dates(db, user_id, [diary_entry.date])
+    db_diary_entry = models.DiaryEntry(**diary_entry.dict(), user_id=user_id)
     db.add(db_diary_entry)
+    rollups.refresh_entry(db, db_diary_entry)
+    risk.evaluate(db, user_id)
     db.commit()
     db.refresh(db_diary_entry)
     return db_diary_entry
@@ -27,8 +64,12 @@ def get_diary_entry(db: Session, diary_entry_id: int):
 def update_diary_entry(db: Session, diary_entry_id: int, diary_entry: schemas.DiaryEntryCreate):
     db_diary_entry = db.query(models.DiaryEntry).filter(models.DiaryEntry.id == diary_entry_id).first()
     if db_diary_entry:
+        archive.restore_dates(db, db_diary_entry.user_id, [diary_entry.date])
+        previous_date = db_diary_entry.date
         for key, value in diary_entry.dict().items():
             setattr(db_diary_entry, key, value)
+        rollups.refresh_entry(db, db_diary_entry, previous_date=previous_date)
+        risk.evaluate(db, db_diary_entry.user_id)
         db.commit()
         db.refresh(db_diary_entry)
     return db_diary_entry
@@ -37,6 +78,8 @@ def delete_diary_entry(db: Session, diary_entry_id: int):
     db_diary_entry = db.query(models.DiaryEntry).filter(models.DiaryEntry.id == diary_entry_id).first()
     if db_diary_entry:
         db.delete(db_diary_entry)
+        rollups.refresh_entry(db, db_diary_entry)
+        risk.evaluate(db, db_diary_entry.user_id)
         db.commit()
         return True
     return False
@@ -0,0 +1,159 @@
+"""Per-user data versions, ETags and a versioned response cache.
+
+Every change to a user's diary bumps their row in user_data_versions in the
+same transaction. ORM inserts, updates and deletes of DiaryEntry do so
+through mapper events; bulk Core statements must call bump() themselves.
+
+Read endpoints whose output depends only on one user's diary and the request
+parameters answer through respond(): it reads the version (one primary key
+lookup), derives a strong ETag from (user, version, URL), and returns 304
+when the client's If-None-Match already matches, before any other query
+runs. Otherwise the rendered body is served from, or stored in, an
+in-process cache keyed by the same triple. A new version makes old keys
+unreachable, so nothing is invalidated; stale bodies are simply evicted
+least-recently-used once the cache holds RESPONSE_CACHE_MAX_BYTES.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple, Union
+
+from dotenv import load_dotenv
+from fastapi import Request, Response
+from sqlalchemy import event, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models, serialization
+
+load_dotenv()
+
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 64 * 2**20))
+
+_versions = models.UserDataVersion.__table__
+
+
+def bump(db: Union[Session, Connection], user_id: int):
+    """Increment `user_id`'s data version in the caller's transaction."""
+    dialect = db.get_bind().dialect if isinstance(db, Session) else db.dialect
+    insert = postgresql_insert if dialect.name == "postgresql" else sqlite_insert
+    statement = insert(_versions).values(user_id=user_id, version=1)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[_versions.c.user_id], set_={"version": _versions.c.version + 1}
+    ))
+
+
+def current(db: Session, user_id: int) -> int:
+    return db.scalar(select(_versions.c.version).where(_versions.c.user_id == user_id)) or 0
+
+
+@event.listens_for(models.DiaryEntry, "after_insert")
+@event.listens_for(models.DiaryEntry, "after_update")
+@event.listens_for(models.DiaryEntry, "after_delete")
+def _bump_changed_entry(mapper, connection, target):
+    bump(connection, target.user_id)
+
+
+class ResponseCache:
+    """LRU cache of rendered response bodies bounded by their total size."""
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()  # key -> (body, headers)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Tuple[bytes, Dict[str, str]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Hashable, body: bytes, headers: Dict[str, str]):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[0])
+            self._entries[key] = (body, headers)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+response_cache = ResponseCache()
+
+
+def _resource(request: Request) -> str:
+    """The request path with its query parameters in a canonical order."""
+    query = "&".join(sorted(f"{key}={value}" for key, value in request.query_params.multi_items()))
+    return f"{request.url.path}?{query}"
+
+
+def etag(user_id: int, version: int, resource: str) -> str:
+    return f'"{user_id}-{version}-{hashlib.sha256(resource.encode()).hexdigest()[:16]}"'
+
+
+def _matches(if_none_match: Optional[str], tag: str) -> bool:
+    if not if_none_match:
+        return False
+    # If-None-Match uses the weak comparison, so a W/ prefix doesn't matter
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == tag for candidate in candidates)
+
+
+async def respond(
+    request: Request,
+    db: AsyncSession,
+    user_id: int,
+    build: Callable[[], Awaitable[Tuple[object, Dict[str, str]]]],
+) -> Response:
+    """Serve a response that depends only on `user_id`'s data and the request URL.
+
+    `build` runs only on a cache miss and returns (content, extra headers);
+    the content is encoded with serialization.dumps.
+    """
+    version = await db.run_sync(current, user_id)
+    resource = _resource(request)
+    tag = etag(user_id, version, resource)
+    headers = {"ETag": tag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+    if _matches(request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers=headers)
+
+    key = (user_id, version, resource)
+    cached = response_cache.get(key)
+    if cached is None:
+        content, extra = await build()
+        cached = (serialization.dumps(content), extra)
+        response_cache.put(key, *cached)
+    body, extra = cached
+    return Response(body, media_type="application/json", headers={**extra, **headers})
@@ -1,11 +1,43 @@
-from datetime import datetime
+"""Demo users and synthetic datasets.
+
+seed_database adds the two demo accounts. seed_dataset bulk-loads a
+reproducible dataset of therapists, their patients and `days` of diary
+history per patient, then rebuilds the derived tables (rollups, search,
+normalized emotions, risk states) the same way an import does, so every
+router sees consistent data. Seeded accounts share one password.
+
+    python -m app.db.seed --demo
+    python -m app.db.seed --therapists 5 --patients 100 --days 180
+"""
+import argparse
+import random
+from datetime import date, datetime, time, timedelta
+from typing import Dict, NamedTuple, Optional
+
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
-from passlib.context import CryptContext
-from app.models.user import User, UserType
-from app.models.patient import Patient
-from app.models.therapist import Therapist
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app import data_version, emotions, models, risk, rollups, search
+from app.auth import pwd_context
+from app.models import Patient, Therapist, User, UserType
+
+DATASET_PASSWORD = "Bench123!"
+BATCH_SIZE = 5000
+
+EMOTIONS = [
+    "שמחה", "עצב", "כעס", "פחד", "חרדה", "בושה", "אשמה", "בדידות", "תסכול", "רוגע",
+    "הקלה", "גאווה", "תקווה", "ייאוש", "בלבול", "עייפות", "התרגשות", "אכזבה",
+]
+NOTES = [
+    "היה יום עמוס בעבודה ולא הספקתי לנוח",
+    "נפגשתי עם חברים וזה שיפר את מצב הרוח",
+    "הייתה לי שיחה קשה עם המשפחה",
+    "ישנתי רע בלילה והרגשתי עייפות כל היום",
+    "יצאתי להליכה ארוכה בבוקר",
+    "תרגלתי נשימות כשהרגשתי את החרדה עולה",
+]
+REMINDER_TIMES = ["08:00", "12:00", "20:00", "21:30"]
+
 
 def seed_database(db: Session):
     # Create a demo patient
@@ -51,3 +83,159 @@ def seed_database(db: Session):
     db.add(therapist_profile)
 
     db.commit()
+
+
+class Dataset(NamedTuple):
+    """Ids and emails of the seeded accounts, which all use `password`."""
+    therapists: Dict[int, str]
+    patients: Dict[int, str]
+    therapist_of: Dict[int, int]  # patient id -> therapist id
+    entries: int
+    password: str
+
+
+def _insert_users(db: Session, user_type: UserType, emails, hashed_password: str) -> Dict[int, str]:
+    now = datetime.utcnow()
+    rows = db.execute(
+        insert(models.User).returning(models.User.id, models.User.email, sort_by_parameter_order=True),
+        [
+            {
+                "email": email,
+                "hashed_password": hashed_password,
+                "first_name": "מטפל" if user_type == UserType.THERAPIST else "מטופל",
+                "last_name": str(number),
+                "user_type": user_type,
+                "created_at": now,
+            }
+            for number, email in enumerate(emails, 1)
+        ]
+    ).all()
+    return dict(rows)
+
+
+def _entry(rng: random.Random, user_id: int, day: date) -> dict:
+    picked = rng.sample(EMOTIONS, rng.randint(1, 4))
+    return {
+        "user_id": user_id,
+        "date": datetime.combine(day, time(21, 0)),
+        "mood": rng.randint(1, 10),
+        "emotions": {name: rng.randint(1, 10) for name in picked},
+        "medications_taken": rng.random() < 0.8,
+        "medications_notes": None,
+        "self_harm": rng.random() < 0.005,
+        "suicidal_thoughts": rng.random() < 0.003,
+        "stressful_events": rng.random() < 0.2,
+        "notes": ". ".join(rng.sample(NOTES, rng.randint(1, 3))),
+        "created_at": datetime.combine(day, time(21, 5)),
+    }
+
+
+def seed_dataset(
+    db: Session,
+    therapists: int = 5,
+    patients: int = 100,
+    days: int = 180,
+    password: str = DATASET_PASSWORD,
+    seed: int = 0,
+    end: Optional[date] = None,
+    prefix: str = "bench",
+) -> Dataset:
+    """Bulk-load `therapists` and `patients` with `days` of diary history ending on `end` (yesterday).
+
+    Patients are assigned to therapists round robin. About one day in seven
+    has no entry, as in a real diary. Commits.
+    """
+    rng = random.Random(seed)
+    end = end or date.today() - timedelta(days=1)
+    hashed_password = pwd_context.hash(password)
+
+    therapist_ids = _insert_users(
+        db, UserType.THERAPIST, [f"{prefix}-therapist{i}@example.com" for i in range(1, therapists + 1)], hashed_password
+    )
+    patient_ids = _insert_users(
+        db, UserType.PATIENT, [f"{prefix}-patient{i}@example.com" for i in range(1, patients + 1)], hashed_password
+    )
+    db.execute(insert(models.Therapist), [
+        {"user_id": user_id, "license_number": str(10000 + user_id), "years_of_experience": rng.randint(1, 30)}
+        for user_id in therapist_ids
+    ])
+    db.execute(insert(models.Patient), [
+        {"user_id": user_id, "date_of_birth": datetime(rng.randint(1950, 2005), rng.randint(1, 12), 1)}
+        for user_id in patient_ids
+    ])
+    therapist_list = list(therapist_ids)
+    therapist_of = {
+        patient_id: therapist_list[number % len(therapist_list)]
+        for number, patient_id in enumerate(patient_ids)
+    } if therapist_list else {}
+    if therapist_of:
+        # As elsewhere in the app, relationships reference the therapist's user id
+        db.execute(insert(models.TherapistPatient), [
+            {"therapist_id": therapist_id, "patient_id": patient_id}
+            for patient_id, therapist_id in therapist_of.items()
+        ])
+    if patient_ids:
+        db.execute(insert(models.NotificationSettings), [
+            {"user_id": user_id, "reminder_time": rng.choice(REMINDER_TIMES), "email_notifications": True}
+            for user_id in patient_ids
+        ])
+
+    entries = 0
+    batch = []
+    for user_id in patient_ids:
+        for offset in range(days - 1, -1, -1):
+            if rng.random() < 1 / 7:
+                continue
+            batch.append(_entry(rng, user_id, end - timedelta(days=offset)))
+            if len(batch) >= BATCH_SIZE:
+                db.execute(insert(models.DiaryEntry), batch)
+                entries += len(batch)
+                batch = []
+    if batch:
+        db.execute(insert(models.DiaryEntry), batch)
+        entries += len(batch)
+
+    # Bulk inserts bypass the ORM events that keep these in sync; only the
+    # seeded patients' rows are rebuilt, whatever else the database holds
+    rollups.rebuild(db, user_ids=patient_ids)
+    search.reindex(db, user_ids=patient_ids)
+    emotions.reindex(db, user_ids=patient_ids)
+    for user_id in patient_ids:
+        data_version.bump(db, user_id)
+    db.commit()
+    risk.backfill(db, patient_ids)
+    return Dataset(therapist_ids, patient_ids, therapist_of, entries, password)
+
+
+def main():
+    from app.database import Base, SessionLocal, engine
+
+    parser = argparse.ArgumentParser(description="Seed the database with demo users or a synthetic dataset")
+    parser.add_argument("--demo", action="store_true", help="add the demo patient and therapist accounts")
+    parser.add_argument("--therapists", type=int, default=0)
+    parser.add_argument("--patients", type=int, default=0)
+    parser.add_argument("--days", type=int, default=180, help="days of diary history per patient")
+    parser.add_argument("--seed", type=int, default=0, help="random seed, for reproducible datasets")
+    parser.add_argument("--prefix", default="bench", help="email prefix of the seeded accounts")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        if args.demo:
+            seed_database(db)
+            print("Added the demo accounts")
+        if args.therapists or args.patients:
+            dataset = seed_dataset(
+                db, args.therapists, args.patients, args.days, seed=args.seed, prefix=args.prefix
+            )
+            print(
+                f"Seeded {len(dataset.therapists)} therapists, {len(dataset.patients)} patients and "
+                f"{dataset.entries} diary entries (password {dataset.password})"
+            )
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
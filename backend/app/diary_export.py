@@ -0,0 +1,152 @@
+"""Streaming NDJSON/CSV export of a user's diary.
+
+Entries are read through a server-side cursor in partitions of
+EXPORT_BATCH_SIZE rows and each partition is encoded and yielded as one
+chunk, so memory use depends on the batch size rather than the length of
+the history. Archived entries (app.archive) are read a month at a time
+from a second cursor and interleaved with the partitions in date order, in
+chunks of at most EXPORT_BATCH_SIZE archived rows. The
+columns match schemas.DiaryEntryImportRow (plus id and
+created_at), so an export can be fed back to POST /diary/entries/import.
+"""
+import csv
+import heapq
+import io
+import json
+import os
+from datetime import date, datetime
+from typing import AsyncIterator, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import select
+
+from . import archive, models
+from .database import AsyncSessionLocal
+
+load_dotenv()
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+COLUMNS = (
+    "id",
+    "date",
+    "mood",
+    "emotions",
+    "medications_taken",
+    "medications_notes",
+    "self_harm",
+    "suicidal_thoughts",
+    "stressful_events",
+    "notes",
+    "created_at",
+)
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _ndjson(rows) -> str:
+    return "".join(
+        json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False, default=_json_default) + "\n"
+        for row in rows
+    )
+
+
+def _position(row):
+    return row[1], row[0]  # (date, id)
+
+
+async def _archived(db, user_id: int, start: Optional[datetime], end: Optional[datetime]) -> AsyncIterator[tuple]:
+    async for entry in archive.stream_entries(db, user_id, start, end):
+        yield tuple(getattr(entry, column) for column in COLUMNS)
+
+
+async def _next(rows: AsyncIterator):
+    try:
+        return await rows.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+def _csv_cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return value
+
+
+def _csv(rows) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for row in rows:
+        values = dict(zip(COLUMNS, row))
+        values["emotions"] = json.dumps(values["emotions"] or {}, ensure_ascii=False)
+        for column in ("date", "created_at"):
+            if values[column] is not None:
+                values[column] = values[column].isoformat()
+        writer.writerow([_csv_cell(value) for value in values.values()])
+    return buffer.getvalue()
+
+
+async def export_entries(
+    user_id: int,
+    format: str = "ndjson",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> AsyncIterator[bytes]:
+    """Yield `user_id`'s entries, oldest first, as encoded chunks.
+
+    Opens its own session: the generator outlives the request handler that
+    builds the StreamingResponse.
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown export format: {format}")
+    encode = _csv if format == "csv" else _ndjson
+    if format == "csv":
+        yield (",".join(COLUMNS) + "\n").encode()
+
+    query = select(*(getattr(models.DiaryEntry, column) for column in COLUMNS)).where(
+        models.DiaryEntry.user_id == user_id
+    )
+    if start:
+        query = query.where(models.DiaryEntry.date >= start)
+    if end:
+        query = query.where(models.DiaryEntry.date <= end)
+    query = query.order_by(models.DiaryEntry.date, models.DiaryEntry.id).execution_options(yield_per=batch_size)
+
+    async with AsyncSessionLocal() as db:
+        archived = _archived(db, user_id, start, end)
+        pending = await _next(archived)
+
+        async def older_than(last) -> List[tuple]:
+            """Up to `batch_size` archived rows before position `last` (all remaining if None)."""
+            nonlocal pending
+            rows = []
+            while pending is not None and len(rows) < batch_size and (last is None or _position(pending) < last):
+                rows.append(pending)
+                pending = await _next(archived)
+            return rows
+
+        result = await db.stream(query)
+        async for partition in result.partitions():
+            # Archived rows up to the partition's last position go out with it,
+            # each chunk merged with the partition's rows that precede its end
+            last = _position(partition[-1])
+            merged = 0
+            while rows := await older_than(last):
+                upto = merged
+                while upto < len(partition) and _position(partition[upto]) < _position(rows[-1]):
+                    upto += 1
+                yield encode(heapq.merge(partition[merged:upto], rows, key=_position)).encode()
+                merged = upto
+            if merged < len(partition):
+                yield encode(partition[merged:]).encode()
+        while rows := await older_than(None):
+            yield encode(rows).encode()
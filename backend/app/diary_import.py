@@ -0,0 +1,241 @@
+"""Streaming bulk import of historical diary entries.
+
+The upload is read chunk by chunk and split into NDJSON lines or CSV
+records as it arrives, each row is validated against
+schemas.DiaryEntryImportRow, and valid rows are written in batches of
+IMPORT_BATCH_SIZE with a single executemany INSERT per batch. Only the
+current batch, the per-row report and the set of dates seen so far are held
+in memory.
+
+The import runs in one transaction: rows that fail validation are reported
+and left out, and with the "fail" conflict policy any clash with an existing
+entry for the same date rolls the whole import back.
+"""
+import codecs
+import csv
+import json
+import os
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from pydantic import ValidationError
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import archive, data_version, emotions, models, risk, rollups, schemas, search
+
+load_dotenv()
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 500))
+# Upper bound on rows listed in the report; counters stay exact beyond it.
+IMPORT_MAX_REPORTED_ROWS = int(os.getenv("IMPORT_MAX_REPORTED_ROWS", 1000))
+
+CONFLICT_POLICIES = ("skip", "overwrite", "fail")
+FORMATS = ("ndjson", "csv")
+
+
+class ImportConflict(Exception):
+    """Raised under the "fail" policy when a row's date already has an entry."""
+
+    def __init__(self, row: int, date: datetime):
+        super().__init__(f"Entry already exists for this date (row {row}, {date.isoformat()})")
+        self.row = row
+        self.date = date
+
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decode a byte stream as UTF-8 and yield it line by line."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+async def ndjson_rows(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, object]]:
+    """Yield (line number, parsed object or error message) for each non-blank line."""
+    number = 0
+    async for line in _lines(chunks):
+        number += 1
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except json.JSONDecodeError as error:
+            yield number, f"Invalid JSON: {error.msg}"
+
+
+async def csv_rows(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, object]]:
+    """Yield (record number, dict or error message) for each CSV record after the header.
+
+    Empty cells are dropped so the schema defaults apply. A quoted field may
+    span lines: physical lines are joined until the quotes balance.
+    """
+    header = None
+    number = 0
+    record = ""
+    async for line in _lines(chunks):
+        record = f"{record}\n{line}" if record else line
+        if record.count('"') % 2:
+            continue
+        text, record = record.rstrip("\r"), ""
+        if not text.strip():
+            continue
+        cells = next(csv.reader([text]))
+        if header is None:
+            header = [cell.strip() for cell in cells]
+            continue
+        number += 1
+        if len(cells) != len(header):
+            yield number, f"Expected {len(header)} columns, got {len(cells)}"
+            continue
+        yield number, {key: value for key, value in zip(header, cells) if value != ""}
+    if record:
+        yield number + 1, "Unterminated quoted field"
+
+
+class DiaryImporter:
+    """Validates rows and writes them to `user_id`'s diary in batches."""
+
+    def __init__(self, db: AsyncSession, user_id: int, on_conflict: str = "skip",
+                 batch_size: int = IMPORT_BATCH_SIZE):
+        if on_conflict not in CONFLICT_POLICIES:
+            raise ValueError(f"Unknown conflict policy: {on_conflict}")
+        self.db = db
+        self.user_id = user_id
+        self.on_conflict = on_conflict
+        self.batch_size = batch_size
+        self.batch: Dict[datetime, Tuple[int, dict]] = {}
+        self.seen = set()
+        self.counts = {"received": 0, "imported": 0, "overwritten": 0, "skipped": 0, "invalid": 0}
+        self.errors: List[dict] = []
+        self.conflicts: List[dict] = []
+
+    def _report(self, target: List[dict], entry: dict):
+        if len(self.errors) + len(self.conflicts) < IMPORT_MAX_REPORTED_ROWS:
+            target.append(entry)
+
+    def _conflict(self, row: int, date: datetime, action: str):
+        if self.on_conflict == "fail":
+            raise ImportConflict(row, date)
+        self.counts["skipped" if action == "skipped" else "overwritten"] += 1
+        self._report(self.conflicts, {"row": row, "date": date.isoformat(), "action": action})
+
+    async def add(self, row: int, data: object):
+        self.counts["received"] += 1
+        if isinstance(data, str):
+            self.counts["invalid"] += 1
+            self._report(self.errors, {"row": row, "errors": [data]})
+            return
+        try:
+            entry = schemas.DiaryEntryImportRow.model_validate(data)
+        except ValidationError as error:
+            self.counts["invalid"] += 1
+            self._report(self.errors, {
+                "row": row,
+                "errors": [f"{'.'.join(map(str, e['loc'])) or 'row'}: {e['msg']}" for e in error.errors()],
+            })
+            return
+
+        if entry.date in self.seen:
+            # Repeats a date from earlier in this upload
+            if self.on_conflict == "skip":
+                self._conflict(row, entry.date, "skipped")
+                return
+            self._conflict(row, entry.date, "overwritten")
+            if entry.date not in self.batch:
+                # The earlier row was already written by a previous batch
+                await self._delete_dates([entry.date])
+                self.counts["imported"] -= 1
+        self.seen.add(entry.date)
+        self.batch[entry.date] = (row, entry.model_dump())
+        if len(self.batch) >= self.batch_size:
+            await self.flush()
+
+    async def _delete_dates(self, dates):
+        await self.db.execute(emotions.uncode(
+            select(models.DiaryEntry.id).where(
+                models.DiaryEntry.user_id == self.user_id,
+                models.DiaryEntry.date.in_(dates)
+            )
+        ))
+        await self.db.execute(
+            delete(models.DiaryEntry).where(
+                models.DiaryEntry.user_id == self.user_id,
+                models.DiaryEntry.date.in_(dates)
+            ).execution_options(synchronize_session=False)
+        )
+
+    async def flush(self):
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, {}
+        # Archived months the batch writes to come back first, for the conflict check
+        await self.db.run_sync(archive.restore_dates, self.user_id, list(batch))
+        existing = set((await self.db.scalars(
+            select(models.DiaryEntry.date).where(
+                models.DiaryEntry.user_id == self.user_id,
+                models.DiaryEntry.date.in_(list(batch))
+            )
+        )).all())
+        for date in sorted(existing):
+            row, _ = batch[date]
+            if self.on_conflict == "skip":
+                self._conflict(row, date, "skipped")
+                del batch[date]
+            else:
+                self._conflict(row, date, "overwritten")
+        if existing and self.on_conflict == "overwrite":
+            await self._delete_dates(list(existing))
+        if batch:
+            await self.db.execute(
+                insert(models.DiaryEntry),
+                [dict(values, user_id=self.user_id) for _, values in batch.values()]
+            )
+            self.counts["imported"] += len(batch)
+
+    async def finish(self) -> dict:
+        """Write the last batch, rebuild the user's derived tables and risk state, and commit."""
+        await self.flush()
+        if self.counts["imported"]:
+            await self.db.run_sync(rollups.rebuild, self.user_id)
+            await self.db.run_sync(search.reindex, self.user_id)
+            await self.db.run_sync(emotions.reindex, self.user_id)
+            await self.db.run_sync(data_version.bump, self.user_id)
+            await self.db.run_sync(risk.evaluate, self.user_id)
+        await self.db.commit()
+        return self.report()
+
+    def report(self) -> dict:
+        return {**self.counts, "errors": self.errors, "conflicts": self.conflicts}
+
+
+async def import_entries(db: AsyncSession, user_id: int, chunks: AsyncIterator[bytes],
+                         format: str = "ndjson", on_conflict: str = "skip") -> dict:
+    """Import a streamed NDJSON or CSV upload into `user_id`'s diary.
+
+    Raises ImportConflict (after rolling back) under the "fail" policy.
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown import format: {format}")
+    importer = DiaryImporter(db, user_id, on_conflict)
+    rows = csv_rows(chunks) if format == "csv" else ndjson_rows(chunks)
+    try:
+        async for number, data in rows:
+            await importer.add(number, data)
+        return await importer.finish()
+    except BaseException:
+        await db.rollback()
+        raise
+
+
+def detect_format(content_type: Optional[str]) -> str:
+    if content_type and content_type.split(";", 1)[0].strip().lower() in ("text/csv", "application/csv"):
+        return "csv"
+    return "ndjson"
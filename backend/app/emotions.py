@@ -0,0 +1,230 @@
+"""Normalized, integer-coded copy of diary entry emotions.
+
+DiaryEntry.emotions stays the JSON the API reads and writes (a mapping of
+emotion to intensity, or a plain list of names). Next to it every entry's
+emotions are stored as (entry_id, emotion_id, intensity) rows in
+diary_entry_emotions, with the names coded through the `emotions`
+vocabulary table. Filtering by emotion then probes an index instead of
+parsing JSON row by row, and per-emotion aggregates are plain GROUP BYs.
+
+The table follows ORM inserts, updates and deletes of DiaryEntry. Bulk Core
+statements bypass those events: inserts must be followed by reindex(), and
+bulk deletes must remove their rows first with uncode(), since neither SQLite
+nor the partitioned diary_entries of PostgreSQL enforce the ON DELETE
+CASCADE. To backfill the table from the JSON column:
+
+    python -m app.emotions [--user-id ID]
+"""
+import argparse
+from collections import defaultdict, namedtuple
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import delete, event, func, inspect, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from . import models
+from .rollups import iter_emotions
+
+_link = models.DiaryEntryEmotion.__table__
+_vocabulary = models.Emotion.__table__
+
+EmotionUsage = namedtuple("EmotionUsage", ("name", "entries", "average_intensity"))
+
+
+def emotion_ids(connection: Connection, names: Iterable[str], known: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+    """Ids of `names`, adding new ones to the vocabulary.
+
+    `known` is a name -> id cache that is consulted and filled in.
+    """
+    known = {} if known is None else known
+    missing = {name for name in names if name not in known}
+    if missing:
+        found = dict(connection.execute(
+            select(_vocabulary.c.name, _vocabulary.c.id).where(_vocabulary.c.name.in_(missing))
+        ).all())
+        new = missing - set(found)
+        if new:
+            insert = postgresql_insert if connection.dialect.name == "postgresql" else sqlite_insert
+            # Another writer may add the same name concurrently
+            connection.execute(insert(_vocabulary).on_conflict_do_nothing(), [{"name": name} for name in new])
+            found.update(connection.execute(
+                select(_vocabulary.c.name, _vocabulary.c.id).where(_vocabulary.c.name.in_(new))
+            ).all())
+        known.update(found)
+    return known
+
+
+def _rows(connection: Connection, entries: Sequence, known: Dict[str, int]) -> List[dict]:
+    pairs = [
+        (entry.id, str(name).strip(), intensity)
+        for entry in entries
+        for name, intensity in iter_emotions(entry.emotions)
+        if str(name).strip()
+    ]
+    ids = emotion_ids(connection, {name for _, name, _ in pairs}, known)
+    # A name repeated within one entry (e.g. differing only in spaces) keeps its last intensity
+    rows = {(entry_id, ids[name]): intensity for entry_id, name, intensity in pairs}
+    return [
+        {"entry_id": entry_id, "emotion_id": emotion_id, "intensity": intensity}
+        for (entry_id, emotion_id), intensity in rows.items()
+    ]
+
+
+def _write(connection: Connection, entries: Sequence, known: Optional[Dict[str, int]] = None):
+    rows = _rows(connection, entries, {} if known is None else known)
+    if rows:
+        connection.execute(_link.insert(), rows)
+
+
+def uncode(entry_ids):
+    """DELETE statement for the rows of the entries selected by `entry_ids` (a SELECT of ids)."""
+    return delete(_link).where(_link.c.entry_id.in_(entry_ids))
+
+
+def reindex(db: Session, user_id: Optional[int] = None, batch_size: int = 1000,
+            user_ids: Optional[Sequence[int]] = None) -> int:
+    """Rebuild the rows of `user_id`'s or `user_ids`' entries (or all entries) in the caller's transaction.
+
+    Returns the number of entries processed.
+    """
+    owners = [user_id] if user_id is not None else None if user_ids is None else list(user_ids)
+    db.flush()
+    connection = db.connection()
+    entries = select(models.DiaryEntry.id, models.DiaryEntry.emotions)
+    if owners is not None:
+        entries = entries.where(models.DiaryEntry.user_id.in_(owners))
+        connection.execute(uncode(select(models.DiaryEntry.id).where(models.DiaryEntry.user_id.in_(owners))))
+    else:
+        connection.execute(delete(_link))
+
+    known: Dict[str, int] = {}
+    count = 0
+    batch = []
+    for entry in connection.execute(entries.execution_options(yield_per=batch_size)):
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            _write(connection, batch, known)
+            count += len(batch)
+            batch = []
+    _write(connection, batch, known)
+    return count + len(batch)
+
+
+@event.listens_for(models.DiaryEntry, "after_insert")
+def _code_inserted_entry(mapper, connection, target):
+    _write(connection, [target])
+
+
+@event.listens_for(models.DiaryEntry, "after_update")
+def _code_updated_entry(mapper, connection, target):
+    if inspect(target).attrs.emotions.history.has_changes():
+        connection.execute(delete(_link).where(_link.c.entry_id == target.id))
+        _write(connection, [target])
+
+
+@event.listens_for(models.DiaryEntry, "before_delete")
+def _uncode_deleted_entry(mapper, connection, target):
+    connection.execute(delete(_link).where(_link.c.entry_id == target.id))
+
+
+# Querying
+
+def has_emotion(name: str, min_intensity: Optional[float] = None):
+    """EXISTS clause matching DiaryEntry rows that report `name` (at `min_intensity` or more).
+
+    Probes the primary key once per candidate entry, so it suits listings of
+    one diary that stop after a page.
+    """
+    clause = select(_link.c.entry_id).join(_vocabulary, _vocabulary.c.id == _link.c.emotion_id).where(
+        _vocabulary.c.name == name.strip(),
+        _link.c.entry_id == models.DiaryEntry.id
+    )
+    if min_intensity is not None:
+        clause = clause.where(_link.c.intensity >= min_intensity)
+    return clause.exists()
+
+
+def entries_with_emotion(name: str, min_intensity: Optional[float] = None):
+    """SELECT of the ids of entries reporting `name`, read from the emotion index.
+
+    Use as `DiaryEntry.id.in_(...)` when the filter spans many diaries.
+    """
+    emotion_id = select(_vocabulary.c.id).where(_vocabulary.c.name == name.strip()).scalar_subquery()
+    entry_ids = select(_link.c.entry_id).where(_link.c.emotion_id == emotion_id)
+    if min_intensity is not None:
+        entry_ids = entry_ids.where(_link.c.intensity >= min_intensity)
+    return entry_ids
+
+
+def vocabulary(db: Session, user_ids: Sequence[int]) -> List[EmotionUsage]:
+    """Emotions `user_ids` have reported, as rows of (name, entries, average intensity), most used first.
+
+    Archived months (app.archive) contribute the per-emotion totals stored with them.
+    """
+    user_ids = list(user_ids)
+    totals: Dict[str, List] = defaultdict(lambda: [0, 0.0, 0])  # entries, intensity sum, rated entries
+    for name, entries, intensity, rated in db.execute(
+        select(
+            _vocabulary.c.name,
+            func.count(),
+            func.sum(_link.c.intensity),
+            func.count(_link.c.intensity)
+        ).select_from(_link).join(
+            _vocabulary, _vocabulary.c.id == _link.c.emotion_id
+        ).join(
+            models.DiaryEntry, models.DiaryEntry.id == _link.c.entry_id
+        ).where(models.DiaryEntry.user_id.in_(user_ids))
+        .group_by(_vocabulary.c.name)
+    ):
+        totals[name] = [entries, intensity or 0.0, rated]
+    for archived in db.scalars(
+        select(models.DiaryArchive.emotion_totals).where(models.DiaryArchive.user_id.in_(user_ids))
+    ):
+        for name, counts in archived.items():
+            totals[name] = [total + count for total, count in zip(totals[name], counts)]
+    usage = [
+        EmotionUsage(name, entries, intensity / rated if rated else None)
+        for name, (entries, intensity, rated) in totals.items()
+    ]
+    return sorted(usage, key=lambda row: (-row.entries, row.name))
+
+
+def daily_totals(db: Session, user_id: int, start: Optional[date] = None, end: Optional[date] = None) -> List:
+    """Per day and emotion: rows of (day, name, entries, intensity sum), in day order."""
+    day = func.date(models.DiaryEntry.date).label("day")
+    query = select(
+        day, _vocabulary.c.name, func.count().label("entries"), func.sum(_link.c.intensity).label("intensity")
+    ).select_from(_link).join(
+        _vocabulary, _vocabulary.c.id == _link.c.emotion_id
+    ).join(
+        models.DiaryEntry, models.DiaryEntry.id == _link.c.entry_id
+    ).where(models.DiaryEntry.user_id == user_id)
+    if start:
+        query = query.where(models.DiaryEntry.date >= datetime.combine(start, time.min))
+    if end:
+        query = query.where(models.DiaryEntry.date < datetime.combine(end + timedelta(days=1), time.min))
+    return db.execute(query.group_by(day, _vocabulary.c.name).order_by(day, _vocabulary.c.name)).all()
+
+
+def main():
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Backfill normalized emotions from the diary JSON column")
+    parser.add_argument("--user-id", type=int, default=None, help="only backfill this user's entries")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        coded = reindex(db, user_id=args.user_id)
+        db.commit()
+        print(f"Coded emotions of {coded} entries")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,417 @@
+"""Push notifications to connected clients.
+
+Every Notification row is published when the transaction that inserted it
+commits (nothing is sent for a rollback). ORM inserts are picked up by a
+mapper event; Core bulk inserts must pass their rows to queue(). The
+message goes to the configured broker, which hands it to the hub of every
+API process, and each hub wakes the streams its user has open
+(GET /notifications/stream).
+
+The broker is chosen by EVENT_BROKER_URL:
+
+* unset: InProcessBroker, for a single process;
+* tcp://host:port: SocketBroker, connected to a relay that fans each message
+  out to every worker. `python -m app.events relay` runs that relay; it
+  stands in for a shared broker (Redis pub/sub, Postgres LISTEN/NOTIFY),
+  which only needs another Broker subclass.
+
+Other modules broadcast to every process the same way: a message with a
+"topic" goes to the callbacks registered with Hub.listen() instead of the
+streams (app.principal_cache drops changed users from each worker's cache).
+
+Delivery is best effort: a client that misses events (a dropped connection,
+a restarted worker, a full queue) reconnects with Last-Event-ID and the
+stream replays unread notifications from the database. The API connects to
+the broker on startup; elsewhere nothing connects until the first subscribe
+or publish.
+
+    python -m app.events relay [--host 127.0.0.1] [--port 7411]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Set
+from urllib.parse import urlparse
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from . import models
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EVENT_BROKER_URL = os.getenv("EVENT_BROKER_URL", "")
+# Events buffered per open stream; a client that falls further behind is disconnected
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", 100))
+EVENT_RECONNECT_SECONDS = float(os.getenv("EVENT_RECONNECT_SECONDS", 1))
+# Messages a SocketBroker holds while its relay connection is down
+EVENT_BACKLOG_SIZE = int(os.getenv("EVENT_BACKLOG_SIZE", 10000))
+# Bytes waiting to be sent on one broker or relay connection before it is dropped as too slow
+EVENT_WRITE_BUFFER_BYTES = int(os.getenv("EVENT_WRITE_BUFFER_BYTES", 4 * 2**20))
+
+_PENDING = "pending_events"
+
+
+def notification_event(notification) -> dict:
+    """The message published for a Notification row or ORM object."""
+    return {
+        "user_id": notification.user_id,
+        "event": {
+            "id": notification.id,
+            "type": notification.type,
+            "message": notification.message,
+            "created_at": notification.created_at.isoformat() if notification.created_at else None,
+        },
+    }
+
+
+class Subscription:
+    """One open stream: a bounded buffer of events and a wakeup flag."""
+    __slots__ = ("user_id", "events", "wakeup", "overflowed")
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.events: Deque[dict] = deque()
+        self.wakeup = asyncio.Event()
+        self.overflowed = False
+
+    def push(self, event: dict):
+        if len(self.events) >= EVENT_QUEUE_SIZE:
+            self.overflowed = True
+        else:
+            self.events.append(event)
+        self.wakeup.set()
+
+    async def next_batch(self, timeout: float) -> List[dict]:
+        """Wait up to `timeout` seconds for events; returns them (empty on timeout)."""
+        if not self.events and not self.overflowed:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        self.wakeup.clear()
+        batch = list(self.events)
+        self.events.clear()
+        return batch
+
+
+class Hub:
+    """Open streams of this process, by user. Lives on the event loop that serves them."""
+
+    def __init__(self):
+        self._subscribers: Dict[int, Set[Subscription]] = {}
+        self._listeners: Dict[str, List[Callable[[dict], None]]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.delivered = 0
+        self.overflows = 0
+
+    def subscribe(self, user_id: int) -> Subscription:
+        self._loop = asyncio.get_running_loop()
+        subscription = Subscription(user_id)
+        self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.user_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.user_id]
+
+    def listen(self, topic: str, callback: Callable[[dict], None]):
+        """Call `callback` with every message published on `topic`. It may run on any thread."""
+        self._listeners.setdefault(topic, []).append(callback)
+
+    def deliver(self, message: dict):
+        """Wake `message`'s user's streams. Must run on the hub's loop."""
+        if "topic" in message:
+            for callback in self._listeners.get(message["topic"], ()):
+                callback(message)
+            return
+        for subscription in self._subscribers.get(message["user_id"], ()):
+            overflowed = subscription.overflowed
+            subscription.push(message["event"])
+            self.delivered += 1
+            self.overflows += subscription.overflowed and not overflowed
+
+    def deliver_threadsafe(self, message: dict):
+        if "topic" in message:
+            self.deliver(message)
+            return
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return  # nobody has ever subscribed in this process
+        if _running_loop() is loop:
+            self.deliver(message)
+        else:
+            loop.call_soon_threadsafe(self.deliver, message)
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._subscribers),
+            "streams": sum(len(subscribers) for subscribers in self._subscribers.values()),
+            "delivered": self.delivered,
+            "overflows": self.overflows,
+        }
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class Broker(ABC):
+    """Carries published messages to the hub of every process, the publisher's included.
+
+    publish() may be called from any thread and must not block.
+    """
+
+    def __init__(self, hub: Hub):
+        self.hub = hub
+
+    @abstractmethod
+    def publish(self, message: dict):
+        ...
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def stats(self) -> dict:
+        return {}
+
+
+class InProcessBroker(Broker):
+    def publish(self, message: dict):
+        self.hub.deliver_threadsafe(message)
+
+
+class SocketBroker(Broker):
+    """Exchanges newline-delimited JSON with a relay (see Relay) over one TCP connection.
+
+    Reconnects after EVENT_RECONNECT_SECONDS when the connection drops; up
+    to EVENT_BACKLOG_SIZE messages published meanwhile are sent once it is back.
+    A relay that falls EVENT_WRITE_BUFFER_BYTES behind is disconnected the same way.
+    """
+
+    def __init__(self, hub: Hub, host: str, port: int):
+        super().__init__(hub)
+        self.host = host
+        self.port = port
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._backlog: Deque[bytes] = deque(maxlen=EVENT_BACKLOG_SIZE)
+        self.published = 0
+        self.received = 0
+        self.reconnects = 0
+        self.overflows = 0
+
+    async def start(self):
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError as error:
+                logger.warning("Event relay %s:%s unreachable: %s", self.host, self.port, error)
+                await asyncio.sleep(EVENT_RECONNECT_SECONDS)
+                continue
+            self._writer = writer
+            while self._backlog:
+                writer.write(self._backlog.popleft())
+            try:
+                while line := await reader.readline():
+                    self.received += 1
+                    self.hub.deliver(json.loads(line))
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            finally:
+                self._writer = None
+                writer.close()
+            self.reconnects += 1
+            await asyncio.sleep(EVENT_RECONNECT_SECONDS)
+
+    def _send(self, line: bytes):
+        if self._writer is not None and self._writer.transport.get_write_buffer_size() > EVENT_WRITE_BUFFER_BYTES:
+            logger.warning("Event relay %s:%s is not keeping up; reconnecting", self.host, self.port)
+            self.overflows += 1
+            self._writer.close()
+            self._writer = None
+        if self._writer is None:
+            self._backlog.append(line)
+        else:
+            self._writer.write(line)
+
+    def publish(self, message: dict):
+        line = json.dumps(message, ensure_ascii=False).encode() + b"\n"
+        self.published += 1
+        running = _running_loop()
+        if self._task is None:
+            if running is None:
+                logger.warning("Dropped an event published outside an event loop before the broker started")
+                return
+            self._loop = running
+            self._task = running.create_task(self._run())
+        if running is self._loop:
+            self._send(line)
+        else:
+            self._loop.call_soon_threadsafe(self._send, line)
+
+    def stats(self) -> dict:
+        return {
+            "connected": int(self._writer is not None),
+            "published": self.published,
+            "received": self.received,
+            "reconnects": self.reconnects,
+            "overflows": self.overflows,
+        }
+
+
+class Relay:
+    """Sends every line any client writes to all connected clients.
+
+    A client more than EVENT_WRITE_BUFFER_BYTES behind is disconnected
+    rather than buffered for; its broker reconnects.
+    """
+
+    def __init__(self):
+        self._clients: Set[asyncio.StreamWriter] = set()
+        self._handlers: Set[asyncio.Task] = set()
+        self.server = None
+        self.messages = 0
+        self.dropped = 0
+
+    @property
+    def port(self) -> int:
+        return self.server.sockets[0].getsockname()[1]
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        self.server = await asyncio.start_server(self._serve, host, port)
+
+    async def stop(self):
+        self.server.close()
+        for writer in list(self._clients):
+            writer.close()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._clients.add(writer)
+        self._handlers.add(asyncio.current_task())
+        try:
+            while line := await reader.readline():
+                self.messages += 1
+                for client in list(self._clients):
+                    if client.transport.get_write_buffer_size() > EVENT_WRITE_BUFFER_BYTES:
+                        logger.warning("Dropping a relay client that is not keeping up")
+                        self.dropped += 1
+                        self._clients.discard(client)
+                        client.close()
+                    else:
+                        client.write(line)
+        except ConnectionError:
+            pass
+        finally:
+            self._clients.discard(writer)
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+
+def make_broker(hub: Hub, url: str = EVENT_BROKER_URL) -> Broker:
+    if not url:
+        return InProcessBroker(hub)
+    parsed = urlparse(url)
+    if parsed.scheme != "tcp" or not parsed.hostname or not parsed.port:
+        raise ValueError(f"Unsupported EVENT_BROKER_URL: {url}")
+    return SocketBroker(hub, parsed.hostname, parsed.port)
+
+
+hub = Hub()
+broker = make_broker(hub)
+
+
+async def subscribe(user_id: int) -> Subscription:
+    await broker.start()
+    return hub.subscribe(user_id)
+
+
+# Publishing on commit
+
+def queue(db: Session, notifications: Iterable):
+    """Publish `notifications` (rows with the Notification columns) once `db` commits.
+
+    For Core inserts, which bypass the mapper event below.
+    """
+    db.info.setdefault(_PENDING, []).extend(notification_event(row) for row in notifications)
+
+
+def queue_message(db: Session, topic: str, **fields):
+    """Publish a message on `topic` (see Hub.listen) once `db` commits."""
+    db.info.setdefault(_PENDING, []).append({"topic": topic, **fields})
+
+
+@event.listens_for(models.Notification, "after_insert")
+def _queue_inserted_notification(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        queue(session, [target])
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed(session):
+    for message in session.info.pop(_PENDING, ()):
+        broker.publish(message)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back(session):
+    session.info.pop(_PENDING, None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Event relay shared by the API workers")
+    commands = parser.add_subparsers(dest="command", required=True)
+    relay = commands.add_parser("relay", help="run the relay that EVENT_BROKER_URL=tcp://host:port points at")
+    relay.add_argument("--host", default="127.0.0.1")
+    relay.add_argument("--port", type=int, default=7411)
+    args = parser.parse_args()
+
+    async def serve():
+        server = Relay()
+        await server.start(args.host, args.port)
+        logger.info("Event relay listening on %s:%s", args.host, server.port)
+        await server.server.serve_forever()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
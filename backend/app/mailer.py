@@ -0,0 +1,120 @@
+"""Bulk email delivery over reused SMTP sessions.
+
+FastMail.send_message opens, authenticates and closes an SMTP session for
+every message, so the connect/STARTTLS/login round trips cost more than the
+message itself. send_bulk instead splits the outgoing mail into batches of
+MAIL_BATCH_SIZE and sends each batch over one session, with at most
+MAIL_CONCURRENCY sessions open at a time.
+
+The SMTP client and fastapi_mail are imported on first use, so the API
+process, which only queues mail in the outbox, never loads them.
+"""
+import asyncio
+import logging
+import os
+from email.message import EmailMessage
+from functools import lru_cache
+from typing import TYPE_CHECKING, Iterable, List, NamedTuple, Optional
+
+from dotenv import load_dotenv
+
+if TYPE_CHECKING:
+    from fastapi_mail import ConnectionConfig
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", 100))
+MAIL_CONCURRENCY = int(os.getenv("MAIL_CONCURRENCY", 2))
+
+
+@lru_cache(maxsize=None)
+def get_config() -> "ConnectionConfig":
+    """SMTP settings from the MAIL_* environment, validated on first use."""
+    from fastapi_mail import ConnectionConfig
+
+    return ConnectionConfig(
+        MAIL_USERNAME=os.getenv("MAIL_USERNAME"),
+        MAIL_PASSWORD=os.getenv("MAIL_PASSWORD"),
+        MAIL_FROM=os.getenv("MAIL_FROM"),
+        MAIL_PORT=int(os.getenv("MAIL_PORT", 587)),
+        MAIL_SERVER=os.getenv("MAIL_SERVER"),
+        MAIL_STARTTLS=True,
+        MAIL_SSL_TLS=False,
+        USE_CREDENTIALS=True
+    )
+
+
+class OutgoingEmail(NamedTuple):
+    to: str
+    subject: str
+    html: str
+
+
+def build_message(sender: str, email: OutgoingEmail) -> EmailMessage:
+    message = EmailMessage()
+    message["From"] = sender
+    message["To"] = email.to
+    message["Subject"] = email.subject
+    message.set_content(email.html, subtype="html")
+    return message
+
+
+async def send_each(config: "ConnectionConfig", emails: List[OutgoingEmail]) -> List[Optional[str]]:
+    """Send `emails` over a single SMTP session.
+
+    Returns one result per email: None if the server accepted it, otherwise
+    the error. A rejected recipient doesn't stop the batch; losing the
+    connection fails the rest of it.
+    """
+    import aiosmtplib
+    from fastapi_mail.connection import Connection
+
+    sender = config.MAIL_FROM
+    if config.MAIL_FROM_NAME:
+        sender = f"{config.MAIL_FROM_NAME} <{config.MAIL_FROM}>"
+    results: List[Optional[str]] = []
+    async with Connection(config) as connection:
+        for email in emails:
+            if config.SUPPRESS_SEND:
+                results.append(None)
+                continue
+            try:
+                await connection.session.send_message(build_message(sender, email))
+                results.append(None)
+            except aiosmtplib.SMTPServerDisconnected as error:
+                results.extend([str(error) or "Server disconnected"] * (len(emails) - len(results)))
+                break
+            except aiosmtplib.SMTPException as error:
+                logger.warning("Failed to send email to %s: %s", email.to, error)
+                results.append(str(error))
+    return results
+
+
+async def send_batch(config: "ConnectionConfig", emails: List[OutgoingEmail]) -> int:
+    """Send `emails` over a single SMTP session. Returns the number accepted."""
+    return sum(result is None for result in await send_each(config, emails))
+
+
+async def send_bulk(
+    config: "ConnectionConfig",
+    emails: Iterable[OutgoingEmail],
+    batch_size: int = MAIL_BATCH_SIZE,
+    concurrency: int = MAIL_CONCURRENCY,
+) -> dict:
+    """Send `emails` in batches, each over its own reused SMTP session."""
+    emails = list(emails)
+    batches = [emails[i:i + batch_size] for i in range(0, len(emails), batch_size)]
+    limit = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(batch):
+        async with limit:
+            try:
+                return await send_batch(config, batch)
+            except Exception:
+                logger.exception("Email batch of %d messages failed", len(batch))
+                return 0
+
+    sent = sum(await asyncio.gather(*(run(batch) for batch in batches)))
+    return {"sent": sent, "failed": len(emails) - sent, "batches": len(batches)}
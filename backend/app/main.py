@@ -1,14 +1,14 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Response
 from sqlalchemy.orm import Session
-from typing import List
-from . import crud, models, schemas
-from .database import SessionLocal, engine
+from typing import List, Optional
+from . import crud, events, schemas
+from .pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, PREV_CURSOR_HEADER, set_cursor_headers
+from .database import SessionLocal, pool_stats
 from fastapi.middleware.cors import CORSMiddleware
 from datetime import datetime
 import uvicorn
-from .routers import users, auth
-
-models.Base.metadata.create_all(bind=engine)
+from .metrics import MetricsMiddleware
+from .routers import analytics, auth, diary, metrics, notifications, search, users
 
 app = FastAPI(title="Emotional Diary API")
 
@@ -19,7 +19,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, PREV_CURSOR_HEADER, "ETag"],
 )
+app.add_middleware(MetricsMiddleware)
+
+# Connect to the event broker up front so that messages from other workers
+# (e.g. principal cache invalidations) arrive before any stream is opened
+@app.on_event("startup")
+async def start_event_broker():
+    await events.broker.start()
+
+@app.on_event("shutdown")
+async def stop_event_broker():
+    await events.broker.stop()
 
 # Dependency
 def get_db():
@@ -34,8 +46,18 @@ def create_diary_entry(diary_entry: schemas.DiaryEntryCreate, user_id: int, db:
     return crud.create_diary_entry(db=db, diary_entry=diary_entry, user_id=user_id)
 
 @app.get("/diary-entries/", response_model=List[schemas.DiaryEntry])
-def read_diary_entries(user_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    diary_entries = crud.get_diary_entries(db, user_id=user_id, skip=skip, limit=limit)
+def read_diary_entries(
+    user_id: int,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    diary_entries, next_cursor, prev_cursor = crud.get_diary_entries(
+        db, user_id=user_id, limit=limit, after=after, before=before
+    )
+    set_cursor_headers(response, next_cursor, prev_cursor)
     return diary_entries
 
 @app.get("/diary-entries/{diary_entry_id}", response_model=schemas.DiaryEntry)
@@ -62,17 +84,19 @@ def delete_diary_entry(diary_entry_id: int, db: Session = Depends(get_db)):
 # Include routers
 app.include_router(users.router)
 app.include_router(auth.router)
+app.include_router(diary.router)
+app.include_router(analytics.router)
+app.include_router(notifications.router)
+app.include_router(search.router)
+app.include_router(metrics.router)
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to Emotional Diary API", "timestamp": datetime.now().isoformat()}
 
-# Initialize admin user on startup
-@app.on_event("startup")
-async def startup_event():
-    from .database import get_db
-    db = next(get_db())
-    await users.init_admin(db)
+@app.get("/health/db")
+async def database_health():
+    return {"pools": pool_stats()}
 
 if __name__ == "__main__":
     # Run on all interfaces (0.0.0.0) to allow external access
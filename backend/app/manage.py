@@ -0,0 +1,147 @@
+"""Deployment tasks that used to run when the API was imported or started.
+
+Importing app.main no longer touches the database: run these once per
+deploy (e.g. Render's preDeployCommand, or before `docker-compose up`)
+instead of on every replica's boot.
+
+    python -m app.manage migrate          # alembic upgrade head
+    python -m app.manage create-tables    # Base.metadata.create_all, for throwaway SQLite databases
+    python -m app.manage bootstrap        # create the admin account if missing
+    python -m app.manage setup            # migrate, then bootstrap
+
+Migrating also creates the coming monthly partitions of diary_entries on
+PostgreSQL (see app.partitions). create-tables refuses to run on PostgreSQL:
+the models describe diary_entries unpartitioned, with the foreign keys to it
+that the partitioning migration drops.
+
+The migrations alter columns in place, which only Postgres supports; on a
+SQLite DATABASE_URL `setup` creates the tables from the models and stamps
+them as the latest revision instead.
+"""
+import argparse
+import os
+from datetime import datetime
+
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+
+from . import models
+
+load_dotenv()
+
+ADMIN_EMAIL = os.getenv("ADMIN_EMAIL", "admin@admin.com")
+ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "Admin123")
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def admin_exists(db: Session) -> bool:
+    return db.query(models.User.id).filter(models.User.email == ADMIN_EMAIL).first() is not None
+
+
+def create_admin(db: Session, hashed_password: str) -> models.User:
+    """Add the admin user (a therapist) and its therapist profile, and commit."""
+    admin_user = models.User(
+        email=ADMIN_EMAIL,
+        hashed_password=hashed_password,
+        first_name="Admin",
+        last_name="User",
+        user_type="THERAPIST",  # Admin will be a therapist
+        created_at=datetime.utcnow()
+    )
+    db.add(admin_user)
+    db.flush()
+    db.add(models.Therapist(
+        user_id=admin_user.id,
+        license_number="ADMIN-LICENSE",
+        specialization="System Administrator",
+        years_of_experience=99
+    ))
+    db.commit()
+    return admin_user
+
+
+def bootstrap(db: Session) -> bool:
+    """Create the admin account unless it exists. Returns whether it was created."""
+    from .auth import pwd_context
+
+    if admin_exists(db):
+        return False
+    create_admin(db, pwd_context.hash(ADMIN_PASSWORD))
+    return True
+
+
+def _alembic_config():
+    from alembic.config import Config
+
+    config = Config(os.path.join(BACKEND_DIR, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(BACKEND_DIR, "alembic"))
+    return config
+
+
+def migrate(revision: str = "head"):
+    from alembic import command
+
+    command.upgrade(_alembic_config(), revision)
+
+
+def create_partitions():
+    from . import partitions
+    from .database import engine
+
+    with engine.begin() as connection:
+        return partitions.ensure(connection)
+
+
+def create_tables():
+    from .database import Base, engine
+    # Attaches the full-text index DDL to the metadata
+    from . import search  # noqa: F401
+
+    if engine.dialect.name == "postgresql":
+        raise RuntimeError(
+            "diary_entries is partitioned on PostgreSQL, which the models do not describe; "
+            "create the tables with `python -m app.manage migrate`"
+        )
+    Base.metadata.create_all(bind=engine)
+
+
+def main():
+    from .database import SQLALCHEMY_DATABASE_URL, SessionLocal, _is_sqlite
+
+    parser = argparse.ArgumentParser(description="Database migration and bootstrap tasks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    upgrade = commands.add_parser("migrate", help="apply alembic migrations")
+    upgrade.add_argument("--revision", default="head")
+    commands.add_parser("create-tables", help="create missing tables from the models, without alembic")
+    commands.add_parser("bootstrap", help="create the admin account if it does not exist")
+    commands.add_parser("setup", help="migrate, then bootstrap")
+    args = parser.parse_args()
+
+    if args.command == "setup" and _is_sqlite(SQLALCHEMY_DATABASE_URL):
+        from alembic import command
+
+        create_tables()
+        command.stamp(_alembic_config(), "head")
+        print("Created missing tables")
+    elif args.command in ("migrate", "setup"):
+        migrate(getattr(args, "revision", "head"))
+        created = create_partitions()
+        print("Database is up to date" + (f", created {len(created)} diary partitions" if created else ""))
+    if args.command == "create-tables":
+        try:
+            create_tables()
+        except RuntimeError as error:
+            parser.error(str(error))
+        print("Created missing tables")
+    if args.command in ("bootstrap", "setup"):
+        db = SessionLocal()
+        try:
+            created = bootstrap(db)
+        finally:
+            db.close()
+        print(f"Created admin user {ADMIN_EMAIL}" if created else f"Admin user {ADMIN_EMAIL} already exists")
+
+
+if __name__ == "__main__":
+    main()
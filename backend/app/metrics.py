@@ -0,0 +1,211 @@
+"""Per-route request metrics in the Prometheus text format.
+
+MetricsMiddleware is a plain ASGI middleware (no per-request task or body
+buffering). For every HTTP request it records, labelled by method and route
+template (e.g. /diary/entries/{entry_id}, never the raw path):
+
+* http_request_duration_seconds, a latency histogram;
+* http_requests_total by status code;
+* http_requests_in_flight;
+* db_statements_per_request and db_time_seconds_per_request: SQL statements
+  the request executed and the time spent in them, counted by SQLAlchemy
+  cursor events on every engine (the async engine and db.run_sync included,
+  since they run in the request's context).
+
+Counters are per process, like the pool metrics in database.py; with several
+workers, scrape each one or aggregate by instance. render() produces the
+/metrics body, together with the gauges passed to it.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, Iterable, Mapping, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+UNMATCHED_ROUTE = "unmatched"
+
+
+class Histogram:
+    """Cumulative bucket counts and a sum for each label set."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple, list] = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, labels: Tuple, value: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self, name: str, label_names: Sequence[str]) -> Iterable[str]:
+        for labels, series in sorted(self._series.items()):
+            base = _labels(zip(label_names, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                yield f"{name}_bucket{{{base},le=\"{le}\"}} {cumulative}"
+            yield f"{name}_sum{{{base}}} {series[-1]}"
+            yield f"{name}_count{{{base}}} {cumulative}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+
+
+class _RequestStats:
+    __slots__ = ("statements", "db_seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+
+
+_current: ContextVar[Optional[_RequestStats]] = ContextVar("request_stats", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _statement_started(connection, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        connection.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _statement_finished(connection, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    started = connection.info.get("metrics_started")
+    if stats is None or not started:
+        return
+    stats.statements += 1
+    stats.db_seconds += time.perf_counter() - started.pop()
+
+
+@event.listens_for(Engine, "handle_error")
+def _statement_failed(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("metrics_started"):
+        connection.info["metrics_started"].pop()
+
+
+class RequestMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.requests: Dict[Tuple[str, str, int], int] = {}
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.statements = Histogram(STATEMENT_BUCKETS)
+        self.db_time = Histogram(LATENCY_BUCKETS)
+
+    def started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def finished(self, method: str, route: str, status: int, seconds: float, stats: _RequestStats):
+        key = (method, route)
+        with self._lock:
+            self.in_flight -= 1
+            self.requests[(method, route, status)] = self.requests.get((method, route, status), 0) + 1
+            self.latency.observe(key, seconds)
+            self.statements.observe(key, stats.statements)
+            self.db_time.observe(key, stats.db_seconds)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            yield "# HELP http_requests_total HTTP requests by route and status code."
+            yield "# TYPE http_requests_total counter"
+            for (method, route, status), count in sorted(self.requests.items()):
+                yield f"http_requests_total{{{_labels((('method', method), ('route', route), ('status', status)))}}} {count}"
+            yield "# HELP http_requests_in_flight HTTP requests being served."
+            yield "# TYPE http_requests_in_flight gauge"
+            yield f"http_requests_in_flight {self.in_flight}"
+            for name, histogram, help_text in (
+                ("http_request_duration_seconds", self.latency, "Time to serve a request."),
+                ("db_statements_per_request", self.statements, "SQL statements executed per request."),
+                ("db_time_seconds_per_request", self.db_time, "Time spent executing SQL per request."),
+            ):
+                yield f"# HELP {name} {help_text}"
+                yield f"# TYPE {name} histogram"
+                yield from histogram.samples(name, ("method", "route"))
+
+
+request_metrics = RequestMetrics()
+
+_route_templates: Dict[int, Dict[object, str]] = {}
+
+
+def _route_template(scope) -> str:
+    """The path template of the route that served `scope`, from its endpoint."""
+    endpoint = scope.get("endpoint")
+    app = scope.get("app")
+    if endpoint is None or app is None:
+        return UNMATCHED_ROUTE
+    templates = _route_templates.get(id(app))
+    if templates is None:
+        templates = _route_templates[id(app)] = {}
+        for route in reversed(app.routes):
+            if hasattr(route, "endpoint") and hasattr(route, "path"):
+                templates[route.endpoint] = route.path
+    return templates.get(endpoint, UNMATCHED_ROUTE)
+
+
+class MetricsMiddleware:
+    def __init__(self, app, metrics: RequestMetrics = request_metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        stats = _RequestStats()
+        token = _current.set(stats)
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.metrics.started()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.metrics.finished(
+                scope["method"], _route_template(scope), status, time.perf_counter() - started, stats
+            )
+            _current.reset(token)
+
+
+def _gauges(prefix: str, values: Mapping, help_text: str) -> Iterable[str]:
+    for key, value in values.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        name = f"{prefix}_{key}"
+        yield f"# HELP {name} {help_text}"
+        yield f"# TYPE {name} gauge"
+        yield f"{name} {value}"
+
+
+def render(gauges: Mapping[str, Tuple[Mapping, str]] = ()) -> str:
+    """The Prometheus text exposition of the request metrics and `gauges`.
+
+    `gauges` maps a metric prefix to (numeric stats dict, help text).
+    """
+    lines = list(request_metrics.samples())
+    for prefix, (values, help_text) in dict(gauges).items():
+        lines.extend(_gauges(prefix, values, help_text))
+    return "\n".join(lines) + "\n"
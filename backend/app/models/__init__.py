@@ -1,9 +1,12 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, JSON, Float, Enum as SQLAlchemyEnum
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Text, Date, DateTime, ForeignKey, Boolean, JSON, Float, Index, LargeBinary, Enum as SQLAlchemyEnum
+from sqlalchemy.orm import column_property, relationship
 from datetime import datetime
 from enum import Enum
 from ..database import Base
-from ..schemas import UserType
+
+class UserType(str, Enum):
+    PATIENT = "PATIENT"
+    THERAPIST = "THERAPIST"
 
 class User(Base):
     __tablename__ = "users"
@@ -21,6 +24,14 @@ class User(Base):
     therapist_profile = relationship("Therapist", back_populates="user", uselist=False)
     diary_entries = relationship("DiaryEntry", back_populates="user")
 
+    @property
+    def is_therapist(self):
+        return self.user_type == UserType.THERAPIST
+
+    @property
+    def full_name(self):
+        return f"{self.first_name or ''} {self.last_name or ''}".strip()
+
 class Patient(Base):
     __tablename__ = "patients"
     
@@ -62,9 +73,12 @@ class TherapistPatient(Base):
 class DiaryEntry(Base):
     __tablename__ = "diary_entries"
     
+    # On PostgreSQL the table is partitioned by date and its primary key is
+    # (id, date) (migration b7e3c9a5d2f1); ids stay unique through the sequence
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     date = Column(DateTime, default=datetime.utcnow)
+    mood = Column(Integer, nullable=True)
     emotions = Column(JSON)  # Store emotions and their intensities
     medications_taken = Column(Boolean)
     medications_notes = Column(String, nullable=True)
@@ -76,3 +90,172 @@ class DiaryEntry(Base):
     
     # Relationships
     user = relationship("User", back_populates="diary_entries")
+
+    __table_args__ = (
+        # Serves per-user listings ordered by (date, id) for keyset pagination
+        Index("ix_diary_entries_user_date_id", "user_id", "date", "id"),
+    )
+
+class DiaryArchive(Base):
+    """One month of a user's diary entries moved out of diary_entries, compressed."""
+    __tablename__ = "diary_archives"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    month = Column(Date, primary_key=True)  # first day of the month
+    entry_count = Column(Integer, nullable=False)
+    # Bounds of the archived entries, so readers skip months without decompressing them
+    first_id = Column(Integer, nullable=False)
+    last_id = Column(Integer, nullable=False)
+    first_date = Column(DateTime, nullable=False)
+    last_date = Column(DateTime, nullable=False)
+    # Behavior -> latest date it was reported; emotion -> [entries, intensity sum, rated entries]
+    latest = Column(JSON, nullable=False, default=dict)
+    emotion_totals = Column(JSON, nullable=False, default=dict)
+    entries = Column(LargeBinary, nullable=False)  # zlib-compressed JSON rows, see app.archive
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class UserDataVersion(Base):
+    """Counter bumped whenever a user's diary data changes; ETags are derived from it."""
+    __tablename__ = "user_data_versions"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    version = Column(Integer, default=0, nullable=False)
+
+class Emotion(Base):
+    """Vocabulary of emotion names reported in diary entries."""
+    __tablename__ = "emotions"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+
+class DiaryEntryEmotion(Base):
+    """One emotion of a diary entry, normalized from DiaryEntry.emotions."""
+    __tablename__ = "diary_entry_emotions"
+
+    # No foreign key on PostgreSQL, where diary_entries is partitioned
+    entry_id = Column(
+        Integer,
+        ForeignKey("diary_entries.id", ondelete="CASCADE", info={"skip_autogenerate": ("postgresql",)}),
+        primary_key=True,
+    )
+    emotion_id = Column(Integer, ForeignKey("emotions.id"), primary_key=True)
+    intensity = Column(Float, nullable=True)
+
+    __table_args__ = (
+        # Finds the entries reporting an emotion without touching diary_entries
+        Index("ix_diary_entry_emotions_emotion_entry", "emotion_id", "entry_id", "intensity"),
+        {"sqlite_with_rowid": False},
+    )
+
+
+class RollupStats:
+    """Aggregate columns shared by the daily and weekly rollup tables."""
+    entry_count = Column(Integer, nullable=False, default=0)
+    mood_count = Column(Integer, nullable=False, default=0)
+    mood_sum = Column(Integer, nullable=False, default=0)
+    mood_min = Column(Integer, nullable=True)
+    mood_max = Column(Integer, nullable=True)
+    emotion_counts = Column(JSON, nullable=False, default=dict)  # emotion -> number of entries
+    emotion_intensity = Column(JSON, nullable=False, default=dict)  # emotion -> summed intensity
+    self_harm_count = Column(Integer, nullable=False, default=0)
+    suicidal_thoughts_count = Column(Integer, nullable=False, default=0)
+    stressful_events_count = Column(Integer, nullable=False, default=0)
+    medications_taken_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class DailyRollup(RollupStats, Base):
+    __tablename__ = "daily_rollups"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+
+class WeeklyRollup(RollupStats, Base):
+    __tablename__ = "weekly_rollups"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    iso_year = Column(Integer, primary_key=True)
+    iso_week = Column(Integer, primary_key=True)
+    week_start = Column(Date, nullable=False)  # Monday of the ISO week
+
+    __table_args__ = (
+        Index("ix_weekly_rollups_user_week_start", "user_id", "week_start"),
+    )
+
+class NotificationSettings(Base):
+    __tablename__ = "notification_settings"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), unique=True, nullable=False)
+    reminder_time = Column(String(5), nullable=True)  # "HH:MM", local server time
+    email_notifications = Column(Boolean, default=True)
+    push_notifications = Column(Boolean, default=False)
+
+    __table_args__ = (
+        # Reminder dispatch selects everyone due at the current minute
+        Index("ix_notification_settings_reminder_time", "reminder_time"),
+    )
+
+class Notification(Base):
+    __tablename__ = "notifications"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    type = Column(String, nullable=False)  # "reminder", "alert"
+    message = Column(String, nullable=False)
+    # active_history: the previous value is loaded before a change, so unread counts see real transitions
+    is_read = column_property(Column(Boolean, default=False, nullable=False), active_history=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Serves each user's unread list, newest first, and the unread scans of bulk mark-read
+        Index("ix_notifications_user_read_created", "user_id", "is_read", "created_at"),
+    )
+
+class UnreadNotificationCount(Base):
+    """Unread notifications per user, maintained as they are created and read."""
+    __tablename__ = "unread_notification_counts"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    unread = Column(Integer, default=0, nullable=False)
+
+class PatientRiskState(Base):
+    """Latest risk signals per patient, maintained when diary entries are written."""
+    __tablename__ = "patient_risk_states"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    last_entry_date = Column(DateTime, nullable=True)
+    last_self_harm_at = Column(DateTime, nullable=True)
+    last_suicidal_thoughts_at = Column(DateTime, nullable=True)
+    # Latest risk report + the risk window; the patient needs attention until then
+    needs_attention_until = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        Index(
+            "ix_patient_risk_states_attention", "needs_attention_until",
+            postgresql_where=needs_attention_until.isnot(None),
+            sqlite_where=needs_attention_until.isnot(None),
+        ),
+    )
+
+class OutboxMessage(Base):
+    """Email written with the rows that caused it, delivered by the outbox worker."""
+    __tablename__ = "outbox_messages"
+
+    id = Column(Integer, primary_key=True)
+    recipient = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    html = Column(Text, nullable=False)
+    status = Column(String, default="pending", nullable=False)  # "pending", "sent", "dead"
+    attempts = Column(Integer, default=0, nullable=False)
+    # Not sent before this time; pushed back after each failed attempt
+    available_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # Set while a worker holds the message; an expired lease can be claimed again
+    locked_until = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_outbox_messages_status_available", "status", "available_at"),
+    )
@@ -0,0 +1,259 @@
+"""Transactional email outbox and its delivery worker.
+
+Code that needs to email someone calls enqueue() on the session that writes
+the related rows (usually a Notification), so the message commits or rolls
+back together with them. Nothing is sent from the web process. The worker
+
+    python -m app.outbox [--once] [--stats]
+
+claims due messages in batches of OUTBOX_BATCH_SIZE, sends each batch over
+one SMTP session, and records the outcome of every message. A claim is a
+lease: the claimed rows get `locked_until` = now + OUTBOX_LEASE_SECONDS,
+and rows whose lease ran out because their worker died become claimable
+again. Delivery is therefore at-least-once. On PostgreSQL the claim selects
+with FOR UPDATE SKIP LOCKED, so concurrent workers take disjoint batches
+without waiting on each other; SQLite runs the single claim UPDATE under
+its database write lock.
+
+A failed message is retried after OUTBOX_RETRY_BASE_SECONDS * 2**(attempts - 1)
+(capped at OUTBOX_RETRY_MAX_SECONDS, plus up to 10% jitter). After
+OUTBOX_MAX_ATTEMPTS failures it is marked "dead" and left for an operator.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import signal
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Iterable, Optional, Sequence
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import Session
+
+from . import mailer, models
+
+if TYPE_CHECKING:
+    from fastapi_mail import ConnectionConfig
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", mailer.MAIL_BATCH_SIZE))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", 2))
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", 300))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 8))
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", 30))
+OUTBOX_RETRY_MAX_SECONDS = float(os.getenv("OUTBOX_RETRY_MAX_SECONDS", 3600))
+OUTBOX_STATS_SECONDS = float(os.getenv("OUTBOX_STATS_SECONDS", 60))
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", 7))
+
+
+def enqueue(db: Session, emails: Iterable[mailer.OutgoingEmail]) -> int:
+    """Queue `emails` in the caller's transaction. Returns the number queued."""
+    rows = [{"recipient": email.to, "subject": email.subject, "html": email.html} for email in emails]
+    if rows:
+        db.execute(insert(models.OutboxMessage), rows)
+    return len(rows)
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """Backoff before the next try of a message that has failed `attempts` times."""
+    seconds = min(OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1), OUTBOX_RETRY_MAX_SECONDS)
+    return timedelta(seconds=seconds * (1 + random.random() / 10))
+
+
+def stats(db: Session, now: Optional[datetime] = None) -> dict:
+    """Queue depth and lag.
+
+    `pending` counts undelivered messages and `due` those that may be sent
+    now; `lag_seconds` is how long the oldest due message has been waiting
+    past its `available_at`.
+    """
+    now = now or datetime.utcnow()
+    message = models.OutboxMessage
+    counts = dict(db.execute(
+        select(message.status, func.count()).where(message.status.in_(("pending", "dead"))).group_by(message.status)
+    ).all())
+    due, oldest = db.execute(
+        select(func.count(), func.min(message.available_at)).where(
+            message.status == "pending", message.available_at <= now
+        )
+    ).one()
+    return {
+        "pending": counts.get("pending", 0),
+        "due": due,
+        "dead": counts.get("dead", 0),
+        "lag_seconds": round((now - oldest).total_seconds(), 3) if oldest else 0.0,
+    }
+
+
+def purge(db: Session, now: Optional[datetime] = None) -> int:
+    """Delete messages delivered more than OUTBOX_RETENTION_DAYS ago."""
+    now = now or datetime.utcnow()
+    result = db.execute(
+        delete(models.OutboxMessage).where(
+            models.OutboxMessage.status == "sent",
+            models.OutboxMessage.sent_at < now - timedelta(days=OUTBOX_RETENTION_DAYS)
+        )
+    )
+    db.commit()
+    return result.rowcount
+
+
+async def claim(db: AsyncSession, batch_size: int = OUTBOX_BATCH_SIZE, now: Optional[datetime] = None):
+    """Lease up to `batch_size` due messages and commit the lease.
+
+    Returns rows of (id, recipient, subject, html, attempts).
+    """
+    now = now or datetime.utcnow()
+    message = models.OutboxMessage
+    due = select(message.id).where(
+        message.status == "pending",
+        message.available_at <= now,
+        or_(message.locked_until.is_(None), message.locked_until < now)
+    ).order_by(message.available_at, message.id).limit(batch_size)
+    if db.get_bind().dialect.name == "postgresql":
+        due = due.with_for_update(skip_locked=True)
+    claimed = (await db.execute(
+        update(message).where(message.id.in_(due.scalar_subquery()))
+        .values(locked_until=now + timedelta(seconds=OUTBOX_LEASE_SECONDS))
+        .returning(message.id, message.recipient, message.subject, message.html, message.attempts)
+        .execution_options(synchronize_session=False)
+    )).all()
+    await db.commit()
+    return claimed
+
+
+async def record(db: AsyncSession, claimed: Sequence, results: Sequence[Optional[str]],
+                 now: Optional[datetime] = None):
+    """Store the outcome of sending `claimed` and release their leases."""
+    now = now or datetime.utcnow()
+    message = models.OutboxMessage
+    sent = [row.id for row, error in zip(claimed, results) if error is None]
+    if sent:
+        await db.execute(
+            update(message).where(message.id.in_(sent)).values(
+                status="sent", attempts=message.attempts + 1, sent_at=now, locked_until=None, last_error=None
+            ).execution_options(synchronize_session=False)
+        )
+    for row, error in zip(claimed, results):
+        if error is None:
+            continue
+        attempts = row.attempts + 1
+        await db.execute(
+            update(message).where(message.id == row.id).values(
+                status="dead" if attempts >= OUTBOX_MAX_ATTEMPTS else "pending",
+                attempts=attempts,
+                available_at=now + retry_delay(attempts),
+                locked_until=None,
+                last_error=error[:500]
+            ).execution_options(synchronize_session=False)
+        )
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            logger.error("Giving up on outbox message %d to %s after %d attempts: %s", row.id, row.recipient, attempts, error)
+    await db.commit()
+
+
+class Worker:
+    """Delivers the outbox, up to `concurrency` SMTP sessions at a time."""
+
+    def __init__(self, sessions: async_sessionmaker, config: "ConnectionConfig",
+                 batch_size: int = OUTBOX_BATCH_SIZE, concurrency: int = mailer.MAIL_CONCURRENCY,
+                 poll_seconds: float = OUTBOX_POLL_SECONDS, stats_seconds: float = OUTBOX_STATS_SECONDS):
+        self.sessions = sessions
+        self.config = config
+        self.batch_size = batch_size
+        self.concurrency = max(1, concurrency)
+        self.poll_seconds = poll_seconds
+        self.stats_seconds = stats_seconds
+        self.stopping = asyncio.Event()
+        self.counts = {"sent": 0, "failed": 0, "batches": 0}
+
+    async def deliver_batch(self) -> int:
+        """Claim, send and record one batch. Returns the number of messages claimed."""
+        async with self.sessions() as db:
+            claimed = await claim(db, self.batch_size)
+        if not claimed:
+            return 0
+        emails = [mailer.OutgoingEmail(row.recipient, row.subject, row.html) for row in claimed]
+        try:
+            results = await mailer.send_each(self.config, emails)
+        except Exception as error:
+            logger.warning("Outbox batch of %d messages failed: %s", len(claimed), error)
+            results = [str(error) or type(error).__name__] * len(claimed)
+        async with self.sessions() as db:
+            await record(db, claimed, results)
+        failed = sum(result is not None for result in results)
+        self.counts["sent"] += len(claimed) - failed
+        self.counts["failed"] += failed
+        self.counts["batches"] += 1
+        return len(claimed)
+
+    async def drain(self) -> int:
+        """Deliver until nothing is due. Returns the number of messages claimed."""
+        total = 0
+        while not self.stopping.is_set():
+            claimed = sum(await asyncio.gather(*(self.deliver_batch() for _ in range(self.concurrency))))
+            if not claimed:
+                break
+            total += claimed
+        return total
+
+    async def run(self):
+        """Poll the outbox until stop() is called, logging queue stats every `stats_seconds`."""
+        next_stats = 0.0
+        loop = asyncio.get_running_loop()
+        while not self.stopping.is_set():
+            await self.drain()
+            if loop.time() >= next_stats:
+                async with self.sessions() as db:
+                    purged = await db.run_sync(purge)
+                    queue = await db.run_sync(stats)
+                logger.info("Outbox %s, purged %d, worker totals %s", queue, purged, self.counts)
+                next_stats = loop.time() + self.stats_seconds
+            try:
+                await asyncio.wait_for(self.stopping.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self):
+        self.stopping.set()
+
+
+async def _main(args):
+    from .database import AsyncSessionLocal
+
+    if args.stats:
+        async with AsyncSessionLocal() as db:
+            print(json.dumps(await db.run_sync(stats)))
+        return
+    worker = Worker(AsyncSessionLocal, mailer.get_config(), batch_size=args.batch_size)
+    if args.once:
+        delivered = await worker.drain()
+        print(f"Processed {delivered} messages: {worker.counts}")
+        return
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, worker.stop)
+    logger.info("Outbox worker started")
+    await worker.run()
+    logger.info("Outbox worker stopped: %s", worker.counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deliver queued emails from the outbox")
+    parser.add_argument("--once", action="store_true", help="deliver everything due, then exit")
+    parser.add_argument("--stats", action="store_true", help="print queue depth and lag as JSON, then exit")
+    parser.add_argument("--batch-size", type=int, default=OUTBOX_BATCH_SIZE, help="messages per SMTP session")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
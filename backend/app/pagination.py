@@ -0,0 +1,112 @@
+import base64
+import json
+from datetime import datetime
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, Response
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+PREV_CURSOR_HEADER = "X-Prev-Cursor"
+
+Position = Tuple[datetime, int]
+
+
+def encode_cursor(entry_date: datetime, entry_id: int) -> str:
+    """Encode a (date, id) position as an opaque URL-safe token."""
+    raw = json.dumps([entry_date.isoformat(), entry_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Position:
+    """Decode a token produced by encode_cursor, raising 400 if it is malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        entry_date, entry_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(entry_date), int(entry_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_page(
+    query,
+    date_column,
+    id_column,
+    limit: int = DEFAULT_PAGE_SIZE,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    extra: Optional[Callable[[Optional[Position], Optional[Position], int, bool], Sequence]] = None,
+):
+    """Return one page of `query` ordered newest first on (date, id).
+
+    `after` continues towards older rows, `before` walks back towards newer
+    ones. The filter is a row-value comparison so that it can be answered by
+    seeking a (user_id, date, id) index instead of counting past an OFFSET.
+    The rows must carry both columns (under their keys) for the cursors.
+
+    `extra(lower, upper, count, newest_first)` adds rows kept outside
+    `query` (such as archived diary entries): it returns up to `count` rows
+    strictly between the (date, id) positions `lower` and `upper` (None is
+    unbounded), in the page's order and with the same fields, which are
+    merged into the page. When `query` fills the page on its own the range
+    ends at its last row, so sources with nothing that recent are not read.
+
+    Returns (rows, next_cursor, prev_cursor).
+    """
+    if after and before:
+        raise HTTPException(status_code=400, detail="Use either 'after' or 'before', not both")
+
+    after_position = decode_cursor(after) if after else None
+    before_position = decode_cursor(before) if before else None
+    position = tuple_(date_column, id_column)
+    if before:
+        query = query.filter(position > tuple_(*before_position))
+        query = query.order_by(date_column.asc(), id_column.asc())
+    else:
+        if after:
+            query = query.filter(position < tuple_(*after_position))
+        query = query.order_by(date_column.desc(), id_column.desc())
+
+    rows = query.limit(limit + 1).all()
+    if extra is not None:
+        def key(row):
+            return getattr(row, date_column.key), getattr(row, id_column.key)
+
+        lower, upper = (before_position, None) if before else (None, after_position)
+        if len(rows) > limit:
+            lower, upper = (lower, key(rows[-1])) if before else (key(rows[-1]), upper)
+        more = extra(lower, upper, limit + 1, not before)
+        if more:
+            rows = sorted([*rows, *more], key=key, reverse=not before)[:limit + 1]
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if before:
+        rows.reverse()
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = after is not None, has_more
+
+    def cursor(row) -> str:
+        return encode_cursor(getattr(row, date_column.key), getattr(row, id_column.key))
+
+    next_cursor = cursor(rows[-1]) if rows and has_older else None
+    prev_cursor = cursor(rows[0]) if rows and has_newer else None
+    return rows, next_cursor, prev_cursor
+
+
+def cursor_headers(next_cursor: Optional[str], prev_cursor: Optional[str]) -> Dict[str, str]:
+    headers = {}
+    if next_cursor:
+        headers[NEXT_CURSOR_HEADER] = next_cursor
+    if prev_cursor:
+        headers[PREV_CURSOR_HEADER] = prev_cursor
+    return headers
+
+
+def set_cursor_headers(response: Response, next_cursor: Optional[str], prev_cursor: Optional[str]):
+    """Expose page cursors as headers so list endpoints keep returning a plain array."""
+    response.headers.update(cursor_headers(next_cursor, prev_cursor))
@@ -0,0 +1,131 @@
+"""Monthly range partitions of diary_entries on PostgreSQL.
+
+Since migration b7e3c9a5d2f1 diary_entries is partitioned by RANGE (date),
+one partition per calendar month (diary_entries_YYYY_MM) plus
+diary_entries_default for dates without one. Listings and analytics windows
+then only touch the months they cover, and months emptied by the archive
+job (app.archive) are dropped whole instead of being deleted row by row.
+
+Partitions must exist before entries for their month arrive, or those
+entries land in the default partition, and a month cannot be added while
+the default partition holds rows for it. Create the coming months ahead of
+time, e.g. daily from cron (`python -m app.archive` does it too):
+
+    python -m app.partitions [--months-ahead N]
+
+On other databases every function here is a no-op.
+"""
+import argparse
+import os
+import re
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+load_dotenv()
+
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", 3))
+
+TABLE = "diary_entries"
+_NAME = re.compile(rf"^{TABLE}_(\d{{4}})_(\d{{2}})$")
+
+
+def month_start(value) -> date:
+    """First day of the month containing `value` (a date or datetime)."""
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{TABLE}_{month:%Y_%m}"
+
+
+def is_partitioned(connection: Connection) -> bool:
+    if connection.dialect.name != "postgresql":
+        return False
+    return connection.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table))"
+    ), {"table": TABLE}).scalar()
+
+
+def monthly_partitions(connection: Connection) -> Dict[date, str]:
+    """Existing monthly partitions, by month."""
+    names = connection.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:table)"
+    ), {"table": TABLE}).scalars()
+    months = {}
+    for name in names:
+        match = _NAME.match(name)
+        if match:
+            months[date(int(match[1]), int(match[2]), 1)] = name
+    return months
+
+
+def create(connection: Connection, month: date):
+    connection.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {TABLE} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    ))
+
+
+def ensure(connection: Connection, months_ahead: int = PARTITION_MONTHS_AHEAD,
+           today: Optional[date] = None) -> List[date]:
+    """Create the partitions of this month and the next `months_ahead`. Returns the months created."""
+    if not is_partitioned(connection):
+        return []
+    existing = monthly_partitions(connection)
+    current = month_start(today or datetime.now())
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        if month not in existing:
+            create(connection, month)
+            created.append(month)
+    return created
+
+
+def drop_empty(connection: Connection, before: date) -> List[date]:
+    """Drop the monthly partitions before `before` that hold no entries. Returns their months.
+
+    Each partition is locked before it is checked, so an entry written
+    concurrently (e.g. an archived month being restored) is never dropped
+    with it.
+    """
+    if not is_partitioned(connection):
+        return []
+    dropped = []
+    for month, name in sorted(monthly_partitions(connection).items()):
+        if month >= before:
+            break
+        connection.execute(text(f"LOCK TABLE {name} IN ACCESS EXCLUSIVE MODE"))
+        if connection.execute(text(f"SELECT NOT EXISTS (SELECT 1 FROM {name})")).scalar():
+            connection.execute(text(f"DROP TABLE {name}"))
+            dropped.append(month)
+    return dropped
+
+
+def main():
+    from .database import engine
+
+    parser = argparse.ArgumentParser(description="Create the coming monthly partitions of diary_entries")
+    parser.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    args = parser.parse_args()
+
+    with engine.begin() as connection:
+        if not is_partitioned(connection):
+            print(f"{TABLE} is not partitioned on this database")
+            return
+        created = ensure(connection, args.months_ahead)
+    print(f"Created {len(created)} partitions" + (f": {', '.join(partition_name(month) for month in created)}" if created else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""In-process cache of authenticated users.
+
+Resolving a bearer token costs a JWT decode and a users lookup on every
+request. The cache maps a verified token to a detached snapshot of its user
+for at most PRINCIPAL_CACHE_TTL_SECONDS and never past the token's own
+expiry. Callers merge the snapshot into the request's session with
+load=False, so a hit issues no SQL.
+
+Entries are evicted least-recently-used beyond PRINCIPAL_CACHE_SIZE. When
+the ORM flushes an update or delete of a user, its entries are dropped at
+once in this process and, when the transaction commits, in every other API
+process through the event broker (app.events, EVENT_BROKER_URL). Without a
+shared broker, or while it is unreachable, other processes may serve the old
+user for up to PRINCIPAL_CACHE_TTL_SECONDS. Bulk Query.update()/delete()
+calls bypass the ORM events and must call invalidate() themselves.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
+
+from . import events, models
+
+load_dotenv()
+
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", 4096))
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", 60))
+
+TOPIC = "principal-invalidated"
+
+
+class PrincipalCache:
+    def __init__(self, maxsize: int = PRINCIPAL_CACHE_SIZE, ttl: float = PRINCIPAL_CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, user_id, snapshot)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable) -> Optional[models.User]:
+        """Return the cached detached snapshot of the user, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key: Hashable, user: models.User, token_expires_at: Optional[float] = None):
+        """Cache `user` for `key` until the TTL or the token expiry, whichever is first."""
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        if token_expires_at is not None:
+            expires_at = min(expires_at, token_expires_at)
+        snapshot = _snapshot(user)
+        with self._lock:
+            self._entries[key] = (expires_at, user.id, snapshot)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry[1] == user_id]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
+
+
+def _snapshot(user: models.User) -> models.User:
+    """Copy the user's column values into a detached instance no session owns."""
+    values = {attr.key: getattr(user, attr.key) for attr in inspect(models.User).column_attrs}
+    snapshot = models.User(**values)
+    make_transient_to_detached(snapshot)
+    return snapshot
+
+
+principal_cache = PrincipalCache()
+
+
+def invalidate(db: Session, user_id: int):
+    """Drop `user_id` from this process's cache now and from every process's once `db` commits."""
+    principal_cache.invalidate_user(user_id)
+    events.queue_message(db, TOPIC, user_id=user_id)
+
+
+events.hub.listen(TOPIC, lambda message: principal_cache.invalidate_user(message["user_id"]))
+
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    session = object_session(target)
+    if session is None:
+        principal_cache.invalidate_user(target.id)
+    else:
+        invalidate(session, target.id)
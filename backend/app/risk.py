@@ -0,0 +1,171 @@
+"""Materialized per-patient risk state.
+
+A patient needs attention while any entry from the last RISK_WINDOW reports
+self harm or suicidal thoughts. Instead of rescanning entries on every
+dashboard load, each diary write calls evaluate(), which stores the latest
+date of each risk signal in patient_risk_states together with
+`needs_attention_until` (latest signal + RISK_WINDOW). Whether a patient
+needs attention "now" is then a comparison against that column, which stays
+correct as time passes without any scheduled job.
+
+When a write reports a risk signal newer than the stored one and recent
+enough to matter, evaluate() also raises a therapist alert in the same
+transaction: a notification plus an email queued in the outbox.
+
+To rebuild the table from history:
+
+    python -m app.risk [--user-id ID]
+"""
+import argparse
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Iterable, List, Optional
+
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import Session
+
+from . import mailer, models, outbox
+
+RISK_WINDOW = timedelta(days=7)
+
+# Entry column -> label shown to therapists
+RISK_FACTORS = {
+    "self_harm": "פגיעה עצמית",
+    "suicidal_thoughts": "מחשבות אובדניות",
+}
+
+
+def _latest_signals(db: Session, user_id: int):
+    entry = models.DiaryEntry
+    hot = db.execute(
+        select(
+            func.max(entry.date).label("last_entry_date"),
+            *(
+                func.max(case((getattr(entry, factor).is_(True), entry.date))).label(factor)
+                for factor in RISK_FACTORS
+            )
+        ).where(entry.user_id == user_id)
+    ).one()
+    signals = dict(hot._mapping)
+    # Archived months (app.archive) keep the latest date of each signal they hold
+    for latest in db.scalars(select(models.DiaryArchive.latest).where(models.DiaryArchive.user_id == user_id)):
+        for signal, key in (("last_entry_date", "date"), *((factor, factor) for factor in RISK_FACTORS)):
+            if latest.get(key):
+                archived = datetime.fromisoformat(latest[key])
+                if signals[signal] is None or archived > signals[signal]:
+                    signals[signal] = archived
+    return SimpleNamespace(**signals)
+
+
+def _apply(state: models.PatientRiskState, signals):
+    state.last_entry_date = signals.last_entry_date
+    latest = None
+    for factor in RISK_FACTORS:
+        value = getattr(signals, factor)
+        setattr(state, f"last_{factor}_at", value)
+        if value is not None and (latest is None or value > latest):
+            latest = value
+    state.needs_attention_until = latest + RISK_WINDOW if latest else None
+
+
+def risk_factors(state, now: Optional[datetime] = None) -> List[str]:
+    """Labels of the risk signals reported within RISK_WINDOW of `now`."""
+    since = (now or datetime.now()) - RISK_WINDOW
+    return [
+        label for factor, label in RISK_FACTORS.items()
+        if (getattr(state, f"last_{factor}_at") or datetime.min) >= since
+    ]
+
+
+def evaluate(db: Session, user_id: int, now: Optional[datetime] = None) -> List[str]:
+    """Recompute `user_id`'s risk state in the caller's transaction.
+
+    Returns the labels of newly reported recent risk signals, which have
+    been alerted to the patient's therapists in the same transaction.
+    """
+    now = now or datetime.now()
+    db.flush()
+    signals = _latest_signals(db, user_id)
+    state = db.get(models.PatientRiskState, user_id)
+    if state is None:
+        state = models.PatientRiskState(user_id=user_id)
+        db.add(state)
+
+    raised = []
+    for factor, label in RISK_FACTORS.items():
+        reported = getattr(signals, factor)
+        previous = getattr(state, f"last_{factor}_at")
+        if reported is not None and reported >= now - RISK_WINDOW and (previous is None or reported > previous):
+            raised.append(label)
+    _apply(state, signals)
+
+    if raised:
+        alert_therapists(db, user_id, ", ".join(raised))
+    return raised
+
+
+def alert_therapists(db: Session, patient_id: int, alert_type: str) -> int:
+    """Notify and queue an email to every therapist of `patient_id`. Returns the number alerted."""
+    therapists = db.scalars(
+        select(models.User).join(
+            models.TherapistPatient, models.TherapistPatient.therapist_id == models.User.id
+        ).where(models.TherapistPatient.patient_id == patient_id)
+    ).all()
+    patient = db.get(models.User, patient_id) if therapists else None
+    if patient is None:
+        return 0
+
+    emails = []
+    for therapist in therapists:
+        db.add(models.Notification(
+            user_id=therapist.id,
+            type="alert",
+            message=f"התראה: {alert_type} אצל המטופל/ת {patient.full_name}"
+        ))
+        emails.append(mailer.OutgoingEmail(
+            therapist.email,
+            f"התראה דחופה - {patient.full_name}",
+            f"""
+        <h2>שלום {therapist.full_name},</h2>
+        <p>התקבלה התראה חשובה לגבי המטופל/ת {patient.full_name}:</p>
+        <p><strong>{alert_type}</strong></p>
+        <p>אנא בדוק/י את המערכת בהקדם האפשרי.</p>
+        """
+        ))
+    outbox.enqueue(db, emails)
+    return len(emails)
+
+
+def backfill(db: Session, user_ids: Optional[Iterable[int]] = None) -> int:
+    """Rebuild risk states from the raw entries without raising alerts. Returns the number rebuilt."""
+    if user_ids is None:
+        user_ids = db.scalars(
+            select(models.DiaryEntry.user_id).union(select(models.DiaryArchive.user_id))
+        ).all()
+    count = 0
+    for user_id in user_ids:
+        state = db.get(models.PatientRiskState, user_id) or models.PatientRiskState(user_id=user_id)
+        db.add(state)
+        _apply(state, _latest_signals(db, user_id))
+        count += 1
+    db.commit()
+    return count
+
+
+def main():
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Rebuild patient risk states from diary history")
+    parser.add_argument("--user-id", type=int, default=None, help="only rebuild this user's state")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        rebuilt = backfill(db, None if args.user_id is None else [args.user_id])
+        print(f"Rebuilt risk state for {rebuilt} patients")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
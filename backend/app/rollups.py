@@ -0,0 +1,262 @@
+"""Daily and weekly rollups of diary entries.
+
+Each (user, day) and (user, ISO week) bucket keeps mood statistics,
+per-emotion counts and intensity sums, and behavior counts, so analytics can
+read a few hundred small rows instead of rescanning every diary entry.
+
+Buckets are refreshed in the caller's transaction whenever an entry is
+written: the day is rebuilt from its own entries and the week from its (at
+most seven) daily rows. Buckets of archived months (app.archive) stay as
+they are, since writes restore a month before touching it; rebuild() reads
+archived entries back in. To rebuild everything from history:
+
+    python -m app.rollups [--user-id ID]
+"""
+import argparse
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from types import SimpleNamespace
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy.orm import Session
+
+from . import models
+
+COUNTER_COLUMNS = (
+    "entry_count",
+    "mood_count",
+    "mood_sum",
+    "self_harm_count",
+    "suicidal_thoughts_count",
+    "stressful_events_count",
+    "medications_taken_count",
+)
+
+BEHAVIORS = ("self_harm", "suicidal_thoughts", "stressful_events", "medications_taken")
+
+
+def iter_emotions(emotions):
+    """Yield (emotion, intensity) pairs from the stored emotions value.
+
+    Entries store either a mapping of emotion to intensity or a plain list of
+    emotion names; list items have no intensity.
+    """
+    if isinstance(emotions, dict):
+        yield from emotions.items()
+    elif emotions:
+        for emotion in emotions:
+            yield emotion, None
+
+
+def _empty_stats() -> dict:
+    stats = {column: 0 for column in COUNTER_COLUMNS}
+    stats.update(mood_min=None, mood_max=None, emotion_counts={}, emotion_intensity={})
+    return stats
+
+
+def _merge(stats: dict, other) -> dict:
+    """Fold a rollup row (or anything with the same attributes) into `stats`."""
+    for column in COUNTER_COLUMNS:
+        stats[column] += getattr(other, column)
+    for column, pick in (("mood_min", min), ("mood_max", max)):
+        value = getattr(other, column)
+        if value is not None:
+            stats[column] = value if stats[column] is None else pick(stats[column], value)
+    for column in ("emotion_counts", "emotion_intensity"):
+        merged = dict(stats[column])
+        for emotion, value in (getattr(other, column) or {}).items():
+            merged[emotion] = merged.get(emotion, 0) + value
+        stats[column] = merged
+    return stats
+
+
+def _stats_from_entries(entries: Iterable) -> dict:
+    stats = _empty_stats()
+    counts: Dict[str, int] = defaultdict(int)
+    intensity: Dict[str, float] = defaultdict(float)
+    for entry in entries:
+        stats["entry_count"] += 1
+        if entry.mood is not None:
+            stats["mood_count"] += 1
+            stats["mood_sum"] += entry.mood
+            stats["mood_min"] = entry.mood if stats["mood_min"] is None else min(stats["mood_min"], entry.mood)
+            stats["mood_max"] = entry.mood if stats["mood_max"] is None else max(stats["mood_max"], entry.mood)
+        for emotion, value in iter_emotions(entry.emotions):
+            counts[emotion] += 1
+            intensity[emotion] += value or 0
+        for behavior in BEHAVIORS:
+            if getattr(entry, behavior):
+                stats[f"{behavior}_count"] += 1
+    stats["emotion_counts"] = dict(counts)
+    stats["emotion_intensity"] = dict(intensity)
+    return stats
+
+
+def _store(db: Session, row, model, key: dict, stats: dict):
+    """Insert, update or drop a bucket row depending on whether it has entries."""
+    if stats["entry_count"] == 0:
+        if row is not None:
+            db.delete(row)
+        return None
+    if row is None:
+        row = model(**key)
+        db.add(row)
+    for column, value in stats.items():
+        setattr(row, column, value)
+    return row
+
+
+def week_start_of(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+def refresh_week(db: Session, user_id: int, day: date):
+    """Rebuild the ISO week containing `day` from its daily rollups."""
+    start = week_start_of(day)
+    iso_year, iso_week, _ = start.isocalendar()
+    db.flush()
+    stats = _empty_stats()
+    for daily in db.query(models.DailyRollup).filter(
+        models.DailyRollup.user_id == user_id,
+        models.DailyRollup.day >= start,
+        models.DailyRollup.day < start + timedelta(days=7)
+    ):
+        _merge(stats, daily)
+    row = db.get(models.WeeklyRollup, (user_id, iso_year, iso_week))
+    key = {"user_id": user_id, "iso_year": iso_year, "iso_week": iso_week, "week_start": start}
+    _store(db, row, models.WeeklyRollup, key, stats)
+
+
+def refresh_day(db: Session, user_id: int, day: date):
+    """Rebuild the daily and weekly buckets that contain `day`.
+
+    Must run before the caller commits so the rollups change in the same
+    transaction as the diary entry itself.
+    """
+    db.flush()
+    start = datetime.combine(day, time.min)
+    entries = db.query(models.DiaryEntry).filter(
+        models.DiaryEntry.user_id == user_id,
+        models.DiaryEntry.date >= start,
+        models.DiaryEntry.date < start + timedelta(days=1)
+    ).all()
+    row = db.get(models.DailyRollup, (user_id, day))
+    _store(db, row, models.DailyRollup, {"user_id": user_id, "day": day}, _stats_from_entries(entries))
+    refresh_week(db, user_id, day)
+
+
+def refresh_entry(db: Session, entry: models.DiaryEntry, previous_date: Optional[datetime] = None):
+    """Refresh the buckets touched by writing `entry`.
+
+    Pass `previous_date` when an update may have moved the entry to another day.
+    """
+    db.flush()
+    refresh_day(db, entry.user_id, entry.date.date())
+    if previous_date is not None and previous_date.date() != entry.date.date():
+        refresh_day(db, entry.user_id, previous_date.date())
+
+
+def daily_rollups(db: Session, user_id: int, start: Optional[date] = None, end: Optional[date] = None) -> List[models.DailyRollup]:
+    query = db.query(models.DailyRollup).filter(models.DailyRollup.user_id == user_id)
+    if start:
+        query = query.filter(models.DailyRollup.day >= start)
+    if end:
+        query = query.filter(models.DailyRollup.day <= end)
+    return query.order_by(models.DailyRollup.day).all()
+
+
+def totals(db: Session, user_id: int, start: Optional[date] = None, end: Optional[date] = None) -> dict:
+    """Sum all buckets between `start` and `end` (inclusive days).
+
+    Whole ISO weeks inside the range are read from the weekly table and only
+    the partial weeks at either edge fall back to daily rows, so a year costs
+    about 52 reads.
+    """
+    first_week = None if start is None else week_start_of(start + timedelta(days=6))
+    last_week = None if end is None else week_start_of(end + timedelta(days=1)) - timedelta(days=7)
+
+    stats = _empty_stats()
+    if first_week is not None and last_week is not None and first_week > last_week:
+        for daily in daily_rollups(db, user_id, start, end):
+            _merge(stats, daily)
+        return stats
+
+    weeks = db.query(models.WeeklyRollup).filter(models.WeeklyRollup.user_id == user_id)
+    if first_week is not None:
+        weeks = weeks.filter(models.WeeklyRollup.week_start >= first_week)
+        for daily in daily_rollups(db, user_id, start, first_week - timedelta(days=1)):
+            _merge(stats, daily)
+    if last_week is not None:
+        weeks = weeks.filter(models.WeeklyRollup.week_start <= last_week)
+        for daily in daily_rollups(db, user_id, last_week + timedelta(days=7), end):
+            _merge(stats, daily)
+    for weekly in weeks:
+        _merge(stats, weekly)
+    return stats
+
+
+def rebuild(db: Session, user_id: Optional[int] = None, user_ids: Optional[Sequence[int]] = None) -> int:
+    """Rebuild rollups from the raw diary entries in the caller's transaction.
+
+    Rebuilds `user_id`'s or `user_ids`' rollups, or everyone's if neither is
+    given. Returns the number of days written.
+    """
+    owners = [user_id] if user_id is not None else None if user_ids is None else list(user_ids)
+    db.flush()
+    for model in (models.DailyRollup, models.WeeklyRollup):
+        query = db.query(model)
+        if owners is not None:
+            query = query.filter(model.user_id.in_(owners))
+        query.delete(synchronize_session=False)
+
+    query = db.query(models.DiaryEntry).order_by(models.DiaryEntry.user_id, models.DiaryEntry.date)
+    if owners is not None:
+        query = query.filter(models.DiaryEntry.user_id.in_(owners))
+
+    # app.archive imports this module
+    from .archive import entries as archived_entries
+
+    days = defaultdict(list)
+    for entry in query.yield_per(1000):
+        days[(entry.user_id, entry.date.date())].append(entry)
+    for owner in [None] if owners is None else owners:
+        for entry in archived_entries(db, owner):
+            days[(entry.user_id, entry.date.date())].append(entry)
+
+    weeks = defaultdict(_empty_stats)
+    for (owner, day), entries in days.items():
+        stats = _stats_from_entries(entries)
+        db.add(models.DailyRollup(user_id=owner, day=day, **stats))
+        _merge(weeks[(owner, week_start_of(day))], SimpleNamespace(**stats))
+
+    for (owner, start), stats in weeks.items():
+        iso_year, iso_week, _ = start.isocalendar()
+        db.add(models.WeeklyRollup(user_id=owner, iso_year=iso_year, iso_week=iso_week, week_start=start, **stats))
+
+    return len(days)
+
+
+def backfill(db: Session, user_id: Optional[int] = None) -> int:
+    """Rebuild rollups from the raw diary entries and commit."""
+    written = rebuild(db, user_id)
+    db.commit()
+    return written
+
+
+def main():
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Rebuild diary rollup tables from history")
+    parser.add_argument("--user-id", type=int, default=None, help="only rebuild this user's rollups")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        written = backfill(db, user_id=args.user_id)
+        print(f"Rebuilt rollups for {written} days")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,139 +1,161 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
-from typing import List, Dict, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, select
+from typing import Literal, Optional
 from datetime import datetime, timedelta
-from .. import models, schemas, security
-from ..database import get_db
-from collections import defaultdict
+from .. import analytics_engine, cohort, crud, data_version, models, risk, rollups, security, serialization
+from ..database import get_async_db
 
 router = APIRouter(prefix="/analytics", tags=["analytics"])
 
+def _day(value: Optional[datetime]):
+    """Rollups are kept per day, so range bounds are truncated to whole days."""
+    return value.date() if value else None
+
+Resolution = Literal["day", "week", "month"]
+Smoothing = Literal["none", "rolling", "ewma"]
+
 @router.get("/emotions/summary")
 async def get_emotions_summary(
+    request: Request,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
-    db: Session = Depends(get_db),
+    resolution: Resolution = "day",
+    smoothing: Smoothing = "none",
+    window: int = Query(7, ge=1, le=365),
+    alpha: float = Query(0.3, gt=0, le=1),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
     """Get summary of emotions over time."""
-    query = db.query(models.DiaryEntry).filter(
-        models.DiaryEntry.user_id == current_user.id
-    )
-    
-    if start_date:
-        query = query.filter(models.DiaryEntry.date >= start_date)
-    if end_date:
-        query = query.filter(models.DiaryEntry.date <= end_date)
-    
-    entries = query.order_by(models.DiaryEntry.date).all()
-    
-    # Process emotions data
-    emotion_trends = defaultdict(list)
-    dates = []
-    
-    for entry in entries:
-        dates.append(entry.date)
-        for emotion, intensity in entry.emotions.items():
-            emotion_trends[emotion].append(intensity)
-    
-    return {
-        "dates": dates,
-        "emotions": dict(emotion_trends)
-    }
+    async def build():
+        start, end = _day(start_date), _day(end_date)
+        columns = await db.run_sync(analytics_engine.DailyColumns.load, current_user.id, start, end)
+        trends = analytics_engine.emotion_trends(
+            columns, start, end,
+            resolution=resolution, smoothing=smoothing, window=window, alpha=alpha
+        )
+        return {"dates": trends["dates"], "emotions": trends["emotions"]}, {}
+
+    return await data_version.respond(request, db, current_user.id, build)
 
 @router.get("/behaviors/summary")
 async def get_behaviors_summary(
+    request: Request,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
     """Get summary of behavioral patterns."""
-    query = db.query(models.DiaryEntry).filter(
-        models.DiaryEntry.user_id == current_user.id
-    )
-    
-    if start_date:
-        query = query.filter(models.DiaryEntry.date >= start_date)
-    if end_date:
-        query = query.filter(models.DiaryEntry.date <= end_date)
-    
-    entries = query.all()
-    
-    behaviors_count = {
-        "self_harm": sum(1 for entry in entries if entry.self_harm),
-        "suicidal_thoughts": sum(1 for entry in entries if entry.suicidal_thoughts),
-        "stressful_events": sum(1 for entry in entries if entry.stressful_events),
-        "medications_taken": sum(1 for entry in entries if entry.medications_taken),
-    }
-    
-    total_entries = len(entries)
-    
-    return {
-        "counts": behaviors_count,
-        "total_entries": total_entries
-    }
+    async def build():
+        stats = await db.run_sync(rollups.totals, current_user.id, _day(start_date), _day(end_date))
+        behaviors_count = {
+            behavior: stats[f"{behavior}_count"] for behavior in rollups.BEHAVIORS
+        }
+        return {
+            "counts": behaviors_count,
+            "total_entries": stats["entry_count"],
+            "mood": {
+                "average": stats["mood_sum"] / stats["mood_count"] if stats["mood_count"] else None,
+                "min": stats["mood_min"],
+                "max": stats["mood_max"]
+            }
+        }, {}
+
+    return await data_version.respond(request, db, current_user.id, build)
+
+@router.get("/mood/correlations")
+async def get_mood_correlations(
+    request: Request,
+    patient_id: Optional[int] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    max_lag: int = Query(3, ge=0, le=14),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(security.get_current_active_user)
+):
+    """How mood relates to behaviors and emotions on the same day and the days after.
+
+    Therapists may ask for a patient's diary. Answers are cached per diary
+    version, so repeat views until the next entry change are a cache hit (or 304).
+    """
+    user_id = await security.resolve_diary_owner(db, current_user, patient_id)
+
+    async def build():
+        start, end = _day(start_date), _day(end_date)
+        columns = await db.run_sync(analytics_engine.DailyColumns.load, user_id, start, end)
+        return analytics_engine.mood_correlations(columns, start, end, max_lag=max_lag), {}
+
+    return await data_version.respond(request, db, user_id, build)
 
 @router.get("/therapist/patients/summary")
 async def get_patients_summary(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
     """Get summary of all patients' data (for therapists only)."""
     if not current_user.is_therapist:
         raise HTTPException(status_code=403, detail="Only therapists can access this endpoint")
     
-    # Get all patients for the therapist
-    patients = db.query(models.TherapistPatient).filter(
-        models.TherapistPatient.therapist_id == current_user.id
-    ).all()
+    now = datetime.now()
+    rows = await db.run_sync(crud.get_patients_summary, therapist_id=current_user.id, since=now - risk.RISK_WINDOW)
     
     patient_summaries = []
     
-    for patient_relation in patients:
-        patient = db.query(models.User).filter(
-            models.User.id == patient_relation.patient_id
-        ).first()
-        
-        # Get latest entry
-        latest_entry = db.query(models.DiaryEntry).filter(
-            models.DiaryEntry.user_id == patient.id
-        ).order_by(models.DiaryEntry.date.desc()).first()
-        
-        # Get entries from last week
-        week_ago = datetime.now() - timedelta(days=7)
-        recent_entries = db.query(models.DiaryEntry).filter(
-            and_(
-                models.DiaryEntry.user_id == patient.id,
-                models.DiaryEntry.date >= week_ago
-            )
-        ).all()
-        
-        # Calculate risk factors
-        risk_factors = []
-        if any(entry.self_harm for entry in recent_entries):
-            risk_factors.append("פגיעה עצמית")
-        if any(entry.suicidal_thoughts for entry in recent_entries):
-            risk_factors.append("מחשבות אובדניות")
-        
+    for row in rows:
+        risk_factors = risk.risk_factors(row, now)
         patient_summaries.append({
-            "patient_id": patient.id,
-            "name": patient.full_name,
-            "last_entry_date": latest_entry.date if latest_entry else None,
-            "entries_last_week": len(recent_entries),
+            "patient_id": row.patient_id,
+            "name": f"{row.first_name or ''} {row.last_name or ''}".strip(),
+            "last_entry_date": row.last_entry_date,
+            "entries_last_week": row.entries_last_week,
             "risk_factors": risk_factors,
             "needs_attention": len(risk_factors) > 0
         })
     
     return patient_summaries
 
+CohortColumn = Literal[cohort.COLUMNS]
+
+@router.get("/therapist/cohort", response_class=serialization.ORJSONResponse)
+async def get_cohort(
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    sort: CohortColumn = "patient_id",
+    descending: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(security.get_current_active_user)
+):
+    """Compare every patient of the therapist over a window (default: the last 90 days).
+
+    One row per patient, sorted by any column; rows without a value for it
+    come last.
+    """
+    if not current_user.is_therapist:
+        raise HTTPException(status_code=403, detail="Only therapists can access this endpoint")
+
+    end = _day(end_date) or datetime.now().date()
+    start = _day(start_date) or end - timedelta(days=89)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start_date is after end_date")
+
+    aggregates, series = await db.run_sync(cohort.load, current_user.id, start, end)
+    statistics = await cohort.compute_statistics(series, [row.patient_id for row in aggregates])
+    rows = cohort.table(aggregates, statistics, (end - start).days + 1)
+    return serialization.ORJSONResponse(cohort.sort_rows(rows, sort, descending))
+
 @router.get("/therapist/patient/{patient_id}/details")
 async def get_patient_details(
+    request: Request,
     patient_id: int,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
-    db: Session = Depends(get_db),
+    resolution: Resolution = "day",
+    smoothing: Smoothing = "none",
+    window: int = Query(7, ge=1, le=365),
+    alpha: float = Query(0.3, gt=0, le=1),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
     """Get detailed analysis for a specific patient (for therapists only)."""
@@ -141,50 +163,25 @@ async def get_patient_details(
         raise HTTPException(status_code=403, detail="Only therapists can access this endpoint")
     
     # Verify therapist-patient relationship
-    relationship = db.query(models.TherapistPatient).filter(
-        and_(
-            models.TherapistPatient.therapist_id == current_user.id,
-            models.TherapistPatient.patient_id == patient_id
+    relationship = await db.scalar(
+        select(models.TherapistPatient).where(
+            and_(
+                models.TherapistPatient.therapist_id == current_user.id,
+                models.TherapistPatient.patient_id == patient_id
+            )
         )
-    ).first()
+    )
     
     if not relationship:
         raise HTTPException(status_code=404, detail="Patient not found")
     
-    # Get patient's entries
-    query = db.query(models.DiaryEntry).filter(
-        models.DiaryEntry.user_id == patient_id
-    )
-    
-    if start_date:
-        query = query.filter(models.DiaryEntry.date >= start_date)
-    if end_date:
-        query = query.filter(models.DiaryEntry.date <= end_date)
-    
-    entries = query.order_by(models.DiaryEntry.date).all()
-    
-    # Process data
-    emotion_trends = defaultdict(list)
-    dates = []
-    behaviors = {
-        "self_harm": [],
-        "suicidal_thoughts": [],
-        "stressful_events": [],
-        "medications_taken": []
-    }
-    
-    for entry in entries:
-        dates.append(entry.date)
-        for emotion, intensity in entry.emotions.items():
-            emotion_trends[emotion].append(intensity)
-        
-        behaviors["self_harm"].append(entry.self_harm)
-        behaviors["suicidal_thoughts"].append(entry.suicidal_thoughts)
-        behaviors["stressful_events"].append(entry.stressful_events)
-        behaviors["medications_taken"].append(entry.medications_taken)
-    
-    return {
-        "dates": dates,
-        "emotions": dict(emotion_trends),
-        "behaviors": behaviors
-    }
+    # Get patient's trends
+    async def build():
+        start, end = _day(start_date), _day(end_date)
+        columns = await db.run_sync(analytics_engine.DailyColumns.load, patient_id, start, end)
+        return analytics_engine.emotion_trends(
+            columns, start, end,
+            resolution=resolution, smoothing=smoothing, window=window, alpha=alpha
+        ), {}
+
+    return await data_version.respond(request, db, patient_id, build)
@@ -5,13 +5,12 @@ from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 from typing import Any
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 
 from .. import models
+from ..auth import check_password_and_update, hash_password
 from ..database import get_db
+from ..principal_cache import principal_cache
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 # Constants
@@ -19,20 +18,10 @@ SECRET_KEY = "your-secret-key-here"  # In production, use environment variable
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    logger.debug(f"Verifying password...")
-    result = pwd_context.verify(plain_password, hashed_password)
-    logger.debug(f"Password verification result: {result}")
-    return result
-
 def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
     to_encode = data.copy()
     if expires_delta:
@@ -49,6 +38,11 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    cache_key = (SECRET_KEY, token)
+    cached = principal_cache.get(cache_key)
+    if cached is not None:
+        return db.merge(cached, load=False)
+    
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
@@ -60,6 +54,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     user = db.query(models.User).filter(models.User.email == email).first()
     if user is None:
         raise credentials_exception
+    principal_cache.put(cache_key, user, token_expires_at=payload.get("exp"))
     return user
 
 @router.post("/register")
@@ -71,7 +66,7 @@ async def register(
     user_type: str = "PATIENT",
     db: Session = Depends(get_db)
 ) -> dict:
-    logger.info(f"Registration attempt for user: {email}")
+    logger.info("Registration attempt for user: %s", email)
     
     # Check if user exists
     if db.query(models.User).filter(models.User.email == email).first():
@@ -81,7 +76,7 @@ async def register(
         )
     
     # Create new user
-    hashed_password = get_password_hash(password)
+    hashed_password = await hash_password(password)
     db_user = models.User(
         email=email,
         hashed_password=hashed_password,
@@ -106,7 +101,7 @@ async def register(
         db.add(patient_profile)
         db.commit()
     
-    logger.info(f"Registration successful for user: {email}")
+    logger.info("Registration successful for user: %s", email)
     
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -132,31 +127,34 @@ async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(get_db)
 ) -> dict:
-    logger.info(f"Login attempt for user: {form_data.username}")
-    logger.debug(f"Form data: {form_data}")
+    logger.debug("Login attempt for user: %s", form_data.username)
     
     # Find user
     user = db.query(models.User).filter(models.User.email == form_data.username).first()
     if not user:
-        logger.warning(f"Login failed: User not found - {form_data.username}")
+        logger.warning("Login failed: User not found - %s", form_data.username)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    logger.debug(f"Found user: {user.email}, {user.first_name} {user.last_name}, {user.user_type}")
-    
     # Verify password
-    if not verify_password(form_data.password, user.hashed_password):
-        logger.warning(f"Login failed: Incorrect password for user - {form_data.username}")
+    verified, new_hash = await check_password_and_update(form_data.password, user.hashed_password)
+    if not verified:
+        logger.warning("Login failed: Incorrect password for user - %s", form_data.username)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    logger.info(f"Login successful for user: {form_data.username}")
+    if new_hash:
+        # The configured bcrypt cost changed since this hash was made
+        user.hashed_password = new_hash
+        db.commit()
+    
+    logger.debug("Login successful for user: %s", form_data.username)
     
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -176,7 +174,6 @@ async def login(
             "last_name": user.last_name,
         }
     }
-    logger.debug(f"Response data: {response_data}")
     return response_data
 
 @router.get("/me")
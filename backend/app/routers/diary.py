@@ -1,23 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List, Optional
-from datetime import datetime, date
-from .. import models, schemas, security
-from ..database import get_db
+from typing import List, Literal, Optional
+from datetime import datetime, date, time
+from .. import archive, data_version, diary_export, diary_import, emotions, models, risk, rollups, schemas, security, serialization
+from ..database import get_async_db
+from ..pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, cursor_headers, keyset_page
 
 router = APIRouter(prefix="/diary", tags=["diary"])
 
 @router.post("/entries", response_model=schemas.DiaryEntry)
 async def create_diary_entry(
     entry: schemas.DiaryEntryCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
+    # Entries of archived months come back first so the check and rollups see them
+    await db.run_sync(archive.restore_dates, current_user.id, [entry.date])
     # Check if entry already exists for this date
-    existing_entry = db.query(models.DiaryEntry).filter(
-        models.DiaryEntry.user_id == current_user.id,
-        models.DiaryEntry.date == entry.date
-    ).first()
+    existing_entry = await db.scalar(
+        select(models.DiaryEntry.id).where(
+            models.DiaryEntry.user_id == current_user.id,
+            models.DiaryEntry.date == entry.date
+        ).limit(1)
+    )
     
     if existing_entry:
         raise HTTPException(
@@ -27,38 +35,126 @@ async def create_diary_entry(
     
     db_entry = models.DiaryEntry(**entry.dict(), user_id=current_user.id)
     db.add(db_entry)
-    db.commit()
-    db.refresh(db_entry)
+    await db.run_sync(rollups.refresh_entry, db_entry)
+    await db.run_sync(risk.evaluate, current_user.id)
+    await db.commit()
+    await db.refresh(db_entry)
     return db_entry
 
-@router.get("/entries", response_model=List[schemas.DiaryEntry])
+@router.post("/entries/import")
+async def import_diary_entries(
+    request: Request,
+    format: Optional[Literal["ndjson", "csv"]] = None,
+    on_conflict: Literal["skip", "overwrite", "fail"] = "skip",
+    patient_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(security.get_current_active_user)
+):
+    """Bulk import entries from a streamed NDJSON or CSV body (one entry per line/record)."""
+    user_id = await security.resolve_diary_owner(db, current_user, patient_id)
+    try:
+        return await diary_import.import_entries(
+            db, user_id, request.stream(),
+            format=format or diary_import.detect_format(request.headers.get("content-type")),
+            on_conflict=on_conflict
+        )
+    except diary_import.ImportConflict as conflict:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Entry already exists for this date", "row": conflict.row, "date": conflict.date.isoformat()}
+        )
+
+@router.get("/entries", response_model=List[schemas.DiaryEntry], response_class=serialization.ORJSONResponse)
 async def get_diary_entries(
+    request: Request,
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
-    db: Session = Depends(get_db),
+    emotion: Optional[str] = None,
+    min_intensity: Optional[float] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
-    query = db.query(models.DiaryEntry).filter(
-        models.DiaryEntry.user_id == current_user.id
-    )
-    
-    if start_date:
-        query = query.filter(models.DiaryEntry.date >= start_date)
-    if end_date:
-        query = query.filter(models.DiaryEntry.date <= end_date)
+    def load_page(session: Session):
+        query = session.query(*serialization.columns_for(schemas.DiaryEntry, models.DiaryEntry)).filter(
+            models.DiaryEntry.user_id == current_user.id
+        )
+        
+        if start_date:
+            query = query.filter(models.DiaryEntry.date >= start_date)
+        if end_date:
+            query = query.filter(models.DiaryEntry.date <= end_date)
+        if emotion:
+            query = query.filter(emotions.has_emotion(emotion, min_intensity))
+
+        def archived(lower, upper, count, newest_first):
+            return archive.page(
+                session, current_user.id, list(schemas.DiaryEntry.model_fields), count,
+                lower, upper, newest_first,
+                start=start_date and datetime.combine(start_date, time.min),
+                end=end_date and datetime.combine(end_date, time.min),
+                emotion=emotion, min_intensity=min_intensity
+            )
+        
+        return keyset_page(
+            query, models.DiaryEntry.date, models.DiaryEntry.id,
+            limit=limit, after=after, before=before, extra=archived
+        )
     
-    return query.order_by(models.DiaryEntry.date.desc()).all()
+    async def build():
+        rows, next_cursor, prev_cursor = await db.run_sync(load_page)
+        page = serialization.row_dicts(rows)
+        # The only stored value not already in the response shape: legacy lists of emotion names
+        for entry in page:
+            entry["emotions"] = schemas.DiaryEntry.parse_emotions(entry["emotions"])
+        return page, cursor_headers(next_cursor, prev_cursor)
+
+    return await data_version.respond(request, db, current_user.id, build)
+
+@router.get("/emotions", response_model=List[schemas.EmotionUsage])
+async def get_emotion_vocabulary(
+    patient_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(security.get_current_active_user)
+):
+    """Emotions reported in a diary, most used first (therapists may ask for a patient's)."""
+    user_id = await security.resolve_diary_owner(db, current_user, patient_id)
+    return await db.run_sync(emotions.vocabulary, [user_id])
+
+@router.get("/entries/export")
+async def export_diary_entries(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    patient_id: Optional[int] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(security.get_current_active_user)
+):
+    """Stream a diary as NDJSON or CSV (therapists may export a patient's diary)."""
+    user_id = await security.resolve_diary_owner(db, current_user, patient_id)
+    return StreamingResponse(
+        diary_export.export_entries(user_id, format, start_date, end_date),
+        media_type=diary_export.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="diary-{user_id}.{format}"'}
+    )
 
 @router.get("/entries/{entry_id}", response_model=schemas.DiaryEntry)
 async def get_diary_entry(
     entry_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
-    entry = db.query(models.DiaryEntry).filter(
-        models.DiaryEntry.id == entry_id,
-        models.DiaryEntry.user_id == current_user.id
-    ).first()
+    entry = await db.scalar(
+        select(models.DiaryEntry).where(
+            models.DiaryEntry.id == entry_id,
+            models.DiaryEntry.user_id == current_user.id
+        )
+    )
+    if not entry:
+        archived = await db.run_sync(archive.entry, current_user.id, entry_id)
+        entry = archived and archived._asdict()
     
     if not entry:
         raise HTTPException(
@@ -68,17 +164,25 @@ async def get_diary_entry(
     
     return entry
 
+async def _writable_entry(db: AsyncSession, user_id: int, entry_id: int) -> Optional[models.DiaryEntry]:
+    """`user_id`'s entry `entry_id`, restoring its month first if it is archived."""
+    query = select(models.DiaryEntry).where(
+        models.DiaryEntry.id == entry_id,
+        models.DiaryEntry.user_id == user_id
+    )
+    entry = await db.scalar(query)
+    if entry is None and await db.run_sync(archive.restore_entry, user_id, entry_id):
+        entry = await db.scalar(query)
+    return entry
+
 @router.put("/entries/{entry_id}", response_model=schemas.DiaryEntry)
 async def update_diary_entry(
     entry_id: int,
     entry_update: schemas.DiaryEntryCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
-    entry = db.query(models.DiaryEntry).filter(
-        models.DiaryEntry.id == entry_id,
-        models.DiaryEntry.user_id == current_user.id
-    ).first()
+    entry = await _writable_entry(db, current_user.id, entry_id)
     
     if not entry:
         raise HTTPException(
@@ -86,23 +190,24 @@ async def update_diary_entry(
             detail="Entry not found"
         )
     
+    await db.run_sync(archive.restore_dates, current_user.id, [entry_update.date])
+    previous_date = entry.date
     for key, value in entry_update.dict().items():
         setattr(entry, key, value)
     
-    db.commit()
-    db.refresh(entry)
+    await db.run_sync(rollups.refresh_entry, entry, previous_date=previous_date)
+    await db.run_sync(risk.evaluate, current_user.id)
+    await db.commit()
+    await db.refresh(entry)
     return entry
 
 @router.delete("/entries/{entry_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_diary_entry(
     entry_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
-    entry = db.query(models.DiaryEntry).filter(
-        models.DiaryEntry.id == entry_id,
-        models.DiaryEntry.user_id == current_user.id
-    ).first()
+    entry = await _writable_entry(db, current_user.id, entry_id)
     
     if not entry:
         raise HTTPException(
@@ -110,6 +215,8 @@ async def delete_diary_entry(
             detail="Entry not found"
         )
     
-    db.delete(entry)
-    db.commit()
+    await db.delete(entry)
+    await db.run_sync(rollups.refresh_entry, entry)
+    await db.run_sync(risk.evaluate, current_user.id)
+    await db.commit()
     return None
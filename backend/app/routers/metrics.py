@@ -0,0 +1,23 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import auth, data_version, events, metrics, outbox
+from ..database import get_async_db, pool_stats
+from ..principal_cache import principal_cache
+
+router = APIRouter(tags=["metrics"])
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(db: AsyncSession = Depends(get_async_db)):
+    """Request, database pool, cache, hashing and outbox metrics in the Prometheus text format."""
+    gauges = {
+        f"db_pool_{name}": (stats, "Database connection pool state and checkout counters.")
+        for name, stats in pool_stats().items()
+    }
+    gauges["principal_cache"] = (principal_cache.stats(), "Authenticated principal cache counters.")
+    gauges["response_cache"] = (data_version.response_cache.stats(), "Versioned response cache counters.")
+    gauges["password_hashing"] = (auth.hashing_stats(), "Password hashing pool counters.")
+    gauges["notification_streams"] = (events.hub.stats(), "Open notification streams and events delivered to them.")
+    gauges["event_broker"] = (events.broker.stats(), "Event broker connection and message counters.")
+    gauges["outbox"] = (await db.run_sync(outbox.stats), "Email outbox depth and delivery lag.")
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,57 +1,35 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+import json
+import os
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import insert, select
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
 from typing import List, Optional
-from datetime import datetime, timedelta
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
-from .. import models, schemas, security
-from ..database import get_db
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
+from datetime import datetime, time, timedelta
+from .. import events, mailer, models, outbox, risk, schemas, security, serialization, unread
+from ..database import AsyncSessionLocal, get_async_db
+from ..pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, cursor_headers, keyset_page
 
 router = APIRouter(prefix="/notifications", tags=["notifications"])
 
-# Email configuration
-conf = ConnectionConfig(
-    MAIL_USERNAME=os.getenv("MAIL_USERNAME"),
-    MAIL_PASSWORD=os.getenv("MAIL_PASSWORD"),
-    MAIL_FROM=os.getenv("MAIL_FROM"),
-    MAIL_PORT=int(os.getenv("MAIL_PORT", 587)),
-    MAIL_SERVER=os.getenv("MAIL_SERVER"),
-    MAIL_STARTTLS=True,
-    MAIL_SSL_TLS=False,
-    USE_CREDENTIALS=True
-)
-
-fastmail = FastMail(conf)
-
-async def send_email_notification(
-    email_to: str,
-    subject: str,
-    body: str
-):
-    message = MessageSchema(
-        subject=subject,
-        recipients=[email_to],
-        body=body,
-        subtype="html"
-    )
-    await fastmail.send_message(message)
+# Comment lines sent on idle streams so proxies keep them open
+STREAM_HEARTBEAT_SECONDS = float(os.getenv("STREAM_HEARTBEAT_SECONDS", 15))
 
 @router.post("/settings")
 async def update_notification_settings(
     reminder_time: str,
     email_notifications: bool,
     push_notifications: bool,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
     """Update user's notification preferences."""
-    settings = db.query(models.NotificationSettings).filter(
-        models.NotificationSettings.user_id == current_user.id
-    ).first()
+    settings = await db.scalar(
+        select(models.NotificationSettings).where(
+            models.NotificationSettings.user_id == current_user.id
+        )
+    )
     
     if not settings:
         settings = models.NotificationSettings(
@@ -66,138 +44,226 @@ async def update_notification_settings(
         settings.email_notifications = email_notifications
         settings.push_notifications = push_notifications
     
-    db.commit()
+    await db.commit()
     return {"message": "הגדרות ההתראות עודכנו בהצלחה"}
 
-@router.get("/unread")
+@router.get("/unread", response_model=List[schemas.Notification], response_class=serialization.ORJSONResponse)
 async def get_unread_notifications(
-    db: Session = Depends(get_db),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
-    """Get user's unread notifications."""
-    notifications = db.query(models.Notification).filter(
-        and_(
+    """Get user's unread notifications, newest first, one keyset page at a time."""
+    def load_page(session: Session):
+        query = session.query(*serialization.columns_for(schemas.Notification, models.Notification)).filter(
             models.Notification.user_id == current_user.id,
             models.Notification.is_read == False
         )
-    ).order_by(models.Notification.created_at.desc()).all()
-    
-    return notifications
+        return keyset_page(
+            query, models.Notification.created_at, models.Notification.id,
+            limit=limit, after=after, before=before
+        )
+
+    rows, next_cursor, prev_cursor = await db.run_sync(load_page)
+    return serialization.ORJSONResponse(
+        serialization.row_dicts(rows), headers=cursor_headers(next_cursor, prev_cursor)
+    )
+
+@router.get("/unread/count", response_model=schemas.UnreadCount)
+async def get_unread_count(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(security.get_current_active_user)
+):
+    """Number of unread notifications, for badges."""
+    return {"unread": await db.run_sync(unread.count, current_user.id)}
+
+def _sse(event: dict) -> str:
+    return f"id: {event['id']}\nevent: notification\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+@router.get("/stream")
+async def stream_notifications(
+    access_token: Optional[str] = Query(None),
+    authorization: Optional[str] = Header(None),
+    last_event_id: Optional[int] = Header(None)
+):
+    """Server-sent events: each new notification of the user as it is committed.
+
+    EventSource cannot set headers, so the token may also come as
+    ?access_token=. On reconnect (Last-Event-ID) unread notifications
+    created since that id are replayed first. The stream holds no database
+    connection while open.
+    """
+    token = access_token
+    if token is None and authorization and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    if not token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated",
+                            headers={"WWW-Authenticate": "Bearer"})
+    async with AsyncSessionLocal() as db:
+        current_user = await security.get_current_user(token=token, db=db)
+        user_id = current_user.id
+
+    subscription = await events.subscribe(user_id)
+    missed = []
+    try:
+        if last_event_id is not None:
+            async with AsyncSessionLocal() as db:
+                missed = (await db.execute(
+                    select(models.Notification).where(
+                        models.Notification.user_id == user_id,
+                        models.Notification.id > last_event_id,
+                        models.Notification.is_read == False
+                    ).order_by(models.Notification.id)
+                )).scalars().all()
+    except Exception:
+        events.hub.unsubscribe(subscription)
+        raise
+
+    async def stream():
+        try:
+            yield f"retry: {int(events.EVENT_RECONNECT_SECONDS * 1000)}\n\n"
+            replayed = set()
+            for notification in missed:
+                replayed.add(notification.id)
+                yield _sse(events.notification_event(notification)["event"])
+            while True:
+                batch = await subscription.next_batch(STREAM_HEARTBEAT_SECONDS)
+                if subscription.overflowed:
+                    # The client reconnects with Last-Event-ID and catches up from the database
+                    break
+                if not batch:
+                    yield ": keepalive\n\n"
+                for event in batch:
+                    # Committed while the replay query ran
+                    if event["id"] not in replayed:
+                        yield _sse(event)
+        finally:
+            events.hub.unsubscribe(subscription)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+@router.post("/mark-read")
+async def mark_notifications_as_read(
+    selection: schemas.MarkNotificationsRead,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(security.get_current_active_user)
+):
+    """Mark the given notifications, or all up to an id, as read in one statement."""
+    if (selection.ids is None) == (selection.up_to is None):
+        raise HTTPException(status_code=400, detail="Use either 'ids' or 'up_to'")
+    if selection.ids is not None and len(selection.ids) > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_PAGE_SIZE} ids per request")
+
+    marked = await db.run_sync(unread.mark_read, current_user.id, selection.ids, selection.up_to)
+    remaining = await db.run_sync(unread.count, current_user.id)
+    await db.commit()
+    return {"marked": marked, "unread": remaining}
 
 @router.post("/mark-read/{notification_id}")
 async def mark_notification_as_read(
     notification_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(security.get_current_active_user)
 ):
     """Mark a notification as read."""
-    notification = db.query(models.Notification).filter(
-        and_(
-            models.Notification.id == notification_id,
-            models.Notification.user_id == current_user.id
+    if not await db.run_sync(unread.mark_read, current_user.id, [notification_id]):
+        exists = await db.scalar(
+            select(models.Notification.id).where(
+                models.Notification.id == notification_id,
+                models.Notification.user_id == current_user.id
+            )
         )
-    ).first()
-    
-    if not notification:
-        raise HTTPException(status_code=404, detail="התראה לא נמצאה")
-    
-    notification.is_read = True
-    db.commit()
+        if not exists:
+            raise HTTPException(status_code=404, detail="התראה לא נמצאה")
+
+    await db.commit()
     return {"message": "ההתראה סומנה כנקראה"}
 
+REMINDER_MESSAGE = "אל תשכח/י למלא את היומן הרגשי היום"
+REMINDER_SUBJECT = "תזכורת - יומן רגשי"
+
+def reminder_email_body(name: str) -> str:
+    return f"""
+    <h2>שלום {name},</h2>
+    <p>זוהי תזכורת ידידותית למלא את היומן הרגשי היומי שלך.</p>
+    <p>מילוי היומן באופן קבוע יעזור לך ולמטפל שלך לעקוב אחר ההתקדמות שלך.</p>
+    """
+
+def due_reminders_query(reminder_time: str, day_start: datetime):
+    """Users due a reminder at `reminder_time` with no diary entry since `day_start`."""
+    has_entry_today = select(models.DiaryEntry.id).where(
+        models.DiaryEntry.user_id == models.NotificationSettings.user_id,
+        models.DiaryEntry.date >= day_start
+    ).exists()
+    return select(
+        models.User.id,
+        models.User.email,
+        models.User.first_name,
+        models.User.last_name,
+        models.NotificationSettings.email_notifications
+    ).join(
+        models.NotificationSettings, models.NotificationSettings.user_id == models.User.id
+    ).where(
+        models.NotificationSettings.reminder_time == reminder_time,
+        ~has_entry_today
+    )
+
 @router.post("/send-reminders")
 async def send_daily_reminders(
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(security.get_current_active_user)
 ):
-    """Send daily reminders to users who haven't filled their diary yet."""
-    current_time = datetime.now().strftime("%H:%M")
-    
-    # Get users who have reminder set for current time
-    settings = db.query(models.NotificationSettings).filter(
-        models.NotificationSettings.reminder_time == current_time
-    ).all()
-    
-    for setting in settings:
-        user = db.query(models.User).filter(models.User.id == setting.user_id).first()
-        
-        # Check if user has already filled diary today
-        today_entry = db.query(models.DiaryEntry).filter(
-            and_(
-                models.DiaryEntry.user_id == user.id,
-                models.DiaryEntry.date >= datetime.now().date()
-            )
-        ).first()
-        
-        if not today_entry:
-            # Create notification
-            notification = models.Notification(
-                user_id=user.id,
-                type="reminder",
-                message="אל תשכח/י למלא את היומן הרגשי היום"
-            )
-            db.add(notification)
-            
-            # Send email if enabled
-            if setting.email_notifications:
-                background_tasks.add_task(
-                    send_email_notification,
-                    user.email,
-                    "תזכורת - יומן רגשי",
-                    f"""
-                    <h2>שלום {user.full_name},</h2>
-                    <p>זוהי תזכורת ידידותית למלא את היומן הרגשי היומי שלך.</p>
-                    <p>מילוי היומן באופן קבוע יעזור לך ולמטפל שלך לעקוב אחר ההתקדמות שלך.</p>
-                    """
-                )
-    
-    db.commit()
-    return {"message": "התזכורות נשלחו בהצלחה"}
+    """Send daily reminders to users who haven't filled their diary yet. Therapists only."""
+    if not current_user.is_therapist:
+        raise HTTPException(status_code=403, detail="Only therapists can access this endpoint")
+    now = datetime.now()
+    day_start = datetime.combine(now.date(), time.min)
+    due = (await db.execute(due_reminders_query(now.strftime("%H:%M"), day_start))).all()
+
+    if due:
+        notifications = (await db.execute(
+            insert(models.Notification).returning(
+                models.Notification.id,
+                models.Notification.user_id,
+                models.Notification.type,
+                models.Notification.message,
+                models.Notification.created_at
+            ),
+            [{"user_id": row.id, "type": "reminder", "message": REMINDER_MESSAGE} for row in due]
+        )).all()
+        await db.run_sync(unread.created, notifications)
+        events.queue(db.sync_session, notifications)
+    emails = await db.run_sync(outbox.enqueue, (
+        mailer.OutgoingEmail(
+            row.email,
+            REMINDER_SUBJECT,
+            reminder_email_body(f"{row.first_name or ''} {row.last_name or ''}".strip())
+        )
+        for row in due
+        if row.email_notifications
+    ))
+    await db.commit()
+    return {"message": "התזכורות נשלחו בהצלחה", "reminders": len(due), "emails": emails}
 
 @router.post("/alert-therapist")
 async def send_therapist_alert(
-    background_tasks: BackgroundTasks,
     patient_id: int,
     alert_type: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(security.get_current_active_user)
 ):
-    """Send alert to therapist about concerning patient behavior."""
-    # Get patient and therapist
-    relationship = db.query(models.TherapistPatient).filter(
-        models.TherapistPatient.patient_id == patient_id
-    ).first()
-    
-    if not relationship:
+    """Send alert to therapist about concerning patient behavior.
+
+    Patients raise alerts about themselves, therapists about their own patients.
+    """
+    patient_id = await security.resolve_diary_owner(db, current_user, patient_id)
+    if not await db.run_sync(risk.alert_therapists, patient_id, alert_type):
         return
     
-    therapist = db.query(models.User).filter(
-        models.User.id == relationship.therapist_id
-    ).first()
-    
-    patient = db.query(models.User).filter(
-        models.User.id == patient_id
-    ).first()
-    
-    # Create notification for therapist
-    notification = models.Notification(
-        user_id=therapist.id,
-        type="alert",
-        message=f"התראה: {alert_type} אצל המטופל/ת {patient.full_name}"
-    )
-    db.add(notification)
-    
-    # Send email to therapist
-    background_tasks.add_task(
-        send_email_notification,
-        therapist.email,
-        f"התראה דחופה - {patient.full_name}",
-        f"""
-        <h2>שלום {therapist.full_name},</h2>
-        <p>התקבלה התראה חשובה לגבי המטופל/ת {patient.full_name}:</p>
-        <p><strong>{alert_type}</strong></p>
-        <p>אנא בדוק/י את המערכת בהקדם האפשרי.</p>
-        """
-    )
-    
-    db.commit()
+    await db.commit()
     return {"message": "ההתראה נשלחה למטפל בהצלחה"}
@@ -0,0 +1,50 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from .. import archive, models, search, security
+from ..database import get_async_db
+
+router = APIRouter(prefix="/search", tags=["search"])
+
+@router.get("/entries")
+async def search_diary_entries(
+    q: str = Query(..., min_length=1, max_length=200),
+    patient_id: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=50),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(security.get_current_active_user)
+):
+    """Ranked full-text search over diary text, with highlighted snippets.
+
+    Therapists search one patient with patient_id, or their whole roster without it.
+    Archived entries (app.archive) are not searched: archived_entries_excluded
+    counts them and archived_through is the date of the latest one.
+    """
+    if patient_id is None and current_user.is_therapist:
+        user_ids = await security.roster_patient_ids(db, current_user.id)
+    else:
+        user_ids = [await security.resolve_diary_owner(db, current_user, patient_id)]
+
+    rows = await db.run_sync(search.search, user_ids, q, limit, offset)
+    results = [
+        {
+            "entry_id": row.id,
+            "user_id": row.user_id,
+            "date": row.date,
+            "score": round(row.score, 4),
+            "snippets": {
+                field: snippet
+                for field in search.SEARCH_FIELDS
+                if (snippet := search.highlight(getattr(row, field), q)) is not None
+            }
+        }
+        for row in rows[:limit]
+    ]
+    archived, archived_through = await db.run_sync(archive.coverage, user_ids)
+    return {
+        "results": results,
+        "next_offset": offset + limit if len(rows) > limit else None,
+        "archived_entries_excluded": archived,
+        "archived_through": archived_through,
+    }
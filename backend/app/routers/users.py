@@ -1,11 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request, Body
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from datetime import datetime
 from typing import Any, Dict
 
-from .. import models, schemas
+from .. import manage, models, schemas, serialization
 from ..database import get_db
-from ..auth import get_password_hash
+from ..auth import hash_password
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -26,7 +27,7 @@ async def create_user(
             )
         
         # Create new user
-        hashed_password = get_password_hash(body["password"])
+        hashed_password = await hash_password(body["password"])
         
         db_user = models.User(
             email=body["email"],
@@ -71,21 +72,11 @@ async def create_user(
             detail=f"Error creating user: {str(e)}"
         )
 
-@router.get("/")
+@router.get("/", response_class=serialization.ORJSONResponse)
 async def get_users(db: Session = Depends(get_db)):
     try:
-        users = db.query(models.User).all()
-        return [
-            {
-                "id": user.id,
-                "email": user.email,
-                "first_name": user.first_name,
-                "last_name": user.last_name,
-                "user_type": user.user_type,
-                "created_at": user.created_at
-            }
-            for user in users
-        ]
+        rows = db.execute(select(*serialization.columns_for(schemas.User, models.User))).all()
+        return serialization.ORJSONResponse(serialization.row_dicts(rows))
     except Exception as e:
         print(f"Error getting users: {str(e)}")
         raise HTTPException(
@@ -133,34 +124,9 @@ async def init_demo_users(db: Session = Depends(get_db)):
 # Initialize admin user
 @router.post("/init-admin")
 async def init_admin(db: Session = Depends(get_db)):
-    admin_email = "admin@admin.com"
-    if not db.query(models.User).filter(models.User.email == admin_email).first():
+    if not manage.admin_exists(db):
         try:
-            # Create admin user
-            hashed_password = get_password_hash("Admin123")
-            admin_user = models.User(
-                email=admin_email,
-                hashed_password=hashed_password,
-                first_name="Admin",
-                last_name="User",
-                user_type="THERAPIST",  # Admin will be a therapist
-                created_at=datetime.utcnow()
-            )
-            
-            db.add(admin_user)
-            db.commit()
-            db.refresh(admin_user)
-            
-            # Create therapist profile for admin
-            therapist_profile = models.Therapist(
-                user_id=admin_user.id,
-                license_number="ADMIN-LICENSE",
-                specialization="System Administrator",
-                years_of_experience=99
-            )
-            db.add(therapist_profile)
-            db.commit()
-            
+            manage.create_admin(db, await hash_password(manage.ADMIN_PASSWORD))
             return {"message": "Admin user created successfully"}
         except Exception as e:
             db.rollback()
@@ -1,6 +1,7 @@
-from pydantic import BaseModel, EmailStr
-from datetime import datetime
-from typing import Optional, List
+import json
+from pydantic import BaseModel, EmailStr, field_validator
+from datetime import date as date_type, datetime
+from typing import Dict, Optional, List
 from .models import UserType
 
 class UserBase(BaseModel):
@@ -81,15 +82,52 @@ class Therapist(TherapistBase):
         from_attributes = True
 
 class DiaryEntryBase(BaseModel):
-    mood: int
-    content: str
-    activities: str
-    thoughts: str
-    emotions: List[str]
+    date: datetime
+    mood: Optional[int] = None
+    # Emotion name -> intensity; the intensity may be omitted
+    emotions: Dict[str, Optional[float]] = {}
+    medications_taken: bool = False
+    medications_notes: Optional[str] = None
+    self_harm: bool = False
+    suicidal_thoughts: bool = False
+    stressful_events: bool = False
+    notes: Optional[str] = None
+
+    @field_validator("emotions", mode="before")
+    @classmethod
+    def parse_emotions(cls, value):
+        # Older entries and clients list emotion names without intensities
+        if isinstance(value, list):
+            return {name: None for name in value}
+        return value or {}
 
 class DiaryEntryCreate(DiaryEntryBase):
     pass
 
+class DiaryEntryImportRow(DiaryEntryBase):
+    """One row of a bulk diary import, mirroring the stored entry columns."""
+
+    @field_validator("date", mode="before")
+    @classmethod
+    def parse_date(cls, value):
+        # Historical records are often dated by day only
+        if isinstance(value, str) and len(value.strip()) == 10:
+            return datetime.combine(date_type.fromisoformat(value.strip()), datetime.min.time())
+        return value
+
+    @field_validator("emotions", mode="before")
+    @classmethod
+    def parse_emotions(cls, value):
+        # CSV cells carry the emotions mapping as a JSON string
+        if isinstance(value, str):
+            value = json.loads(value) if value.strip() else {}
+        return super().parse_emotions(value)
+
+class EmotionUsage(BaseModel):
+    name: str
+    entries: int
+    average_intensity: Optional[float] = None
+
 class DiaryEntry(DiaryEntryBase):
     id: int
     user_id: int
@@ -97,3 +135,22 @@ class DiaryEntry(DiaryEntryBase):
 
     class Config:
         from_attributes = True
+
+class Notification(BaseModel):
+    id: int
+    user_id: int
+    type: str
+    message: str
+    is_read: bool
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class UnreadCount(BaseModel):
+    unread: int
+
+class MarkNotificationsRead(BaseModel):
+    """Either explicit ids, or every notification with an id up to `up_to` (e.g. the stream's last event id)."""
+    ids: Optional[List[int]] = None
+    up_to: Optional[int] = None
@@ -0,0 +1,275 @@
+"""Full-text search over diary entry text.
+
+Entries' free-text fields (SEARCH_FIELDS) are indexed in `diary_search`:
+an FTS5 virtual table keyed by entry id on SQLite, or a tsvector column
+with a GIN index on PostgreSQL. Neither engine's tokenizer knows Hebrew, so
+text is normalized here before it reaches the index:
+
+* niqqud, cantillation marks and geresh/gershayim are removed and final
+  letters are mapped to their regular forms;
+* every word is also indexed without up to three leading one-letter
+  prefixes (ו ה ב כ ל מ ש), so "ובחרדה" is found when searching "חרדה".
+
+Query words get the same treatment, and a word matches if any of its forms
+does. Snippets are highlighted in Python from the original text of the
+returned page only.
+
+The index follows ORM inserts, updates and deletes of DiaryEntry. Bulk Core
+statements bypass those events and must call reindex() (or unindex() before
+deleting); to rebuild it from scratch:
+
+    python -m app.search [--user-id ID]
+"""
+import argparse
+import html
+import re
+from typing import Iterable, List, Optional, Sequence, Set
+
+from sqlalchemy import DateTime, Float, Integer, String, bindparam, column, delete, event, inspect, select, table, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from . import models
+
+SEARCH_FIELDS = ("notes", "medications_notes")
+PREFIX_LETTERS = set("והבכלמש")
+MAX_PREFIX = 3
+MIN_STEM = 2
+SNIPPET_WORDS = 8
+
+_WORD = re.compile(r"[\w\u0591-\u05C7\u05F3\u05F4]+")
+_MARKS = re.compile(r"[\u0591-\u05C7\u05F3\u05F4_]")
+_FINALS = str.maketrans("ךםןףץ", "כמנפצ")
+
+
+def normalize(word: str) -> str:
+    return _MARKS.sub("", word).translate(_FINALS).lower()
+
+
+def word_forms(word: str) -> Set[str]:
+    """The normalized word plus its forms with leading Hebrew prefixes removed."""
+    word = normalize(word)
+    forms = {word} if word else set()
+    for length in range(1, MAX_PREFIX + 1):
+        if len(word) - length < MIN_STEM or word[length - 1] not in PREFIX_LETTERS:
+            break
+        forms.add(word[length:])
+    return forms
+
+
+def index_terms(values: Iterable[Optional[str]]) -> str:
+    """Space-separated index terms for the given field values."""
+    terms = []
+    for value in values:
+        for word in _WORD.findall(value or ""):
+            terms.extend(sorted(word_forms(word)))
+    return " ".join(terms)
+
+
+def query_groups(query: str) -> List[Set[str]]:
+    """One set of alternative forms per query word; every group must match."""
+    return [forms for forms in (word_forms(word) for word in _WORD.findall(query)) if forms]
+
+
+def _is_postgres(bind) -> bool:
+    return bind.dialect.name == "postgresql"
+
+
+# Index DDL and maintenance
+
+def create_index(connection: Connection):
+    if _is_postgres(connection):
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS diary_search ("
+            " entry_id INTEGER PRIMARY KEY REFERENCES diary_entries(id) ON DELETE CASCADE,"
+            " terms TSVECTOR NOT NULL)"
+        ))
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_diary_search_terms ON diary_search USING GIN (terms)"
+        ))
+    else:
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS diary_search USING fts5(terms, tokenize='unicode61')"
+        ))
+
+
+def drop_index(connection: Connection):
+    connection.execute(text("DROP TABLE IF EXISTS diary_search"))
+
+
+def _upsert(connection: Connection, rows: Sequence[dict]):
+    if not rows:
+        return
+    if _is_postgres(connection):
+        connection.execute(text(
+            "INSERT INTO diary_search (entry_id, terms) VALUES (:id, to_tsvector('simple', :terms)) "
+            "ON CONFLICT (entry_id) DO UPDATE SET terms = EXCLUDED.terms"
+        ), rows)
+    else:
+        connection.execute(text("DELETE FROM diary_search WHERE rowid = :id"), rows)
+        connection.execute(text("INSERT INTO diary_search (rowid, terms) VALUES (:id, :terms)"), rows)
+
+
+def _key(connection: Connection) -> str:
+    return "entry_id" if _is_postgres(connection) else "rowid"
+
+
+def _remove(connection: Connection, entry_id: int):
+    connection.execute(text(f"DELETE FROM diary_search WHERE {_key(connection)} = :id"), {"id": entry_id})
+
+
+def unindex(connection: Connection, entry_ids):
+    """Remove the index rows of the entries selected by `entry_ids` (a SELECT of ids)."""
+    index = table("diary_search", column(_key(connection)))
+    connection.execute(delete(index).where(index.c[_key(connection)].in_(entry_ids)))
+
+
+def _row(entry) -> dict:
+    return {"id": entry.id, "terms": index_terms(getattr(entry, field) for field in SEARCH_FIELDS)}
+
+
+def reindex(db: Session, user_id: Optional[int] = None, batch_size: int = 1000,
+            user_ids: Optional[Sequence[int]] = None) -> int:
+    """Rebuild index rows for `user_id`'s or `user_ids`' entries (or all entries) in the caller's transaction."""
+    owners = [user_id] if user_id is not None else None if user_ids is None else list(user_ids)
+    db.flush()
+    connection = db.connection()
+    entries = select(models.DiaryEntry.id, *(getattr(models.DiaryEntry, field) for field in SEARCH_FIELDS))
+    if owners is not None:
+        entries = entries.where(models.DiaryEntry.user_id.in_(owners))
+    elif not _is_postgres(connection):
+        connection.execute(text("DELETE FROM diary_search"))
+    # Neither FTS5 rows nor rows of a partitioned diary_entries have a foreign
+    # key; drop those left behind by bulk deletes
+    key = _key(connection)
+    connection.execute(text(f"DELETE FROM diary_search WHERE {key} NOT IN (SELECT id FROM diary_entries)"))
+
+    count = 0
+    batch = []
+    for entry in connection.execute(entries.execution_options(yield_per=batch_size)):
+        batch.append(_row(entry))
+        if len(batch) >= batch_size:
+            _upsert(connection, batch)
+            count += len(batch)
+            batch = []
+    _upsert(connection, batch)
+    return count + len(batch)
+
+
+@event.listens_for(models.DiaryEntry, "after_insert")
+def _index_inserted_entry(mapper, connection, target):
+    _upsert(connection, [_row(target)])
+
+
+@event.listens_for(models.DiaryEntry, "after_update")
+def _index_updated_entry(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in SEARCH_FIELDS):
+        _upsert(connection, [_row(target)])
+
+
+@event.listens_for(models.DiaryEntry, "after_delete")
+def _unindex_deleted_entry(mapper, connection, target):
+    _remove(connection, target.id)
+
+
+@event.listens_for(models.Base.metadata, "after_create")
+def _create_index_with_tables(metadata, connection, **kwargs):
+    create_index(connection)
+
+
+# Querying
+
+def search(db: Session, user_ids: Sequence[int], query: str, limit: int = 20, offset: int = 0):
+    """Rank `user_ids`' entries against `query`.
+
+    Returns up to `limit` rows of (id, user_id, date, score, *SEARCH_FIELDS),
+    best match first, plus one extra row when more results follow.
+    """
+    groups = query_groups(query)
+    if not groups or not user_ids:
+        return []
+    fields = ", ".join(f"d.{field}" for field in SEARCH_FIELDS)
+    if _is_postgres(db.get_bind()):
+        expression = " & ".join("(" + " | ".join(sorted(group)) + ")" for group in groups)
+        statement = text(
+            f"SELECT d.id, d.user_id, d.date, ts_rank(s.terms, q) AS score, {fields} "
+            "FROM diary_search s JOIN diary_entries d ON d.id = s.entry_id, "
+            "to_tsquery('simple', :expression) q "
+            "WHERE s.terms @@ q AND d.user_id IN :user_ids "
+            "ORDER BY score DESC, d.date DESC LIMIT :limit OFFSET :offset"
+        )
+    else:
+        expression = " AND ".join(
+            "(" + " OR ".join(f'"{form}"' for form in sorted(group)) + ")" for group in groups
+        )
+        # bm25() is lower-is-better; negate it so both engines rank descending
+        statement = text(
+            f"SELECT d.id, d.user_id, d.date, -bm25(diary_search) AS score, {fields} "
+            "FROM diary_search JOIN diary_entries d ON d.id = diary_search.rowid "
+            "WHERE diary_search MATCH :expression AND d.user_id IN :user_ids "
+            "ORDER BY score DESC, d.date DESC LIMIT :limit OFFSET :offset"
+        )
+    statement = statement.bindparams(bindparam("user_ids", expanding=True)).columns(
+        column("id", Integer), column("user_id", Integer), column("date", DateTime), column("score", Float),
+        *(column(field, String) for field in SEARCH_FIELDS)
+    )
+    return db.execute(statement, {
+        "expression": expression,
+        "user_ids": list(user_ids),
+        "limit": limit + 1,
+        "offset": offset,
+    }).all()
+
+
+def highlight(value: Optional[str], query: str, words: int = SNIPPET_WORDS) -> Optional[str]:
+    """HTML snippet of `value` around its first match, matches wrapped in <mark>.
+
+    Returns None when the field has no matching word.
+    """
+    wanted = set().union(*query_groups(query))
+    if not value or not wanted:
+        return None
+    tokens = list(_WORD.finditer(value))
+    hits = [index for index, token in enumerate(tokens) if word_forms(token.group()) & wanted]
+    if not hits:
+        return None
+    first = max(hits[0] - words, 0)
+    last = min(hits[0] + words, len(tokens) - 1)
+    start, end = tokens[first].start(), tokens[last].end()
+
+    parts = ["…" if start > 0 else ""]
+    position = start
+    for index in hits:
+        if index > last:
+            break
+        if index < first:
+            continue
+        token = tokens[index]
+        parts.append(html.escape(value[position:token.start()]))
+        parts.append(f"<mark>{html.escape(token.group())}</mark>")
+        position = token.end()
+    parts.append(html.escape(value[position:end]))
+    parts.append("…" if end < len(value) else "")
+    return "".join(parts)
+
+
+def main():
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Rebuild the diary full-text search index")
+    parser.add_argument("--user-id", type=int, default=None, help="only reindex this user's entries")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        create_index(db.connection())
+        indexed = reindex(db, user_id=args.user_id)
+        db.commit()
+        print(f"Indexed {indexed} entries")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,15 @@
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import List, Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import pyotp
-from .database import get_db
+from .database import get_async_db
+from .auth import pwd_context
 from . import models, schemas
+from .principal_cache import principal_cache
 import os
 from dotenv import load_dotenv
 
@@ -18,7 +20,6 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -46,13 +47,18 @@ def verify_2fa_code(secret: str, code: str) -> bool:
 
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> models.User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    cache_key = (SECRET_KEY, token)
+    cached = principal_cache.get(cache_key)
+    if cached is not None:
+        return await db.merge(cached, load=False)
+    
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
@@ -62,9 +68,10 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
     
-    user = db.query(models.User).filter(models.User.email == token_data.email).first()
+    user = await db.scalar(select(models.User).where(models.User.email == token_data.email))
     if user is None:
         raise credentials_exception
+    principal_cache.put(cache_key, user, token_expires_at=payload.get("exp"))
     return user
 
 async def get_current_active_user(
@@ -73,3 +80,26 @@ async def get_current_active_user(
     if not current_user:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
+
+async def resolve_diary_owner(db: AsyncSession, current_user: models.User, patient_id: Optional[int]) -> int:
+    """Resolve whose diary to use: the caller's own, or a patient of the calling therapist."""
+    if patient_id is None or patient_id == current_user.id:
+        return current_user.id
+    if not current_user.is_therapist:
+        raise HTTPException(status_code=403, detail="Only therapists can access this endpoint")
+    relationship = await db.scalar(
+        select(models.TherapistPatient.id).where(
+            models.TherapistPatient.therapist_id == current_user.id,
+            models.TherapistPatient.patient_id == patient_id
+        )
+    )
+    if not relationship:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    return patient_id
+
+async def roster_patient_ids(db: AsyncSession, therapist_id: int) -> List[int]:
+    return list((await db.scalars(
+        select(models.TherapistPatient.patient_id).where(
+            models.TherapistPatient.therapist_id == therapist_id
+        )
+    )).all())
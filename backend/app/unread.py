@@ -0,0 +1,130 @@
+"""Per-user unread notification counts.
+
+unread_notification_counts holds one row per user, changed in the same
+transaction as the notifications it counts, so the badge count is a primary
+key lookup instead of a count over the user's notifications. ORM inserts,
+updates of is_read and deletes of Notification adjust it through mapper
+events; Core statements must call add() themselves (mark_read() does). To
+recount from the notifications table:
+
+    python -m app.unread [--user-id ID]
+"""
+import argparse
+from collections import Counter
+from typing import Iterable, Mapping, Optional, Union
+
+from sqlalchemy import delete, event, func, inspect, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from . import models
+
+_counts = models.UnreadNotificationCount.__table__
+_notifications = models.Notification.__table__
+
+
+def add(db: Union[Session, Connection], deltas: Mapping[int, int]):
+    """Add deltas[user_id] to each user's unread count in the caller's transaction."""
+    deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    dialect = db.get_bind().dialect if isinstance(db, Session) else db.dialect
+    insert = postgresql_insert if dialect.name == "postgresql" else sqlite_insert
+    statement = insert(_counts)
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[_counts.c.user_id], set_={"unread": _counts.c.unread + statement.excluded.unread}
+        ),
+        [{"user_id": user_id, "unread": delta} for user_id, delta in deltas.items()],
+    )
+
+
+def created(db: Union[Session, Connection], notifications: Iterable):
+    """Count new unread notifications (rows with a user_id) inserted through Core."""
+    add(db, Counter(row.user_id for row in notifications))
+
+
+def count(db: Session, user_id: int) -> int:
+    return db.scalar(select(_counts.c.unread).where(_counts.c.user_id == user_id)) or 0
+
+
+def mark_read(db: Session, user_id: int, ids: Optional[Iterable[int]] = None, up_to: Optional[int] = None) -> int:
+    """Mark `user_id`'s unread notifications in `ids`, or all with an id up to `up_to`, as read.
+
+    One UPDATE; only rows still unread match, so concurrent calls never count
+    a notification twice. Returns how many were marked.
+    """
+    statement = update(_notifications).where(
+        _notifications.c.user_id == user_id,
+        _notifications.c.is_read == False
+    ).values(is_read=True)
+    if ids is not None:
+        statement = statement.where(_notifications.c.id.in_(list(ids)))
+    if up_to is not None:
+        statement = statement.where(_notifications.c.id <= up_to)
+    marked = db.execute(statement).rowcount
+    add(db, {user_id: -marked})
+    return marked
+
+
+@event.listens_for(models.Notification, "after_insert")
+def _count_inserted(mapper, connection, target):
+    if not target.is_read:
+        add(connection, {target.user_id: 1})
+
+
+@event.listens_for(models.Notification, "after_update")
+def _count_updated(mapper, connection, target):
+    history = inspect(target).attrs.is_read.history
+    if history.has_changes():
+        was_read = bool(history.deleted and history.deleted[0])
+        if was_read != bool(target.is_read):
+            add(connection, {target.user_id: 1 if was_read else -1})
+
+
+@event.listens_for(models.Notification, "after_delete")
+def _count_deleted(mapper, connection, target):
+    if not target.is_read:
+        add(connection, {target.user_id: -1})
+
+
+def rebuild(db: Session, user_id: Optional[int] = None) -> int:
+    """Recount unread notifications in the caller's transaction. Returns the users counted."""
+    db.flush()
+    clear = delete(_counts)
+    unread = select(_notifications.c.user_id, func.count()).where(_notifications.c.is_read == False)
+    if user_id is not None:
+        clear = clear.where(_counts.c.user_id == user_id)
+        unread = unread.where(_notifications.c.user_id == user_id)
+    db.execute(clear)
+    rows = db.execute(unread.group_by(_notifications.c.user_id)).all()
+    add(db, dict(rows))
+    return len(rows)
+
+
+def backfill(db: Session, user_id: Optional[int] = None) -> int:
+    """Recount unread notifications and commit."""
+    counted = rebuild(db, user_id)
+    db.commit()
+    return counted
+
+
+def main():
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Recount unread notifications per user")
+    parser.add_argument("--user-id", type=int, default=None, help="only recount this user")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        counted = backfill(db, user_id=args.user_id)
+        print(f"Recounted unread notifications for {counted} users")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""Check and time diary reads across hot and archived entries.
+
+Seeds --patients patients with --days of history, records what the diary
+readers return for a sample of them (every page of GET /diary/entries,
+newest first and walking back, with and without a date window and an
+emotion filter, each entry by id, the NDJSON export, the emotion
+vocabulary), the rollups and the risk states, then archives entries older
+than --archive-after-days with app.archive and checks that:
+
+* every reader returns the same as before;
+* rollups.rebuild() from hot plus archived entries gives the same rollups;
+* writing into an archived month restores it, and archiving again leaves
+  the readers unchanged;
+* search reports how many entries it left out because they are archived.
+
+Times each reader before and after archiving and reports how much smaller
+diary_entries got. Exits non-zero on a mismatch.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.bench_archive --patients 50 --days 1095
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+LIMIT = 100
+
+
+async def walk(client, headers, params):
+    """Every page newest first, then back again from the oldest with `before`."""
+    pages, cursor = [], None
+    while True:
+        response = await client.get("/diary/entries", params={**params, "limit": LIMIT, **({"after": cursor} if cursor else {})}, headers=headers)
+        response.raise_for_status()
+        pages.append(response.json())
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+    back, cursor = [], pages[-1] and response.headers.get("x-prev-cursor")
+    while cursor:
+        response = await client.get("/diary/entries", params={**params, "limit": LIMIT, "before": cursor}, headers=headers)
+        response.raise_for_status()
+        back.append(response.json())
+        cursor = response.headers.get("x-prev-cursor")
+    return pages, back
+
+
+async def snapshot(client, headers, ids, window):
+    from app import data_version
+
+    data_version.response_cache.clear()
+    result = {
+        "all": await walk(client, headers, {}),
+        "window": await walk(client, headers, window),
+        "emotion": await walk(client, headers, {"emotion": "חרדה", "min_intensity": 5}),
+        "entries": [(await client.get(f"/diary/entries/{entry_id}", headers=headers)).json() for entry_id in ids],
+        "export": (await client.get("/diary/entries/export", headers=headers)).text,
+        "vocabulary": (await client.get("/diary/emotions", headers=headers)).json(),
+    }
+    for value in result["vocabulary"]:
+        value["average_intensity"] = round(value["average_intensity"], 9)
+    return result
+
+
+def tables(db):
+    from sqlalchemy import select
+
+    from app import models
+
+    def rows(model, *order):
+        return [
+            {column.key: getattr(row, column.key) for column in model.__table__.columns if column.key != "updated_at"}
+            for row in db.scalars(select(model).order_by(*order))
+        ]
+
+    return {
+        "daily": rows(models.DailyRollup, models.DailyRollup.user_id, models.DailyRollup.day),
+        "weekly": rows(models.WeeklyRollup, models.WeeklyRollup.user_id, models.WeeklyRollup.week_start),
+        "risk": [
+            {key: value for key, value in row.items() if key != "updated_at"}
+            for row in rows(models.PatientRiskState, models.PatientRiskState.user_id)
+        ],
+    }
+
+
+def compare(name, expected, actual, failures):
+    if expected == actual:
+        return
+    if isinstance(expected, dict):
+        for key in expected:
+            compare(f"{name}.{key}", expected[key], actual.get(key), failures)
+    elif isinstance(expected, (list, tuple)) and isinstance(actual, (list, tuple)) and len(expected) == len(actual):
+        for index, (want, got) in enumerate(zip(expected, actual)):
+            compare(f"{name}[{index}]", want, got, failures)
+    else:
+        failures.append(f"{name}: expected {str(expected)[:200]}, got {str(actual)[:200]}")
+
+
+async def timings(client, headers, ids, window, repeat):
+    from app import data_version
+
+    async def first_page():
+        return await client.get("/diary/entries", params={"limit": LIMIT}, headers=headers)
+
+    async def full_walk():
+        return await walk(client, headers, {})
+
+    async def spanning_window():
+        return await walk(client, headers, window)
+
+    async def by_id():
+        for entry_id in ids:
+            await client.get(f"/diary/entries/{entry_id}", headers=headers)
+
+    async def export():
+        return await client.get("/diary/entries/export", headers=headers)
+
+    result = {}
+    for name, call in (("first page", first_page), ("all pages", full_walk), ("window across cutoff", spanning_window),
+                       (f"{len(ids)} entries by id", by_id), ("export", export)):
+        samples = []
+        for _ in range(repeat):
+            data_version.response_cache.clear()
+            started = time.perf_counter()
+            await call()
+            samples.append(time.perf_counter() - started)
+        result[name] = statistics.median(samples) * 1000
+    return result
+
+
+async def run(args, dataset, tokens, failures):
+    import httpx
+    from sqlalchemy import func, select
+
+    from app import archive, models, rollups
+    from app.database import SessionLocal
+    from app.main import app
+
+    patients = list(dataset.patients)[:args.sample]
+    before = archive.cutoff(args.archive_after_days)
+    window = {"start_date": str(before.date() - timedelta(days=60)), "end_date": str(before.date() + timedelta(days=60))}
+
+    db = SessionLocal()
+    ids = {}
+    for patient in patients:
+        owned = db.scalars(select(models.DiaryEntry.id).where(models.DiaryEntry.user_id == patient).order_by(models.DiaryEntry.id)).all()
+        # Old entries, which end up archived, and recent ones
+        ids[patient] = owned[:5] + owned[len(owned) // 2:len(owned) // 2 + 3] + owned[-2:]
+    hot_before = db.scalar(select(func.count()).select_from(models.DiaryEntry))
+    db.close()
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None) as client:
+        headers = {patient: {"Authorization": f"Bearer {tokens[patient]}"} for patient in patients}
+        expected = {patient: await snapshot(client, headers[patient], ids[patient], window) for patient in patients}
+        db = SessionLocal()
+        expected_tables = tables(db)
+        db.close()
+        slow_before = await timings(client, headers[patients[0]], ids[patients[0]], window, args.repeat)
+
+        db = SessionLocal()
+        started = time.perf_counter()
+        archived, _ = archive.run(db, before)
+        archive_seconds = time.perf_counter() - started
+        hot_after = db.scalar(select(func.count()).select_from(models.DiaryEntry))
+        stored = db.execute(select(func.count(), func.sum(func.length(models.DiaryArchive.entries)))).one()
+        db.close()
+        print(f"archived {archived} of {hot_before} entries dated before {before.date()} into {stored[0]} patient-months "
+              f"({(stored[1] or 0) / 2**20:.1f} MiB compressed) in {archive_seconds:.1f} s; {hot_after} entries stay hot")
+        if not archived or hot_after != hot_before - archived:
+            failures.append(f"expected {hot_before} - {archived} hot entries, found {hot_after}")
+
+        for patient in patients:
+            compare(f"patient {patient}", expected[patient], await snapshot(client, headers[patient], ids[patient], window), failures)
+        db = SessionLocal()
+        compare("tables after archiving", expected_tables, tables(db), failures)
+        rollups.backfill(db)
+        compare("tables after rebuilding rollups", expected_tables, tables(db), failures)
+        db.close()
+        slow_after = await timings(client, headers[patients[0]], ids[patients[0]], window, args.repeat)
+
+        # Search covers hot entries only and says how many it skipped
+        db = SessionLocal()
+        skipped = db.scalar(select(func.sum(models.DiaryArchive.entry_count)).where(
+            models.DiaryArchive.user_id == patients[0]
+        ))
+        db.close()
+        found = (await client.get("/search/entries", params={"q": "היום"}, headers=headers[patients[0]])).json()
+        if found["archived_entries_excluded"] != skipped or not found["archived_through"]:
+            failures.append(f"search reports {found['archived_entries_excluded']} archived entries skipped, expected {skipped}")
+
+        # A write to an archived month brings it back; archiving again restores the picture
+        patient = patients[0]
+        old_day = expected[patient]["all"][0][-1][-1]["date"][:10]
+        response = await client.post("/diary/entries", json={
+            "date": f"{old_day}T08:00:00", "mood": 5, "emotions": {"שמחה": 3}, "medications_taken": True,
+            "self_harm": False, "suicidal_thoughts": False, "stressful_events": False,
+        }, headers=headers[patient])
+        response.raise_for_status()
+        new_id = response.json()["id"]
+        db = SessionLocal()
+        restored = db.scalar(select(func.count()).select_from(models.DiaryEntry).where(
+            models.DiaryEntry.user_id == patient, models.DiaryEntry.date < before
+        ))
+        db.close()
+        if restored < 2:
+            failures.append(f"writing on {old_day} did not restore its month ({restored} hot old entries)")
+        listed = await walk(client, headers[patient], {})
+        if new_id not in [entry["id"] for page in listed[0] for entry in page]:
+            failures.append("the entry written into an archived month is not listed")
+        (await client.delete(f"/diary/entries/{new_id}", headers=headers[patient])).raise_for_status()
+        db = SessionLocal()
+        archive.run(db, before)
+        db.close()
+        compare(f"patient {patient} after restore and re-archive", expected[patient],
+                await snapshot(client, headers[patient], ids[patient], window), failures)
+
+    print(f"{'':<24}{'hot only ms':>12}{'hot+archive ms':>16}")
+    for name in slow_before:
+        print(f"{name:<24}{slow_before[name]:>12.1f}{slow_after[name]:>16.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patients", type=int, default=50)
+    parser.add_argument("--days", type=int, default=1095)
+    parser.add_argument("--archive-after-days", type=int, default=365)
+    parser.add_argument("--sample", type=int, default=3, help="patients whose readers are compared")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'archive.db')}"
+
+        from app import manage, security
+        from app.database import SessionLocal
+        from app.db.seed import seed_dataset
+
+        manage.create_tables()
+        db = SessionLocal()
+        dataset = seed_dataset(db, therapists=1, patients=args.patients, days=args.days, prefix="archive")
+        db.close()
+        tokens = {user_id: security.create_access_token({"sub": email}) for user_id, email in dataset.patients.items()}
+
+        failures = []
+        asyncio.run(run(args, dataset, tokens, failures))
+
+    for failure in failures[:20]:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
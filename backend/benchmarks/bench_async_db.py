@@ -0,0 +1,125 @@
+"""Compare request latency of the sync and async session paths under concurrency.
+
+Serves the same two endpoints twice from one in-process FastAPI app:
+`/sync/...` uses the blocking SessionLocal inside `async def` handlers (the
+pattern the routers used before), `/async/...` uses AsyncSession. A fraction
+of requests hit a deliberately slow query; the script reports the latency of
+the fast requests, which is what a slow analytics query does to everyone
+else in the worker.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.bench_async_db --requests 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Registers the tables (FAST_SQL reads users) on Base.metadata
+from app import models  # noqa: F401
+from app.database import Base, to_async_url
+
+SLOW_SQL = text(
+    "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < :n) "
+    "SELECT count(*) FROM c"
+)
+FAST_SQL = text("SELECT count(*) FROM users")
+
+
+def build_app(url: str, slow_rows: int, pool_size: int) -> FastAPI:
+    # The sync pool must cover every concurrent request: when a blocking
+    # handler waits for a connection on the event loop, the handlers that
+    # would release one never get scheduled and the worker deadlocks.
+    sync_engine = create_engine(url, connect_args={"check_same_thread": False}, pool_size=pool_size)
+    Base.metadata.create_all(bind=sync_engine)
+    SyncSession = sessionmaker(bind=sync_engine)
+    AsyncSessionFactory = async_sessionmaker(create_async_engine(to_async_url(url)), class_=AsyncSession)
+
+    def get_sync_db():
+        db = SyncSession()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def get_async_db():
+        async with AsyncSessionFactory() as db:
+            yield db
+
+    app = FastAPI()
+
+    @app.get("/sync/fast")
+    async def sync_fast(db: Session = Depends(get_sync_db)):
+        return {"count": db.execute(FAST_SQL).scalar()}
+
+    @app.get("/sync/slow")
+    async def sync_slow(db: Session = Depends(get_sync_db)):
+        return {"count": db.execute(SLOW_SQL, {"n": slow_rows}).scalar()}
+
+    @app.get("/async/fast")
+    async def async_fast(db: AsyncSession = Depends(get_async_db)):
+        return {"count": (await db.execute(FAST_SQL)).scalar()}
+
+    @app.get("/async/slow")
+    async def async_slow(db: AsyncSession = Depends(get_async_db)):
+        return {"count": (await db.execute(SLOW_SQL, {"n": slow_rows})).scalar()}
+
+    return app
+
+
+async def run(app: FastAPI, prefix: str, requests: int, concurrency: int, slow_ratio: float):
+    rng = random.Random(7)
+    plan = [f"{prefix}/slow" if rng.random() < slow_ratio else f"{prefix}/fast" for _ in range(requests)]
+    latencies = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            while plan:
+                path = plan.pop()
+                started = time.perf_counter()
+                response = await client.get(path)
+                response.raise_for_status()
+                if path.endswith("/fast"):
+                    latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+    print(
+        f"{prefix:<7} fast p50 {statistics.median(latencies):8.2f} ms  p95 {pick(0.95):8.2f} ms  "
+        f"p99 {pick(0.99):8.2f} ms  throughput {requests / elapsed:8.1f} req/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--slow-ratio", type=float, default=0.05)
+    parser.add_argument("--slow-rows", type=int, default=200000, help="size of the slow recursive query")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = build_app(f"sqlite:///{os.path.join(tmp, 'bench.db')}", args.slow_rows, args.concurrency)
+        for prefix in ("/sync", "/async"):
+            asyncio.run(run(app, prefix, args.requests, args.concurrency, args.slow_ratio))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Time the roster cohort table against one details call per patient.
+
+Seeds one therapist per roster size (--sizes, default 10, 100 and 500
+patients) with --days of history each, then for every size times through
+the API:
+
+* per patient: GET /analytics/therapist/patient/{id}/details for each
+  patient in turn, what a client had to do before (response cache cleared);
+* GET /analytics/therapist/cohort with the statistics computed in the request;
+* the same with them on a process pool (--processes).
+
+The cohort rows are checked against per-patient NumPy reference
+computations. Exits non-zero on a mismatch.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.bench_cohort --sizes 10 100 500 --days 90
+"""
+import argparse
+import asyncio
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def reference(series_rows):
+    """Each statistic for one patient, computed directly from their days."""
+    days = np.array([row.day.toordinal() for row in series_rows])
+    mood = np.array([row.mood_sum / row.mood_count if row.mood_count else np.nan for row in series_rows])
+    stressed = np.array([row.stressful_events_count > 0 for row in series_rows])
+    medicated = np.array([row.medications_taken_count > 0 for row in series_rows], dtype=float)
+    rated = ~np.isnan(mood)
+    result = {"longest_gap_days": int((np.diff(days) - 1).max()) if len(days) > 1 else 0}
+    if rated.sum() >= 5:
+        result["mood_trend"] = np.polyfit(days[rated], mood[rated], 1)[0] * 7
+        result["mood_volatility"] = mood[rated].std()
+        taken = medicated[rated]
+        result["adherence_mood_correlation"] = (
+            np.corrcoef(taken, mood[rated])[0, 1] if taken.std() > 0 and mood[rated].std() > 0 else None
+        )
+    following = {day: value for day, value in zip(days, mood) if not np.isnan(value)}
+    after = [(stress, following[day + 1]) for day, stress in zip(days, stressed) if day + 1 in following]
+    after_stress = [value for stress, value in after if stress]
+    after_calm = [value for stress, value in after if not stress]
+    if len(after_stress) >= 5 and len(after_calm) >= 5:
+        result["stress_mood_change"] = np.mean(after_stress) - np.mean(after_calm)
+    return result
+
+
+def check(rows, series, failures, size):
+    by_patient = {}
+    for row in series:
+        by_patient.setdefault(row.user_id, []).append(row)
+    for row in rows:
+        expected = reference(by_patient.get(row["patient_id"], []))
+        for name in ("mood_trend", "mood_volatility", "adherence_mood_correlation", "stress_mood_change", "longest_gap_days"):
+            want, got = expected.get(name), row[name]
+            if not row["days_with_entries"] and name == "longest_gap_days":
+                want = None
+            if (want is None) != (got is None) or (want is not None and not math.isclose(want, got, abs_tol=1e-3)):
+                failures.append(f"{size} patients, patient {row['patient_id']} {name}: expected {want}, got {got}")
+
+
+async def run(args, datasets, tokens):
+    import httpx
+
+    from app import cohort, data_version
+    from app.database import SessionLocal
+    from app.main import app
+
+    failures = []
+    end = date.today() - timedelta(days=1)
+    start = end - timedelta(days=args.days - 1)
+    window = {"start_date": f"{start}T00:00:00", "end_date": f"{end}T00:00:00"}
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None) as client:
+        async def timed_async(call, repeat):
+            samples = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                await call()
+                samples.append(time.perf_counter() - started)
+            return statistics.median(samples) * 1000
+
+        print(f"{'patients':>8}{'per patient ms':>16}{'cohort ms':>11}{'pool ms':>9}{'speedup':>9}")
+        for size, dataset in datasets.items():
+            therapist = next(iter(dataset.therapists))
+            headers = {"Authorization": f"Bearer {tokens[therapist]}"}
+
+            async def per_patient():
+                data_version.response_cache.clear()
+                for patient_id in dataset.patients:
+                    response = await client.get(
+                        f"/analytics/therapist/patient/{patient_id}/details", params=window, headers=headers
+                    )
+                    response.raise_for_status()
+
+            async def cohort_table():
+                response = await client.get("/analytics/therapist/cohort", params={**window, "sort": "mood_trend"}, headers=headers)
+                response.raise_for_status()
+                return response.json()
+
+            per_patient_ms = await timed_async(per_patient, 1)
+            cohort.COHORT_PROCESSES = 0
+            rows = await cohort_table()
+            cohort_ms = await timed_async(cohort_table, args.repeat)
+            cohort.COHORT_PROCESSES = args.processes
+            pooled = await cohort_table()  # starts the pool
+            pool_ms = await timed_async(cohort_table, args.repeat)
+            print(f"{size:>8}{per_patient_ms:>16.1f}{cohort_ms:>11.1f}{pool_ms:>9.1f}{per_patient_ms / cohort_ms:>8.1f}x")
+
+            if len(rows) != size:
+                failures.append(f"{size} patients: cohort returned {len(rows)} rows")
+            if pooled != rows:
+                failures.append(f"{size} patients: the process pool returned different rows")
+            db = SessionLocal()
+            try:
+                _, series = cohort.load(db, therapist, start, end)
+            finally:
+                db.close()
+            check(rows, series, failures, size)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--processes", type=int, default=min(4, os.cpu_count() or 2))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'cohort.db')}"
+
+        from app import manage, security
+        from app.database import SessionLocal
+        from app.db.seed import seed_dataset
+
+        manage.create_tables()
+        datasets, tokens = {}, {}
+        for size in args.sizes:
+            db = SessionLocal()
+            datasets[size] = dataset = seed_dataset(db, therapists=1, patients=size, days=args.days, prefix=f"cohort{size}")
+            db.close()
+            tokens.update(
+                (user_id, security.create_access_token({"sub": email})) for user_id, email in dataset.therapists.items()
+            )
+
+        failures = asyncio.run(run(args, datasets, tokens))
+
+    for failure in failures[:20]:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
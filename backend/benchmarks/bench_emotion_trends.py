@@ -0,0 +1,149 @@
+"""Compare the vectorized trend engine with the per-row Python loops.
+
+Seeds one patient with several years of daily entries, then times:
+
+* the original loop over every DiaryEntry row,
+* the loop over daily rollups the analytics routers used before the engine,
+* that loop extended to produce the engine's aligned, EWMA-smoothed output,
+* analytics_engine at each resolution, with and without smoothing.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.bench_emotion_trends --years 5 --emotions 12
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import analytics_engine, models, rollups
+from app.database import Base
+
+USER_ID = 1
+
+
+def seed(db, years: int, emotions: int):
+    names = [f"emotion-{i}" for i in range(emotions)]
+    start = datetime(2020, 1, 1, 21)
+    rng = random.Random(4)
+    db.execute(
+        insert(models.DiaryEntry),
+        [
+            {
+                "user_id": USER_ID,
+                "date": start + timedelta(days=day),
+                "mood": rng.randint(1, 10),
+                "emotions": {name: rng.randint(1, 5) for name in rng.sample(names, rng.randint(1, emotions))},
+                "medications_taken": rng.random() < 0.8,
+                "self_harm": rng.random() < 0.02,
+                "suicidal_thoughts": rng.random() < 0.01,
+                "stressful_events": rng.random() < 0.3,
+            }
+            for day in range(years * 365)
+            if rng.random() < 0.9
+        ],
+    )
+    db.commit()
+    rollups.backfill(db)
+
+
+def entry_loop(db):
+    entries = db.query(models.DiaryEntry).filter(
+        models.DiaryEntry.user_id == USER_ID
+    ).order_by(models.DiaryEntry.date).all()
+    emotion_trends = defaultdict(list)
+    dates = []
+    for entry in entries:
+        dates.append(entry.date)
+        for emotion, intensity in entry.emotions.items():
+            emotion_trends[emotion].append(intensity)
+    return dates, emotion_trends
+
+
+def rollup_loop(db):
+    emotion_trends = defaultdict(list)
+    dates = []
+    for day in rollups.daily_rollups(db, USER_ID):
+        dates.append(day.day)
+        for emotion, count in day.emotion_counts.items():
+            emotion_trends[emotion].append(day.emotion_intensity.get(emotion, 0) / count)
+    return dates, emotion_trends
+
+
+def rollup_loop_ewma(db, alpha=0.3):
+    days = rollups.daily_rollups(db, USER_ID)
+    emotions = sorted({emotion for day in days for emotion in day.emotion_counts})
+    by_day = {day.day: day for day in days}
+    dates, series = [], {emotion: [] for emotion in emotions}
+    state = {emotion: [0.0, 0.0] for emotion in emotions}
+    current = days[0].day
+    while current <= days[-1].day:
+        dates.append(current)
+        day = by_day.get(current)
+        for emotion in emotions:
+            weighted, weights = state[emotion]
+            weighted *= 1 - alpha
+            weights *= 1 - alpha
+            if day is not None and emotion in day.emotion_counts:
+                weighted += day.emotion_intensity[emotion] / day.emotion_counts[emotion]
+                weights += 1
+            state[emotion] = [weighted, weights]
+            series[emotion].append(round(weighted / weights, 4) if weights else None)
+        current += timedelta(days=1)
+    return dates, series
+
+
+def engine(db, **options):
+    columns = analytics_engine.DailyColumns.load(db, USER_ID)
+    return analytics_engine.emotion_trends(columns, **options)
+
+
+def timed(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--emotions", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(bind=db_engine)
+        db = sessionmaker(bind=db_engine)()
+        seed(db, args.years, args.emotions)
+
+        cases = [
+            ("entry loop", lambda: entry_loop(db)),
+            ("rollup loop", lambda: rollup_loop(db)),
+            ("rollup loop + ewma", lambda: rollup_loop_ewma(db)),
+            ("engine day", lambda: engine(db)),
+            ("engine day + rolling", lambda: engine(db, smoothing="rolling", window=7)),
+            ("engine day + ewma", lambda: engine(db, smoothing="ewma", alpha=0.3)),
+            ("engine week + ewma", lambda: engine(db, resolution="week", smoothing="ewma")),
+            ("engine month", lambda: engine(db, resolution="month")),
+        ]
+        for name, fn in cases:
+            db.expire_all()
+            print(f"{name:<24} {timed(fn, args.repeat):>9.2f} ms")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""Compare normalized emotion storage with the JSON column.
+
+Seeds a roster of patients whose entries carry a few emotions each, backfills
+diary_entry_emotions with emotions.reindex, and reports:
+
+* storage: bytes of JSON text in diary_entries.emotions against the pages
+  used by diary_entry_emotions, its index and the vocabulary (SQLite dbstat);
+* a per-day emotion trend for one patient, aggregated in Python from the
+  JSON (as rollups.rebuild does), with SQLite's json_each, and with
+  emotions.daily_totals;
+* the first page of one patient's entries reporting an emotion, and a
+  roster-wide count, filtered with json_each against emotions.has_emotion
+  and emotions.entries_with_emotion respectively.
+
+Exits non-zero if the approaches disagree.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.bench_emotions --patients 50 --days 2000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import LargeBinary, create_engine, func, insert, select, text
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import emotions, models
+from app.database import Base
+from app.rollups import iter_emotions
+
+VOCABULARY = [
+    "שמחה", "עצב", "כעס", "פחד", "חרדה", "בושה", "אשמה", "בדידות", "תסכול", "רוגע",
+    "הקלה", "גאווה", "קנאה", "תקווה", "ייאוש", "בלבול", "עייפות", "התרגשות", "אכזבה", "אהבה",
+]
+TARGET = "ייאוש"
+PAGE = 100
+
+
+def seed(db, patients: int, days: int):
+    rng = random.Random(5)
+    start = datetime(2015, 1, 1)
+    db.execute(insert(models.User), [{"id": i, "email": f"p{i}@example.com"} for i in range(1, patients + 1)])
+    rows = []
+    for user_id in range(1, patients + 1):
+        for day in range(days):
+            picked = rng.sample(VOCABULARY, rng.randint(1, 5))
+            rows.append({
+                "user_id": user_id,
+                "date": start + timedelta(days=day),
+                "emotions": {name: rng.randint(1, 10) for name in picked},
+            })
+        if len(rows) >= 20000:
+            db.execute(insert(models.DiaryEntry), rows)
+            rows = []
+    if rows:
+        db.execute(insert(models.DiaryEntry), rows)
+    db.commit()
+
+
+def storage(db):
+    json_bytes = db.scalar(select(func.sum(func.length(func.cast(models.DiaryEntry.emotions, LargeBinary)))))
+    pages = dict(db.execute(text(
+        "SELECT name, SUM(pgsize) FROM dbstat WHERE name IN "
+        "('diary_entry_emotions', 'ix_diary_entry_emotions_emotion_entry', 'emotions', 'sqlite_autoindex_emotions_1') "
+        "GROUP BY name"
+    )).all())
+    return json_bytes, pages
+
+
+def trend_python(db, user_id):
+    totals = defaultdict(lambda: [0, 0.0])
+    for day, value in db.execute(
+        select(models.DiaryEntry.date, models.DiaryEntry.emotions).where(models.DiaryEntry.user_id == user_id)
+    ):
+        for name, intensity in iter_emotions(value):
+            cell = totals[(day.date().isoformat(), name)]
+            cell[0] += 1
+            cell[1] += intensity or 0
+    return sorted((day, name, count, total) for (day, name), (count, total) in totals.items())
+
+
+def trend_json_each(db, user_id):
+    return [tuple(row) for row in db.execute(text(
+        "SELECT date(d.date) AS day, e.key, COUNT(*), SUM(e.value) FROM diary_entries d, json_each(d.emotions) e "
+        "WHERE d.user_id = :user_id GROUP BY day, e.key ORDER BY day, e.key"
+    ), {"user_id": user_id})]
+
+
+def trend_normalized(db, user_id):
+    return [tuple(row) for row in emotions.daily_totals(db, user_id)]
+
+
+def json_emotion(name, min_intensity=None):
+    """The same filter against the JSON column, one json_each expansion per entry."""
+    condition = "key = :name" if min_intensity is None else "key = :name AND value >= :min_intensity"
+    return text(
+        f"EXISTS (SELECT 1 FROM json_each(diary_entries.emotions) WHERE {condition})"
+    ).bindparams(name=name, **({} if min_intensity is None else {"min_intensity": min_intensity}))
+
+
+def page_json(db, user_id):
+    return db.scalars(
+        select(models.DiaryEntry.id).where(
+            models.DiaryEntry.user_id == user_id,
+            json_emotion(TARGET)
+        ).order_by(models.DiaryEntry.date.desc(), models.DiaryEntry.id.desc()).limit(PAGE)
+    ).all()
+
+
+def page_normalized(db, user_id):
+    return db.scalars(
+        select(models.DiaryEntry.id).where(
+            models.DiaryEntry.user_id == user_id, emotions.has_emotion(TARGET)
+        ).order_by(models.DiaryEntry.date.desc(), models.DiaryEntry.id.desc()).limit(PAGE)
+    ).all()
+
+
+def roster_json(db, user_ids):
+    return db.scalar(select(func.count()).where(
+        models.DiaryEntry.user_id.in_(user_ids),
+        json_emotion(TARGET, min_intensity=8)
+    ))
+
+
+def roster_normalized(db, user_ids):
+    return db.scalar(select(func.count()).where(
+        models.DiaryEntry.user_id.in_(user_ids),
+        models.DiaryEntry.id.in_(emotions.entries_with_emotion(TARGET, min_intensity=8))
+    ))
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - started)
+    return result, statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patients", type=int, default=50)
+    parser.add_argument("--days", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        seed(db, args.patients, args.days)
+        started = time.perf_counter()
+        emotions.reindex(db)
+        db.commit()
+        entries = args.patients * args.days
+        print(f"{entries} entries, backfilled in {time.perf_counter() - started:.1f}s")
+
+        json_bytes, pages = storage(db)
+        normalized_bytes = sum(pages.values())
+        print(f"\n{'storage':<40}{'MiB':>8}{'bytes/entry':>13}")
+        print(f"{'JSON text':<40}{json_bytes / 2**20:>8.1f}{json_bytes / entries:>13.1f}")
+        for name, size in sorted(pages.items()):
+            print(f"{'  ' + name:<40}{size / 2**20:>8.1f}{size / entries:>13.1f}")
+        print(f"{'normalized total':<40}{normalized_bytes / 2**20:>8.1f}{normalized_bytes / entries:>13.1f}")
+
+        user_ids = list(range(1, args.patients + 1))
+        print(f"\n{'query':<40}{'rows':>8}{'ms':>10}")
+        for label, fns in (
+            ("daily trend, one patient", (
+                ("JSON parsed in Python", lambda: trend_python(db, 1)),
+                ("JSON via json_each", lambda: trend_json_each(db, 1)),
+                ("normalized GROUP BY", lambda: trend_normalized(db, 1)),
+            )),
+            (f"first {PAGE} entries with emotion", (
+                ("json_each", lambda: page_json(db, 1)),
+                ("has_emotion", lambda: page_normalized(db, 1)),
+            )),
+            ("roster count, intensity >= 8", (
+                ("json_each", lambda: roster_json(db, user_ids)),
+                ("entries_with_emotion", lambda: roster_normalized(db, user_ids)),
+            )),
+        ):
+            print(label)
+            results = []
+            for name, fn in fns:
+                result, seconds = timed(fn, args.repeat)
+                results.append(result)
+                rows = result if isinstance(result, int) else len(result)
+                print(f"{'  ' + name:<40}{rows:>8}{seconds * 1000:>10.1f}")
+            if any(result != results[0] for result in results[1:]):
+                failures.append(f"{label}: results differ")
+        db.close()
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Measure repeat requests to analytics and diary listings with data versions.
+
+Seeds one user's diary and rollups, then times each endpoint through the
+routers (TestClient, authentication overridden):
+
+* cold: the response cache is cleared before every request, so the full
+  query and rendering runs each time, as it did before versioning;
+* cached: same version and parameters, the body comes from the cache;
+* 304: the client sends the ETag it got back in If-None-Match.
+
+Finally writes an entry and checks the old ETag no longer matches.
+Exits non-zero if a revalidation returns stale data.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.bench_etag --days 1500 --repeat 30
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import data_version, models, rollups, security
+from app.database import Base, get_async_db
+from app.routers import analytics, diary
+
+USER_ID = 1
+ENDPOINTS = [
+    "/analytics/emotions/summary?resolution=week&smoothing=ewma",
+    "/analytics/behaviors/summary",
+    "/diary/entries?limit=100",
+]
+
+
+def seed(db, days: int):
+    start = datetime(2020, 1, 1)
+    db.execute(insert(models.User), [{"id": USER_ID, "email": "bench@example.com"}])
+    db.execute(insert(models.DiaryEntry), [
+        {
+            "user_id": USER_ID,
+            "date": start + timedelta(days=day),
+            "mood": day % 10,
+            "emotions": {"שמחה": day % 7, "עצב": (day + 3) % 5, "חרדה": day % 4},
+            "medications_taken": day % 2 == 0,
+            "self_harm": False,
+            "suicidal_thoughts": False,
+            "stressful_events": day % 9 == 0,
+        }
+        for day in range(days)
+    ])
+    rollups.backfill(db)
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=1500)
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        seed(db, args.days)
+        user = db.get(models.User, USER_ID)
+        db.expunge(user)
+        db.close()
+
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        sessions = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+        async def get_db():
+            async with sessions() as session:
+                yield session
+
+        app = FastAPI()
+        app.include_router(analytics.router)
+        app.include_router(diary.router)
+        app.dependency_overrides[get_async_db] = get_db
+        app.dependency_overrides[security.get_current_active_user] = lambda: user
+
+        failures = []
+        with TestClient(app) as client:
+            print(f"{args.days} entries")
+            print(f"{'endpoint':<58}{'cold ms':>9}{'cached ms':>11}{'304 ms':>8}{'KiB':>7}")
+            tags = {}
+            for url in ENDPOINTS:
+                first = client.get(url)
+                tag = tags[url] = first.headers["etag"]
+
+                def cold():
+                    data_version.response_cache.clear()
+                    client.get(url)
+
+                cold_ms = timed(cold, args.repeat)
+                cached_ms = timed(lambda: client.get(url), args.repeat)
+                not_modified_ms = timed(lambda: client.get(url, headers={"If-None-Match": tag}), args.repeat)
+                if client.get(url, headers={"If-None-Match": tag}).status_code != 304:
+                    failures.append(f"{url}: matching ETag was not answered with 304")
+                print(f"{url:<58}{cold_ms:>9.1f}{cached_ms:>11.1f}{not_modified_ms:>8.1f}{len(first.content) / 1024:>7.1f}")
+
+            written = client.post("/diary/entries", json={
+                "date": (datetime(2020, 1, 1) + timedelta(days=args.days)).isoformat(), "mood": 1, "emotions": {"שמחה": 9},
+            })
+            if written.status_code != 200:
+                failures.append(f"writing an entry failed: {written.status_code}")
+            for url in ENDPOINTS:
+                response = client.get(url, headers={"If-None-Match": tags[url]})
+                if response.status_code != 200 or response.headers["etag"] == tags[url]:
+                    failures.append(f"{url}: the ETag from before the write still matches")
+            print(f"response cache {data_version.response_cache.stats()}")
+
+        asyncio.run(async_engine.dispose())
+        engine.dispose()
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""Measure notification stream memory and fan-out latency across workers.
+
+Seeds --subscribers patients into a temporary SQLite database, starts an
+event relay (app.events.Relay) and --workers uvicorn processes pointed at it
+through EVENT_BROKER_URL, and opens one GET /notifications/stream per
+patient, spread round robin over the workers. It then reports:
+
+* memory: each worker's resident set growth divided by its open streams;
+* fan-out: one POST /notifications/send-reminders on the first worker
+  creates a reminder for every patient; the latency is measured from that
+  request to each stream receiving its event, separately for streams on the
+  publishing worker and on the others (through the relay);
+* invalidation: every worker caches one patient's principal, then this
+  process changes the patient's email and commits; the latency is measured
+  until each worker rejects the old token.
+
+Exits non-zero if any stream misses its event or a worker keeps accepting
+the old token.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.bench_events --subscribers 3000 --workers 2
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def rss_kib(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    raise RuntimeError(f"no VmRSS for {pid}")
+
+
+def percentile(ordered, fraction):
+    return ordered[max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))]
+
+
+def describe(latencies):
+    if not latencies:
+        return "no events"
+    ordered = sorted(latencies)
+    return (
+        f"p50 {percentile(ordered, 0.5) * 1000:.1f} ms, p95 {percentile(ordered, 0.95) * 1000:.1f} ms, "
+        f"p99 {percentile(ordered, 0.99) * 1000:.1f} ms, max {ordered[-1] * 1000:.1f} ms"
+    )
+
+
+async def wait_until_up(base_url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                if (await client.get(f"{base_url}/health/db")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{base_url} did not start")
+            await asyncio.sleep(0.2)
+
+
+async def run(args, database_url, dataset, tokens):
+    from app import events
+    from app.database import SessionLocal
+    from app import models
+
+    relay = events.Relay()
+    await relay.start()
+    env = {
+        **os.environ,
+        "DATABASE_URL": database_url,
+        "EVENT_BROKER_URL": f"tcp://127.0.0.1:{relay.port}",
+        "STREAM_HEARTBEAT_SECONDS": "60",
+    }
+    workers = []
+    for _ in range(args.workers):
+        port = free_port()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+            cwd=BACKEND, env=env,
+        )
+        workers.append((process, f"http://127.0.0.1:{port}"))
+
+    received = {}
+    connected = asyncio.Event()
+    ready = 0
+    patients = list(dataset.patients)
+    client = httpx.AsyncClient(timeout=None, limits=httpx.Limits(max_connections=None, max_keepalive_connections=0))
+
+    async def listen(patient_id, base_url):
+        nonlocal ready
+        async with client.stream(
+            "GET", f"{base_url}/notifications/stream", params={"access_token": tokens[patient_id]}
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line.startswith("retry:"):
+                    ready += 1
+                    if ready == len(patients):
+                        connected.set()
+                elif line.startswith("data:"):
+                    received[patient_id] = time.perf_counter()
+
+    streams = []
+    failures = []
+    try:
+        for _, base_url in workers:
+            await wait_until_up(base_url)
+        baseline = [rss_kib(process.pid) for process, _ in workers]
+
+        started = time.perf_counter()
+        for number, patient_id in enumerate(patients):
+            streams.append(asyncio.create_task(listen(patient_id, workers[number % len(workers)][1])))
+            if number % 200 == 199:
+                await asyncio.sleep(0)  # let the connections made so far proceed
+        await asyncio.wait_for(connected.wait(), timeout=120)
+        print(f"{len(patients)} streams open over {len(workers)} workers in {time.perf_counter() - started:.1f}s")
+
+        await asyncio.sleep(1)
+        print("memory per open stream:")
+        for number, (process, _) in enumerate(workers):
+            opened = len(patients[number::len(workers)])
+            grown = rss_kib(process.pid) - baseline[number]
+            print(f"  worker {number}: +{grown / 1024:.1f} MiB for {opened} streams, {grown / max(opened, 1):.1f} KiB each")
+
+        # Every patient is due now, so one dispatch notifies all of them
+        db = SessionLocal()
+        db.query(models.NotificationSettings).update({"reminder_time": datetime.now().strftime("%H:%M")})
+        db.commit()
+        db.close()
+
+        published = time.perf_counter()
+        async with httpx.AsyncClient(timeout=120) as caller:
+            response = await caller.post(f"{workers[0][1]}/notifications/send-reminders",
+                                         headers={"Authorization": f"Bearer {tokens[next(iter(dataset.therapists))]}"})
+        answered = time.perf_counter()
+        reminders = response.json().get("reminders")
+        deadline = time.monotonic() + 30
+        while len(received) < len(patients) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+        local = [received[p] - published for p in patients[0::len(workers)] if p in received]
+        relayed = [
+            received[p] - published for number, p in enumerate(patients)
+            if number % len(workers) and p in received
+        ]
+        print(f"fan-out of {reminders} reminders; dispatch request took {(answered - published) * 1000:.1f} ms")
+        print(f"  publishing worker ({len(local)} streams): {describe(local)}")
+        if len(workers) > 1:
+            print(f"  other workers via relay ({len(relayed)} streams): {describe(relayed)}")
+        print(f"relay forwarded {relay.messages} messages")
+        if len(received) < len(patients):
+            failures.append(f"{len(patients) - len(received)} streams did not receive their reminder")
+
+        # A change to a user made anywhere drops it from every worker's principal cache
+        patient_id = patients[-1]
+        async with httpx.AsyncClient(timeout=30) as caller:
+            for _, base_url in workers:
+                response = await caller.get(f"{base_url}/notifications/unread/count",
+                                            headers={"Authorization": f"Bearer {tokens[patient_id]}"})
+                response.raise_for_status()
+            events.broker = events.make_broker(events.hub, env["EVENT_BROKER_URL"])
+            db = SessionLocal()
+            user = db.get(models.User, patient_id)
+            user.email = f"renamed-{user.email}"
+            db.commit()
+            db.close()
+            changed = time.perf_counter()
+            stale = {base_url: None for _, base_url in workers}
+            deadline = time.monotonic() + 10
+            while None in stale.values() and time.monotonic() < deadline:
+                for base_url in [url for url, seen in stale.items() if seen is None]:
+                    response = await caller.get(f"{base_url}/notifications/unread/count",
+                                                headers={"Authorization": f"Bearer {tokens[patient_id]}"})
+                    if response.status_code == 401:
+                        stale[base_url] = time.perf_counter() - changed
+                await asyncio.sleep(0.01)
+            await events.broker.stop()
+        print("principal invalidation: " + ", ".join(
+            f"worker {number} {'never' if seen is None else f'{seen * 1000:.1f} ms'}"
+            for number, seen in enumerate(stale.values())
+        ))
+        failures.extend(f"{base_url} still accepts a token of the renamed user" for base_url, seen in stale.items() if seen is None)
+    finally:
+        for stream in streams:
+            stream.cancel()
+        await asyncio.gather(*streams, return_exceptions=True)
+        await client.aclose()
+        for process, _ in workers:
+            process.terminate()
+        for process, _ in workers:
+            process.wait()
+        await relay.stop()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subscribers", type=int, default=3000)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite:///{os.path.join(tmp, 'events.db')}"
+        os.environ["DATABASE_URL"] = database_url
+
+        from app import manage, security
+        from app.database import SessionLocal
+        from app.db.seed import seed_dataset
+
+        manage.create_tables()
+        db = SessionLocal()
+        dataset = seed_dataset(db, therapists=1, patients=args.subscribers, days=1)
+        db.close()
+        # Minted directly: logging thousands of accounts in would only measure bcrypt
+        tokens = {
+            user_id: security.create_access_token({"sub": email})
+            for user_id, email in {**dataset.patients, **dataset.therapists}.items()
+        }
+
+        failures = asyncio.run(run(args, database_url, dataset, tokens))
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Check that the streaming diary export uses flat memory as history grows.
+
+For each history length, seeds one user's diary and measures the peak
+traced allocation (tracemalloc) of:
+
+* loading every entry as ORM objects and serializing the full JSON list,
+  which is what GET /diary-entries/ does without paging;
+* draining diary_export.export_entries as NDJSON;
+* the same export after app.archive has moved all but the last month of the
+  history into diary_archives.
+
+Exits non-zero if either export's peak grows more than 2x between the
+smallest and largest history, or if archiving changes the export.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.bench_export --sizes 1000 10000 50000
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import archive, diary_export, models
+from app.partitions import month_start
+from app.database import Base
+
+USER_ID = 1
+
+
+def seed(db, entries: int):
+    start = datetime(2000, 1, 1)
+    db.execute(insert(models.User), [{"id": USER_ID, "email": "bench@example.com"}])
+    db.execute(
+        insert(models.DiaryEntry),
+        [
+            {
+                "user_id": USER_ID,
+                "date": start + timedelta(days=day),
+                "mood": day % 10,
+                "emotions": {"joy": day % 5, "sad": (day + 2) % 5},
+                "medications_taken": True,
+                "self_harm": False,
+                "suicidal_thoughts": False,
+                "stressful_events": day % 7 == 0,
+                "notes": "entry text " * 10,
+            }
+            for day in range(entries)
+        ],
+    )
+    db.commit()
+
+
+def materialize(db):
+    entries = db.query(models.DiaryEntry).filter(models.DiaryEntry.user_id == USER_ID).all()
+    body = json.dumps(
+        [{column: getattr(entry, column) for column in diary_export.COLUMNS} for entry in entries],
+        default=str,
+    )
+    return len(body)
+
+
+async def stream(digests):
+    total = 0
+    digest = hashlib.sha256()
+    async for chunk in diary_export.export_entries(USER_ID, "ndjson"):
+        total += len(chunk)
+        digest.update(chunk)
+    digests.append(digest.hexdigest())
+    return total
+
+
+def archive_history(db, entries: int):
+    before = datetime.combine(month_start(datetime(2000, 1, 1) + timedelta(days=entries - 1)), datetime.min.time())
+    archived, _ = archive.run(db, before)
+    return archived
+
+
+def measure(fn):
+    tracemalloc.start()
+    started = time.perf_counter()
+    size = fn()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    args = parser.parse_args()
+
+    print(f"{'entries':>8}  {'loader':<16}{'MiB out':>9}{'peak MiB':>10}{'seconds':>9}")
+    peaks = {"stream": [], "stream archived": []}
+    failures = []
+    for entries in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bench.db")
+            async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+            engine = create_engine(f"sqlite:///{path}")
+            Base.metadata.create_all(bind=engine)
+            db = sessionmaker(bind=engine)()
+            seed(db, entries)
+            db.close()
+
+            # Point the export at this run's database
+            diary_export.AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession)
+            digests = []
+            for label, fn in (
+                ("materialize", lambda: materialize(sessionmaker(bind=engine)())),
+                ("stream", lambda: asyncio.run(stream(digests))),
+                ("archive", lambda: archive_history(sessionmaker(bind=engine)(), entries)),
+                ("stream archived", lambda: asyncio.run(stream(digests))),
+            ):
+                size, peak, elapsed = measure(fn)
+                if label == "archive":
+                    print(f"{entries:>8}  archived {size} entries in {elapsed:.2f} s")
+                    continue
+                print(f"{entries:>8}  {label:<16}{size / 2**20:>9.1f}{peak / 2**20:>10.1f}{elapsed:>9.2f}")
+                if label in peaks:
+                    peaks[label].append(peak)
+            if digests[0] != digests[1]:
+                failures.append(f"{entries} entries: the export changes once entries are archived")
+            asyncio.run(async_engine.dispose())
+            engine.dispose()
+
+    for label, measured in peaks.items():
+        if measured[-1] > 2 * measured[0]:
+            failures.append(f"{label}: export memory grows with history length")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
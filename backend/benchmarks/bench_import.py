@@ -0,0 +1,127 @@
+"""Compare loading historical entries one by one with the streaming bulk import.
+
+Generates an NDJSON file of N daily entries and loads it into an empty
+SQLite database twice:
+
+* per entry, repeating what POST /diary/entries does for each row
+  (existence check, insert, rollup refresh, commit);
+* through diary_import.import_entries, fed in 64 KiB chunks.
+
+Exits non-zero if the two runs leave different entries or rollups behind.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.bench_import --entries 5000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import diary_import, models, rollups, schemas
+from app.database import Base
+
+USER_ID = 1
+CHUNK_SIZE = 64 * 1024
+
+
+def make_body(entries: int) -> bytes:
+    rng = random.Random(7)
+    start = datetime(2015, 1, 1)
+    lines = [
+        json.dumps({
+            "date": (start + timedelta(days=day)).date().isoformat(),
+            "mood": rng.randint(1, 10),
+            "emotions": {emotion: rng.randint(1, 5) for emotion in rng.sample(["joy", "sad", "anger", "fear"], 2)},
+            "self_harm": rng.random() < 0.02,
+            "notes": "imported",
+        })
+        for day in range(entries)
+    ]
+    return "\n".join(lines).encode()
+
+
+async def chunked(body: bytes):
+    for offset in range(0, len(body), CHUNK_SIZE):
+        yield body[offset:offset + CHUNK_SIZE]
+
+
+async def one_by_one(db: AsyncSession, body: bytes):
+    for line in body.decode().splitlines():
+        entry = schemas.DiaryEntryImportRow.model_validate_json(line)
+        existing = await db.scalar(
+            select(models.DiaryEntry.id).where(
+                models.DiaryEntry.user_id == USER_ID, models.DiaryEntry.date == entry.date
+            ).limit(1)
+        )
+        if existing:
+            continue
+        db_entry = models.DiaryEntry(**entry.model_dump(), user_id=USER_ID)
+        db.add(db_entry)
+        await db.run_sync(rollups.refresh_entry, db_entry)
+        await db.commit()
+
+
+async def fingerprint(db: AsyncSession):
+    entries = (await db.execute(
+        select(func.count(), func.sum(models.DiaryEntry.mood)).where(models.DiaryEntry.user_id == USER_ID)
+    )).one()
+    weekly = (await db.execute(
+        select(func.count(), func.sum(models.WeeklyRollup.entry_count), func.sum(models.WeeklyRollup.mood_sum))
+    )).one()
+    return tuple(entries), tuple(weekly)
+
+
+async def run(label: str, body: bytes, loader):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}")
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        Session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        async with Session() as db:
+            db.add(models.User(id=USER_ID, email="bench@example.com", first_name="Bench", last_name="User"))
+            await db.commit()
+        async with Session() as db:
+            started = time.perf_counter()
+            await loader(db, body)
+            elapsed = time.perf_counter() - started
+        async with Session() as db:
+            result = await fingerprint(db)
+        await engine.dispose()
+    return label, elapsed, result
+
+
+async def main_async(entries: int):
+    body = make_body(entries)
+    results = [
+        await run("one POST-equivalent per entry", body, one_by_one),
+        await run("streaming import", body, lambda db, data: diary_import.import_entries(db, USER_ID, chunked(data))),
+    ]
+    print(f"{entries} entries, {len(body) / 1024:.0f} KiB")
+    print(f"{'loader':<32}{'seconds':>10}{'rows/s':>10}")
+    for label, elapsed, _ in results:
+        print(f"{label:<32}{elapsed:>10.2f}{entries / elapsed:>10.0f}")
+    if results[0][2] != results[1][2]:
+        print(f"FAIL: results differ: {results[0][2]} != {results[1][2]}")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(main_async(args.entries))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+"""Load-test every router with scripted workloads and report latency as JSON.
+
+Seeds a dataset with app.db.seed.seed_dataset (N therapists, M patients,
+K days of entries each) into DATABASE_URL, logs every account in, then runs
+one workload per endpoint: login, diary CRUD (create, read, list, update,
+delete), emotions, analytics, mood correlations, the therapist summary,
+cohort table and patient details, search, unread notifications and their
+count, the reminder dispatch and bulk mark-read. Each workload sends a fixed
+number of requests from --concurrency concurrent clients, as random seeded
+users, after a few unrecorded warm-up requests.
+
+Requests go to app.main in-process over ASGI by default, or to a running
+server with --base-url (which must use the same DATABASE_URL, since the
+seed is written there).
+
+The report is JSON (stdout, or --output): per endpoint the request and error
+counts, p50/p95/p99/mean/max latency in ms and throughput, plus the commit,
+database and dataset, so runs can be compared between commits; --compare
+prints the p95 change against an earlier report. A readable table goes to
+stderr.
+
+Usage (from the backend directory):
+
+    # SQLite in a temporary directory
+    python -m benchmarks.bench_load --patients 100 --days 180 --output load.json
+    # A local Postgres (the database is emptied first with --reset)
+    python -m benchmarks.bench_load --database-url postgresql://localhost/diary_bench --reset
+    # Compare with a report from another commit
+    python -m benchmarks.bench_load --compare load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPORT_VERSION = 1
+
+
+class Context:
+    """State shared by the workloads: tokens, ids and what earlier workloads created."""
+
+    def __init__(self, dataset, tokens, entry_ids, rng):
+        self.dataset = dataset
+        self.tokens = tokens
+        self.entry_ids = entry_ids  # patient id -> ids of some seeded entries
+        self.rng = rng
+        self.patients = list(dataset.patients)
+        self.therapists = list(dataset.therapists)
+        self.created = []  # (patient id, entry id) from the create workload
+        self._next_day = {}
+
+    def auth(self, user_id):
+        return {"Authorization": f"Bearer {self.tokens[user_id]}"}
+
+    def patient(self):
+        return self.rng.choice(self.patients)
+
+    def therapist(self):
+        return self.rng.choice(self.therapists)
+
+    def new_day(self, patient_id) -> date:
+        """A date after the seeded history that `patient_id` has no entry for yet."""
+        offset = self._next_day.get(patient_id, 1)
+        self._next_day[patient_id] = offset + 1
+        return date.today() + timedelta(days=offset)
+
+
+def entry_body(rng, day: date) -> dict:
+    return {
+        "date": datetime.combine(day, datetime.min.time()).isoformat(),
+        "mood": rng.randint(1, 10),
+        "emotions": {"שמחה": rng.randint(1, 10), "חרדה": rng.randint(1, 10)},
+        "medications_taken": True,
+        "notes": "נרשם במהלך בדיקת עומס",
+    }
+
+
+# Workloads: (name, share of --requests, request coroutine)
+
+async def login(client, ctx):
+    email = ctx.dataset.patients[ctx.patient()]
+    return await client.post("/auth/token", data={"username": email, "password": ctx.dataset.password})
+
+
+async def create_entry(client, ctx):
+    patient_id = ctx.patient()
+    response = await client.post(
+        "/diary/entries", json=entry_body(ctx.rng, ctx.new_day(patient_id)), headers=ctx.auth(patient_id)
+    )
+    if response.status_code == 200:
+        ctx.created.append((patient_id, response.json()["id"]))
+    return response
+
+
+async def get_entry(client, ctx):
+    patient_id = ctx.patient()
+    entry_id = ctx.rng.choice(ctx.entry_ids[patient_id])
+    return await client.get(f"/diary/entries/{entry_id}", headers=ctx.auth(patient_id))
+
+
+async def list_entries(client, ctx):
+    return await client.get("/diary/entries", params={"limit": 50}, headers=ctx.auth(ctx.patient()))
+
+
+async def update_entry(client, ctx):
+    patient_id, entry_id = ctx.rng.choice(ctx.created)
+    day = ctx.new_day(patient_id)
+    return await client.put(f"/diary/entries/{entry_id}", json=entry_body(ctx.rng, day), headers=ctx.auth(patient_id))
+
+
+async def delete_entry(client, ctx):
+    patient_id, entry_id = ctx.created.pop()
+    return await client.delete(f"/diary/entries/{entry_id}", headers=ctx.auth(patient_id))
+
+
+async def emotion_vocabulary(client, ctx):
+    return await client.get("/diary/emotions", headers=ctx.auth(ctx.patient()))
+
+
+async def emotions_summary(client, ctx):
+    return await client.get(
+        "/analytics/emotions/summary", params={"resolution": "week", "smoothing": "ewma"}, headers=ctx.auth(ctx.patient())
+    )
+
+
+async def behaviors_summary(client, ctx):
+    return await client.get("/analytics/behaviors/summary", headers=ctx.auth(ctx.patient()))
+
+
+async def mood_correlations(client, ctx):
+    patient_id = ctx.patient()
+    return await client.get(
+        "/analytics/mood/correlations", params={"patient_id": patient_id},
+        headers=ctx.auth(ctx.dataset.therapist_of[patient_id])
+    )
+
+
+async def patients_summary(client, ctx):
+    return await client.get("/analytics/therapist/patients/summary", headers=ctx.auth(ctx.therapist()))
+
+
+async def cohort_table(client, ctx):
+    return await client.get(
+        "/analytics/therapist/cohort", params={"sort": "average_mood", "descending": True},
+        headers=ctx.auth(ctx.therapist())
+    )
+
+
+async def patient_details(client, ctx):
+    patient_id = ctx.patient()
+    return await client.get(
+        f"/analytics/therapist/patient/{patient_id}/details", headers=ctx.auth(ctx.dataset.therapist_of[patient_id])
+    )
+
+
+async def search_entries(client, ctx):
+    return await client.get("/search/entries", params={"q": "חברים"}, headers=ctx.auth(ctx.patient()))
+
+
+async def unread_notifications(client, ctx):
+    return await client.get("/notifications/unread", headers=ctx.auth(ctx.patient()))
+
+
+async def unread_count(client, ctx):
+    return await client.get("/notifications/unread/count", headers=ctx.auth(ctx.patient()))
+
+
+async def mark_all_read(client, ctx):
+    return await client.post("/notifications/mark-read", json={"up_to": 2**31 - 1}, headers=ctx.auth(ctx.patient()))
+
+
+async def send_reminders(client, ctx):
+    return await client.post("/notifications/send-reminders", headers=ctx.auth(ctx.therapist()))
+
+
+WORKLOADS = [
+    ("POST /auth/token", 0.25, login),
+    ("POST /diary/entries", 1, create_entry),
+    ("GET /diary/entries/{id}", 1, get_entry),
+    ("GET /diary/entries", 1, list_entries),
+    ("PUT /diary/entries/{id}", 1, update_entry),
+    # Deletes the entries the create workload added, so it runs at most as often
+    ("DELETE /diary/entries/{id}", 1, delete_entry),
+    ("GET /diary/emotions", 1, emotion_vocabulary),
+    ("GET /analytics/emotions/summary", 1, emotions_summary),
+    ("GET /analytics/behaviors/summary", 1, behaviors_summary),
+    ("GET /analytics/mood/correlations", 1, mood_correlations),
+    ("GET /analytics/therapist/patients/summary", 1, patients_summary),
+    ("GET /analytics/therapist/cohort", 1, cohort_table),
+    ("GET /analytics/therapist/patient/{id}/details", 1, patient_details),
+    ("GET /search/entries", 1, search_entries),
+    ("GET /notifications/unread", 1, unread_notifications),
+    ("GET /notifications/unread/count", 1, unread_count),
+    # Every patient is made due, so each call dispatches to the whole roster
+    ("POST /notifications/send-reminders", 0.05, send_reminders),
+    ("POST /notifications/mark-read", 1, mark_all_read),
+]
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an ascending list."""
+    return ordered[max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))]
+
+
+def summarize(latencies, errors, seconds):
+    ordered = sorted(latencies)
+    if not ordered:
+        return {"requests": 0, "errors": errors}
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "throughput_rps": round(len(ordered) / seconds, 2) if seconds else None,
+    }
+
+
+async def run_workload(client, ctx, request, count, concurrency, warmup):
+    for _ in range(min(warmup, count)):
+        await request(client, ctx)
+    latencies = []
+    errors = 0
+    remaining = count
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                response = await request(client, ctx)
+                failed = response.status_code >= 400
+            except (httpx.HTTPError, IndexError):
+                failed = True
+            latencies.append(time.perf_counter() - started)
+            errors += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+async def log_in_everyone(client, dataset, concurrency):
+    tokens = {}
+    accounts = list({**dataset.therapists, **dataset.patients}.items())
+    limit = asyncio.Semaphore(concurrency)
+
+    async def log_in(user_id, email):
+        async with limit:
+            response = await client.post("/auth/token", data={"username": email, "password": dataset.password})
+            response.raise_for_status()
+            tokens[user_id] = response.json()["access_token"]
+
+    await asyncio.gather(*(log_in(user_id, email) for user_id, email in accounts))
+    return tokens
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(report, baseline=None, stream=sys.stderr):
+    previous = (baseline or {}).get("endpoints", {})
+    header = f"{'endpoint':<46}{'reqs':>6}{'errs':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}"
+    print(header + (f"{'p95 vs base':>13}" if baseline else ""), file=stream)
+    for name, result in report["endpoints"].items():
+        if not result["requests"]:
+            print(f"{name:<46}{0:>6}{result['errors']:>6}", file=stream)
+            continue
+        line = (
+            f"{name:<46}{result['requests']:>6}{result['errors']:>6}{result['p50_ms']:>9.1f}"
+            f"{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}{result['throughput_rps']:>9.1f}"
+        )
+        base = previous.get(name, {}).get("p95_ms")
+        if baseline and base:
+            line += f"{(result['p95_ms'] - base) / base:>+13.0%}"
+        print(line, file=stream)
+
+
+def make_due(dataset):
+    """Make every seeded patient due a reminder at the current minute."""
+    from app import models
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    db.query(models.NotificationSettings).filter(
+        models.NotificationSettings.user_id.in_(list(dataset.patients))
+    ).update({"reminder_time": datetime.now().strftime("%H:%M")}, synchronize_session=False)
+    db.commit()
+    db.close()
+
+
+async def run(args, app, dataset, entry_ids):
+    if args.base_url:
+        transport, base_url = None, args.base_url
+    else:
+        transport, base_url = httpx.ASGITransport(app=app), "http://bench"
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=args.timeout) as client:
+        started = time.perf_counter()
+        tokens = await log_in_everyone(client, dataset, args.concurrency)
+        print(f"logged in {len(tokens)} accounts in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+        ctx = Context(dataset, tokens, entry_ids, random.Random(args.seed))
+        results = {}
+        for name, share, request in WORKLOADS:
+            count = max(1, round(args.requests * share))
+            if request is update_entry or request is delete_entry:
+                count = min(count, len(ctx.created))
+                warmup = 0
+            else:
+                warmup = args.warmup
+            if request is send_reminders:
+                make_due(dataset)
+            results[name] = await run_workload(client, ctx, request, count, args.concurrency, warmup)
+            print(f"  {name}: {results[name].get('p95_ms', '-')} ms p95", file=sys.stderr)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=None, help="defaults to a SQLite file in a temporary directory")
+    parser.add_argument("--reset", action="store_true", help="drop and recreate all tables before seeding")
+    parser.add_argument("--base-url", default=None, help="load a running server instead of the app in-process")
+    parser.add_argument("--therapists", type=int, default=5)
+    parser.add_argument("--patients", type=int, default=100)
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--requests", type=int, default=200, help="requests per workload")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="-", help="where to write the JSON report (default stdout)")
+    parser.add_argument("--compare", default=None, help="an earlier JSON report to compare p95 latency with")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # app.database builds its engines from DATABASE_URL when first imported
+        os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(tmp, 'load.db')}"
+
+        from sqlalchemy import func, select
+
+        from app import models
+        from app.database import Base, SessionLocal, async_engine, engine
+        from app.db.seed import seed_dataset
+        from app.main import app
+
+        if args.reset:
+            Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+        db = SessionLocal()
+        if db.scalar(select(func.count()).select_from(models.User)):
+            sys.exit("The database already has users; pass --reset to empty it first")
+
+        started = time.perf_counter()
+        dataset = seed_dataset(db, args.therapists, args.patients, args.days, seed=args.seed)
+        seed_seconds = time.perf_counter() - started
+        entry_ids = {patient_id: [] for patient_id in dataset.patients}
+        for user_id, entry_id in db.execute(select(models.DiaryEntry.user_id, models.DiaryEntry.id)):
+            entry_ids[user_id].append(entry_id)
+        db.close()
+        print(f"seeded {dataset.entries} entries in {seed_seconds:.1f}s ({engine.dialect.name})", file=sys.stderr)
+
+        report = {
+            "version": REPORT_VERSION,
+            "commit": git_commit(),
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "database": engine.dialect.name,
+            "target": args.base_url or "in-process",
+            "python": platform.python_version(),
+            "dataset": {
+                "therapists": args.therapists,
+                "patients": args.patients,
+                "days": args.days,
+                "entries": dataset.entries,
+                "seed_seconds": round(seed_seconds, 2),
+            },
+            "settings": {
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "warmup": args.warmup,
+                "seed": args.seed,
+            },
+        }
+        report["endpoints"] = asyncio.run(run(args, app, dataset, entry_ids))
+        asyncio.run(async_engine.dispose())
+        engine.dispose()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    print_table(report, baseline)
+
+    text = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""Check and time the vectorized mood correlations against a per-day loop.
+
+Seeds one user's diary with planted relationships (mood drops the day after
+a stressful event, is higher on days with medication and with "שמחה"),
+then:
+
+* compares analytics_engine.mood_correlations with a straightforward loop
+  over the diary entries, factor by factor and lag by lag;
+* times that loop, the engine (rollup load included) and
+  GET /analytics/mood/correlations cold, cached and revalidated (304).
+
+Exits non-zero if the two disagree or the planted effects are not found.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.bench_mood_correlations --days 1500 --emotions 12
+"""
+import argparse
+import asyncio
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import analytics_engine, data_version, models, rollups, security
+from app.database import Base, get_async_db
+from app.routers import analytics
+
+USER_ID = 1
+MAX_LAG = 3
+URL = f"/analytics/mood/correlations?max_lag={MAX_LAG}"
+
+
+def seed(db, days: int, emotions: int):
+    names = ["שמחה"] + [f"emotion-{i}" for i in range(emotions - 1)]
+    rng = random.Random(7)
+    start = datetime(2020, 1, 1, 21)
+    stressed_yesterday = False
+    rows = []
+    for day in range(days):
+        stressed = rng.random() < 0.25
+        medicated = rng.random() < 0.7
+        felt = rng.sample(names, rng.randint(1, min(4, emotions)))
+        mood = 5 + rng.gauss(0, 1) - 2 * stressed_yesterday + medicated + ("שמחה" in felt)
+        stressed_yesterday = stressed
+        if rng.random() < 0.1:
+            continue  # no entry that day
+        rows.append({
+            "user_id": USER_ID,
+            "date": start + timedelta(days=day),
+            "mood": None if rng.random() < 0.05 else max(1, min(10, round(mood))),
+            "emotions": {name: rng.randint(1, 5) for name in felt},
+            "medications_taken": medicated,
+            "self_harm": rng.random() < 0.01,
+            "suicidal_thoughts": False,
+            "stressful_events": stressed,
+        })
+    db.execute(insert(models.User), [{"id": USER_ID, "email": "bench@example.com"}])
+    db.execute(insert(models.DiaryEntry), rows)
+    db.commit()
+    rollups.backfill(db)
+
+
+def entry_loop(db):
+    """The same statistics, computed per factor and lag over the raw entries."""
+    moods, factors = defaultdict(list), defaultdict(set)
+    for entry in db.query(models.DiaryEntry).filter(models.DiaryEntry.user_id == USER_ID):
+        day = entry.date.date()
+        factors[day]  # a day with entries, even if nothing was reported
+        if entry.mood is not None:
+            moods[day].append(entry.mood)
+        for behavior in rollups.BEHAVIORS:
+            if getattr(entry, behavior):
+                factors[day].add(behavior)
+        factors[day].update(entry.emotions)
+    mood = {day: sum(values) / len(values) for day, values in moods.items()}
+    names = list(rollups.BEHAVIORS) + sorted({name for day in factors.values() for name in day} - set(rollups.BEHAVIORS))
+
+    result = {}
+    for name in names:
+        series = {"correlation": [], "mood_with": [], "mood_without": []}
+        for lag in range(MAX_LAG + 1):
+            pairs = [
+                (name in reported, mood[day + timedelta(days=lag)])
+                for day, reported in factors.items()
+                if day + timedelta(days=lag) in mood
+            ]
+            with_factor = [later for present, later in pairs if present]
+            without = [later for present, later in pairs if not present]
+            try:
+                correlation = statistics.correlation([float(present) for present, _ in pairs], [later for _, later in pairs])
+            except statistics.StatisticsError:
+                correlation = None
+            if len(pairs) < analytics_engine.MIN_PAIRS:
+                correlation = None
+            series["correlation"].append(correlation)
+            series["mood_with"].append(statistics.mean(with_factor) if len(with_factor) >= analytics_engine.MIN_PAIRS else None)
+            series["mood_without"].append(statistics.mean(without) if len(without) >= analytics_engine.MIN_PAIRS else None)
+        result[name] = series
+    return result
+
+
+def engine(db):
+    columns = analytics_engine.DailyColumns.load(db, USER_ID)
+    return analytics_engine.mood_correlations(columns, max_lag=MAX_LAG)
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+def compare(expected, actual):
+    mismatches = []
+    factors = {**actual["behaviors"], **actual["emotions"]}
+    for name, series in expected.items():
+        for key, values in series.items():
+            for lag, (want, got) in enumerate(zip(values, factors[name][key])):
+                if (want is None) != (got is None) or (want is not None and not math.isclose(want, got, abs_tol=1e-3)):
+                    mismatches.append(f"{name} {key} lag {lag}: loop {want}, engine {got}")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=1500)
+    parser.add_argument("--emotions", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        sync_engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(bind=sync_engine)
+        db = sessionmaker(bind=sync_engine)()
+        seed(db, args.days, args.emotions)
+
+        result = engine(db)
+        failures.extend(compare(entry_loop(db), result))
+        stress, medication = result["behaviors"]["stressful_events"], result["behaviors"]["medications_taken"]
+        print(f"{args.days} days, {len(result['emotions'])} emotions, pairs per lag {result['pairs']}")
+        print(f"stressful_events correlation by lag {stress['correlation']}")
+        print(f"medications_taken correlation by lag {medication['correlation']}")
+        print(f"שמחה same-day mood with/without {result['emotions']['שמחה']['mood_with'][0]} / {result['emotions']['שמחה']['mood_without'][0]}")
+        if not stress["correlation"][1] < -0.3:
+            failures.append("the next-day mood drop after stressful events was not found")
+        if not medication["correlation"][0] > 0.1:
+            failures.append("the same-day medication effect was not found")
+
+        print(f"{'entry loop':<24}{timed(lambda: entry_loop(db), args.repeat):>9.2f} ms")
+        print(f"{'engine':<24}{timed(lambda: engine(db), args.repeat):>9.2f} ms")
+        user = db.get(models.User, USER_ID)
+        db.expunge(user)
+        db.close()
+
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        sessions = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+        async def get_db():
+            async with sessions() as session:
+                yield session
+
+        app = FastAPI()
+        app.include_router(analytics.router)
+        app.dependency_overrides[get_async_db] = get_db
+        app.dependency_overrides[security.get_current_active_user] = lambda: user
+
+        with TestClient(app) as client:
+            tag = client.get(URL).headers["etag"]
+
+            def cold():
+                data_version.response_cache.clear()
+                client.get(URL)
+
+            print(f"{'endpoint cold':<24}{timed(cold, args.repeat):>9.2f} ms")
+            print(f"{'endpoint cached':<24}{timed(lambda: client.get(URL), args.repeat):>9.2f} ms")
+            print(f"{'endpoint 304':<24}{timed(lambda: client.get(URL, headers={'If-None-Match': tag}), args.repeat):>9.2f} ms")
+
+        asyncio.run(async_engine.dispose())
+        sync_engine.dispose()
+
+    for failure in failures[:20]:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
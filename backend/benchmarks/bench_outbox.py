@@ -0,0 +1,159 @@
+"""Drive the outbox worker against a local SMTP stand-in that fails on purpose.
+
+Queues therapist alerts the way diary writes do (risk.alert_therapists, one
+transaction per patient), checks that a rolled-back write leaves nothing in
+the outbox, then runs outbox.Worker against an SMTP server that defers every
+--defer-every-th message and permanently refuses one recipient. Partway
+through, a batch is claimed by a "crashed" worker that never reports back,
+so those messages are only delivered once their lease expires. Queue depth
+and lag are sampled while the worker drains the queue.
+
+Exits non-zero unless every deliverable alert arrives, the refused one ends
+up dead after OUTBOX_MAX_ATTEMPTS, and the rolled-back alert is never sent.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.bench_outbox --patients 2000 --defer-every 7
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi_mail import ConnectionConfig
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import models, outbox, risk
+from app.database import Base
+from benchmarks.smtp_standin import SMTPStandIn
+
+REFUSED = "refused@example.com"
+
+
+def seed(db, patients: int):
+    """One therapist per patient; the first therapist's address is refused by the server."""
+    db.execute(insert(models.User), [
+        {"id": i, "email": REFUSED if i == 2 else f"user{i}@example.com", "first_name": "User", "last_name": str(i)}
+        for i in range(1, 2 * patients + 1)
+    ])
+    db.execute(insert(models.TherapistPatient), [
+        {"therapist_id": 2 * i, "patient_id": 2 * i - 1} for i in range(1, patients + 1)
+    ])
+    db.commit()
+    started = time.perf_counter()
+    for i in range(1, patients + 1):
+        risk.alert_therapists(db, 2 * i - 1, "פגיעה עצמית")
+        db.commit()
+    elapsed = time.perf_counter() - started
+
+    # A write that fails after raising its alert must not leave an email behind
+    risk.alert_therapists(db, 1, "rolled back")
+    db.rollback()
+    return elapsed
+
+
+async def drain(sessions, config, args, expected_dead: int):
+    worker = outbox.Worker(sessions, config, batch_size=args.batch_size, concurrency=args.concurrency,
+                           poll_seconds=0.05, stats_seconds=3600)
+
+    # A worker that claims a batch and dies before recording it
+    async with sessions() as db:
+        abandoned = len(await outbox.claim(db, args.batch_size))
+
+    samples = []
+    task = asyncio.create_task(worker.run())
+    started = time.perf_counter()
+    while time.perf_counter() - started < args.timeout:
+        async with sessions() as db:
+            queue = await db.run_sync(outbox.stats)
+        samples.append((time.perf_counter() - started, queue))
+        if queue["pending"] == 0 and queue["dead"] == expected_dead:
+            break
+        await asyncio.sleep(0.25)
+    elapsed = time.perf_counter() - started
+    worker.stop()
+    await task
+    return worker, abandoned, samples, elapsed
+
+
+async def run(path: str, args):
+    standin = await SMTPStandIn(args.session_delay, reject=[REFUSED], defer_every=args.defer_every).start()
+    config = ConnectionConfig(
+        MAIL_USERNAME="", MAIL_PASSWORD="", MAIL_FROM="diary@example.com", MAIL_PORT=standin.port,
+        MAIL_SERVER="127.0.0.1", MAIL_STARTTLS=False, MAIL_SSL_TLS=False, USE_CREDENTIALS=False,
+        VALIDATE_CERTS=False,
+    )
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    sessions = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    try:
+        result = await drain(sessions, config, args, expected_dead=1)
+        async with sessions() as db:
+            statuses = dict((await db.execute(
+                select(models.OutboxMessage.status, func.count()).group_by(models.OutboxMessage.status)
+            )).all())
+            attempts = await db.scalar(select(func.max(models.OutboxMessage.attempts)))
+    finally:
+        await engine.dispose()
+        await standin.stop()
+    return (standin, statuses, attempts) + result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patients", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=outbox.OUTBOX_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--defer-every", type=int, default=7, help="defer every Nth message with a 451")
+    parser.add_argument("--session-delay", type=float, default=0.02, help="seconds added to each new SMTP session")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    # Compress the retry schedule and the lease so the run takes seconds
+    outbox.OUTBOX_RETRY_BASE_SECONDS = 0.1
+    outbox.OUTBOX_MAX_ATTEMPTS = 4
+    outbox.OUTBOX_LEASE_SECONDS = 2
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        enqueue_seconds = seed(db, args.patients)
+        db.close()
+        engine.dispose()
+        standin, statuses, attempts, worker, abandoned, samples, elapsed = asyncio.run(run(path, args))
+
+    print(f"queued {args.patients} alerts in {enqueue_seconds:.2f}s "
+          f"({enqueue_seconds / args.patients * 1000:.2f} ms per alert transaction)")
+    print(f"\n{'t (s)':>7}{'pending':>9}{'due':>7}{'dead':>6}{'lag (s)':>9}")
+    for at, queue in samples[::max(1, len(samples) // 15)] + samples[-1:]:
+        print(f"{at:>7.2f}{queue['pending']:>9}{queue['due']:>7}{queue['dead']:>6}{queue['lag_seconds']:>9.2f}")
+
+    delivered = sum(standin.delivered.values())
+    duplicates = sum(count - 1 for count in standin.delivered.values() if count > 1)
+    print(f"\ndrained in {elapsed:.2f}s: {delivered / elapsed:.0f} msgs/s over {standin.sessions} SMTP sessions")
+    print(f"worker {worker.counts}, abandoned batch of {abandoned} recovered after its lease")
+    print(f"server deferred {standin.deferred}, delivered {delivered} ({duplicates} duplicates)")
+    print(f"outbox statuses {statuses}, max attempts {attempts}")
+
+    failures = []
+    if set(standin.delivered) != {f"user{2 * i}@example.com" for i in range(2, args.patients + 1)}:
+        failures.append("not every deliverable alert arrived")
+    if statuses != {"sent": args.patients - 1, "dead": 1}:
+        failures.append("unexpected outbox statuses (the rolled-back alert was queued, or messages are stuck)")
+    if attempts != outbox.OUTBOX_MAX_ATTEMPTS:
+        failures.append("the refused message was not retried up to OUTBOX_MAX_ATTEMPTS")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
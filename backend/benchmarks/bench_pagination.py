@@ -0,0 +1,88 @@
+"""Compare OFFSET/LIMIT and keyset pagination latency as page depth grows.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.bench_pagination --entries 200000 --page-size 50
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import models
+from app.database import Base
+from app.pagination import encode_cursor, keyset_page
+
+
+def seed(db, user_id: int, count: int):
+    start = datetime(2000, 1, 1)
+    rows = [
+        {
+            "user_id": user_id,
+            "date": start + timedelta(hours=i),
+            "emotions": {},
+            "medications_taken": False,
+            "self_harm": False,
+            "suicidal_thoughts": False,
+            "stressful_events": False,
+        }
+        for i in range(count)
+    ]
+    db.execute(insert(models.DiaryEntry), rows)
+    db.commit()
+
+
+def timed(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        seed(db, user_id=1, count=args.entries)
+
+        base = db.query(models.DiaryEntry).filter(models.DiaryEntry.user_id == 1)
+        newest_first = base.order_by(models.DiaryEntry.date.desc(), models.DiaryEntry.id.desc())
+
+        print(f"{'page':>8} {'offset ms':>10} {'keyset ms':>10}")
+        pages = args.entries // args.page_size
+        depth = 1
+        while depth < pages:
+            skip = depth * args.page_size
+            anchor = newest_first.offset(skip - 1).first()
+            cursor = encode_cursor(anchor.date, anchor.id)
+
+            offset_ms = timed(lambda: newest_first.offset(skip).limit(args.page_size).all(), args.repeat)
+            keyset_ms = timed(
+                lambda: keyset_page(base, models.DiaryEntry.date, models.DiaryEntry.id,
+                                    limit=args.page_size, after=cursor),
+                args.repeat,
+            )
+            print(f"{depth:>8} {offset_ms:>10.2f} {keyset_ms:>10.2f}")
+            depth *= 4
+
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Check that the therapist patients summary costs a constant number of queries.
+
+Seeds rosters of increasing size, counts the SQL statements issued by
+crud.get_patients_summary and exits non-zero if the count grows with the
+number of patients.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.bench_patients_summary --sizes 1 10 80 500 --days 30
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import crud, models, risk, rollups
+from app.database import Base
+
+THERAPIST_ID = 1
+
+
+def seed(db, patients: int, days: int):
+    now = datetime.now()
+    users = [
+        {"id": THERAPIST_ID + 1 + i, "email": f"patient{i}@bench.local", "first_name": "Patient", "last_name": str(i)}
+        for i in range(patients)
+    ]
+    db.execute(insert(models.User), users)
+    db.execute(
+        insert(models.TherapistPatient),
+        [{"therapist_id": THERAPIST_ID, "patient_id": user["id"]} for user in users],
+    )
+    db.execute(
+        insert(models.DiaryEntry),
+        [
+            {
+                "user_id": user["id"],
+                "date": now - timedelta(days=day),
+                "emotions": {},
+                "medications_taken": True,
+                "self_harm": day == 3 and user["id"] % 7 == 0,
+                "suicidal_thoughts": day == 20 and user["id"] % 5 == 0,
+                "stressful_events": False,
+            }
+            for user in users
+            for day in range(days)
+        ],
+    )
+    db.commit()
+    # The summary reads materialized state, which bulk inserts bypass
+    rollups.backfill(db)
+    risk.backfill(db)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 80, 500])
+    parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    counts = {}
+    print(f"{'patients':>9} {'queries':>8} {'ms':>8}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+            Base.metadata.create_all(bind=engine)
+            db = sessionmaker(bind=engine)()
+            seed(db, size, args.days)
+
+            statements = []
+            event.listen(engine, "before_cursor_execute", lambda *a, **kw: statements.append(a[2]))
+            started = time.perf_counter()
+            rows = crud.get_patients_summary(db, THERAPIST_ID, since=datetime.now() - timedelta(days=7))
+            elapsed = (time.perf_counter() - started) * 1000
+            assert len(rows) == size
+
+            counts[size] = len(statements)
+            print(f"{size:>9} {len(statements):>8} {elapsed:>8.2f}")
+            db.close()
+            engine.dispose()
+
+    if len(set(counts.values())) != 1:
+        sys.exit(f"query count depends on roster size: {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Measure reminder selection and email throughput against a local SMTP stand-in.
+
+Seeds users with reminder settings (half of them already wrote today's
+entry), then:
+
+* counts the SQL statements the old per-user loop and the anti-join query
+  issue, and checks both select the same users;
+* sends the resulting emails to an in-process SMTP server that adds a fixed
+  delay to every new session (standing in for TLS and login round trips),
+  once with a session per message as FastMail.send_message does and once
+  through mailer.send_bulk.
+
+Exits non-zero if the two selections differ or any message is lost.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.bench_reminders --users 2000 --session-delay 0.05
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, create_engine, event, insert, select
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi_mail import ConnectionConfig
+
+from app import mailer, models
+from app.database import Base
+from app.routers.notifications import REMINDER_SUBJECT, due_reminders_query, reminder_email_body
+from benchmarks.smtp_standin import SMTPStandIn
+
+REMINDER_TIME = "20:00"
+
+
+def seed(db, users: int):
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    db.execute(
+        insert(models.User),
+        [{"id": i, "email": f"user{i}@example.com", "first_name": "User", "last_name": str(i)} for i in range(1, users + 1)],
+    )
+    db.execute(
+        insert(models.NotificationSettings),
+        [
+            {"user_id": i, "reminder_time": REMINDER_TIME if i % 10 else "08:00", "email_notifications": True}
+            for i in range(1, users + 1)
+        ],
+    )
+    db.execute(
+        insert(models.DiaryEntry),
+        [
+            {"user_id": i, "date": today + timedelta(hours=9) if i % 2 else today - timedelta(days=1), "emotions": {}}
+            for i in range(1, users + 1)
+        ],
+    )
+    db.commit()
+
+
+def loop_selection(db, day_start):
+    """The selection send_daily_reminders used to make: one settings query, then two per user."""
+    due = []
+    for setting in db.scalars(select(models.NotificationSettings).where(models.NotificationSettings.reminder_time == REMINDER_TIME)):
+        user = db.get(models.User, setting.user_id)
+        today_entry = db.scalar(
+            select(models.DiaryEntry.id).where(
+                and_(models.DiaryEntry.user_id == user.id, models.DiaryEntry.date >= day_start)
+            ).limit(1)
+        )
+        if not today_entry:
+            due.append(user.id)
+    return due
+
+
+def count_statements(engine, fn):
+    statements = []
+    listener = lambda *args: statements.append(1)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        started = time.perf_counter()
+        result = fn()
+        return result, len(statements), time.perf_counter() - started
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+
+async def send_one_per_session(config, emails, concurrency):
+    limit = asyncio.Semaphore(concurrency)
+
+    async def send(email):
+        async with limit:
+            return await mailer.send_batch(config, [email])
+
+    return sum(await asyncio.gather(*(send(email) for email in emails)))
+
+
+async def measure_email(emails, session_delay, batch_size, concurrency):
+    results = []
+    for label in ("session per message", f"send_bulk (batch={batch_size})"):
+        standin = await SMTPStandIn(session_delay).start()
+        config = ConnectionConfig(
+            MAIL_USERNAME="", MAIL_PASSWORD="", MAIL_FROM="diary@example.com", MAIL_PORT=standin.port,
+            MAIL_SERVER="127.0.0.1", MAIL_STARTTLS=False, MAIL_SSL_TLS=False, USE_CREDENTIALS=False,
+            VALIDATE_CERTS=False,
+        )
+        started = time.perf_counter()
+        if label.startswith("session"):
+            sent = await send_one_per_session(config, emails, concurrency)
+        else:
+            sent = (await mailer.send_bulk(config, emails, batch_size=batch_size, concurrency=concurrency))["sent"]
+        elapsed = time.perf_counter() - started
+        await standin.stop()
+        results.append((label, sent, standin.messages, standin.sessions, elapsed))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--session-delay", type=float, default=0.05, help="seconds added to each new SMTP session")
+    parser.add_argument("--batch-size", type=int, default=mailer.MAIL_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=mailer.MAIL_CONCURRENCY)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        seed(db, args.users)
+        day_start = datetime.combine(datetime.now().date(), datetime.min.time())
+
+        old_ids, old_statements, old_seconds = count_statements(engine, lambda: loop_selection(db, day_start))
+        rows, new_statements, new_seconds = count_statements(
+            engine, lambda: db.execute(due_reminders_query(REMINDER_TIME, day_start)).all()
+        )
+        db.close()
+
+    print(f"{'selection':<28}{'statements':>12}{'seconds':>10}")
+    print(f"{'per-user loop':<28}{old_statements:>12}{old_seconds:>10.3f}")
+    print(f"{'anti-join':<28}{new_statements:>12}{new_seconds:>10.3f}")
+    if sorted(old_ids) != sorted(row.id for row in rows):
+        print("FAIL: the two selections disagree")
+        sys.exit(1)
+
+    emails = [
+        mailer.OutgoingEmail(row.email, REMINDER_SUBJECT, reminder_email_body(f"{row.first_name} {row.last_name}"))
+        for row in rows
+    ]
+    print(f"\n{len(emails)} emails, {args.session_delay * 1000:.0f} ms per new session, concurrency {args.concurrency}")
+    print(f"{'delivery':<28}{'received':>10}{'sessions':>10}{'seconds':>10}{'msgs/s':>10}")
+    failed = False
+    for label, sent, received, sessions, elapsed in asyncio.run(
+        measure_email(emails, args.session_delay, args.batch_size, args.concurrency)
+    ):
+        print(f"{label:<28}{received:>10}{sessions:>10}{elapsed:>10.2f}{received / elapsed:>10.0f}")
+        failed |= sent != len(emails) or received != len(emails)
+    if failed:
+        print("FAIL: messages were lost")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Compare the full-text index with a LIKE scan over diary notes.
+
+Seeds a roster of patients with generated Hebrew notes, builds the search
+index with search.reindex, and times a roster-wide query for a trigger word
+both ways. The LIKE scan only finds the exact spelling, so it is given every
+prefixed form the index matches to keep the result sets comparable.
+
+Exits non-zero if the index misses an entry the LIKE scan finds.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.bench_search --patients 50 --days 2000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert, or_, select
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import models, search
+from app.database import Base
+
+WORDS = "היום הרגשתי עייפות בעבודה עם המשפחה חברים שינה אוכל טיול שיחה כאב ראש שקט".split()
+TRIGGER = "חרדה"
+PREFIXES = ["", "ו", "ה", "ב", "וב", "מה", "שה"]
+
+
+def seed(db, patients: int, days: int):
+    rng = random.Random(3)
+    start = datetime(2015, 1, 1)
+    db.execute(insert(models.User), [{"id": i, "email": f"p{i}@example.com"} for i in range(1, patients + 1)])
+    rows = []
+    for user_id in range(1, patients + 1):
+        for day in range(days):
+            words = rng.choices(WORDS, k=rng.randint(8, 30))
+            if rng.random() < 0.01:
+                words.insert(rng.randrange(len(words)), rng.choice(PREFIXES) + TRIGGER)
+            rows.append({"user_id": user_id, "date": start + timedelta(days=day), "emotions": {}, "notes": " ".join(words)})
+        if len(rows) >= 20000:
+            db.execute(insert(models.DiaryEntry), rows)
+            rows = []
+    if rows:
+        db.execute(insert(models.DiaryEntry), rows)
+    db.commit()
+
+
+def like_scan(db, user_ids):
+    return db.scalars(
+        select(models.DiaryEntry.id).where(
+            models.DiaryEntry.user_id.in_(user_ids),
+            or_(*(models.DiaryEntry.notes.like(f"%{prefix}{TRIGGER}%") for prefix in PREFIXES))
+        )
+    ).all()
+
+
+def indexed(db, user_ids):
+    return [row.id for row in search.search(db, user_ids, TRIGGER, limit=10**9)]
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - started)
+    return result, statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patients", type=int, default=50)
+    parser.add_argument("--days", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        seed(db, args.patients, args.days)
+        started = time.perf_counter()
+        search.reindex(db)
+        db.commit()
+        print(f"{args.patients * args.days} entries, index built in {time.perf_counter() - started:.1f}s")
+
+        user_ids = list(range(1, args.patients + 1))
+        like_ids, like_seconds = timed(lambda: like_scan(db, user_ids), args.repeat)
+        index_ids, index_seconds = timed(lambda: indexed(db, user_ids), args.repeat)
+        db.close()
+
+    print(f"{'query':<12}{'matches':>9}{'ms':>10}")
+    print(f"{'LIKE scan':<12}{len(like_ids):>9}{like_seconds * 1000:>10.1f}")
+    print(f"{'index':<12}{len(index_ids):>9}{index_seconds * 1000:>10.1f}")
+    if not set(like_ids) <= set(index_ids):
+        print("FAIL: the index missed entries the LIKE scan found")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
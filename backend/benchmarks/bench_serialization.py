@@ -0,0 +1,132 @@
+"""Compare the default and the fast serialization path for diary listings.
+
+Seeds one diary and renders its first N entries both ways:
+
+* default: load ORM objects, validate them into schemas.DiaryEntry
+  (from_attributes), run jsonable_encoder and encode with the stdlib json
+  module, as FastAPI does for a response_model route;
+* fast: select the schema's columns, build dicts with serialization.row_dicts
+  and encode with serialization.dumps (orjson).
+
+Reports the query, build and encode time of each and checks both bodies
+decode to the same data; exits non-zero if they do not.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.bench_serialization --sizes 1000 10000 --repeat 10
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import models, schemas, serialization
+from app.database import Base
+
+USER_ID = 1
+
+
+def seed(db, entries: int):
+    start = datetime(1990, 1, 1)
+    db.execute(insert(models.User), [{"id": USER_ID, "email": "bench@example.com"}])
+    db.execute(insert(models.DiaryEntry), [
+        {
+            "user_id": USER_ID,
+            "date": start + timedelta(days=day),
+            "mood": day % 10,
+            "emotions": {"שמחה": day % 7, "עצב": (day + 3) % 5, "חרדה": day % 4},
+            "medications_taken": day % 2 == 0,
+            "medications_notes": "כדור אחד בבוקר" if day % 3 == 0 else None,
+            "self_harm": False,
+            "suicidal_thoughts": False,
+            "stressful_events": day % 9 == 0,
+            "notes": f"יום {day}: " + "הרגשתי בסדר, יצאתי להליכה קצרה. " * (day % 4),
+        }
+        for day in range(entries)
+    ])
+    db.commit()
+
+
+def newest(query, limit):
+    return query.where(models.DiaryEntry.user_id == USER_ID).order_by(
+        models.DiaryEntry.date.desc(), models.DiaryEntry.id.desc()
+    ).limit(limit)
+
+
+def default_path(db, limit):
+    started = time.perf_counter()
+    entries = db.scalars(newest(select(models.DiaryEntry), limit)).all()
+    loaded = time.perf_counter()
+    content = jsonable_encoder([schemas.DiaryEntry.model_validate(entry) for entry in entries])
+    built = time.perf_counter()
+    body = json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+    encoded = time.perf_counter()
+    db.expunge_all()
+    return body, (loaded - started, built - loaded, encoded - built)
+
+
+def fast_path(db, limit):
+    started = time.perf_counter()
+    rows = db.execute(newest(select(*serialization.columns_for(schemas.DiaryEntry, models.DiaryEntry)), limit)).all()
+    loaded = time.perf_counter()
+    content = serialization.row_dicts(rows)
+    for entry in content:
+        entry["emotions"] = schemas.DiaryEntry.parse_emotions(entry["emotions"])
+    built = time.perf_counter()
+    body = serialization.dumps(content)
+    encoded = time.perf_counter()
+    return body, (loaded - started, built - loaded, encoded - built)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        seed(db, max(args.sizes))
+
+        print(f"{'entries':>8}{'path':>9}{'query ms':>10}{'build ms':>10}{'encode ms':>11}{'total ms':>10}{'KiB':>8}{'speedup':>9}")
+        for size in args.sizes:
+            totals = {}
+            bodies = {}
+            for name, fn in (("default", default_path), ("fast", fast_path)):
+                samples = []
+                for _ in range(args.repeat):
+                    bodies[name], phases = fn(db, size)
+                    samples.append(phases)
+                medians = [statistics.median(phase) * 1000 for phase in zip(*samples)]
+                totals[name] = statistics.median(sum(phases) for phases in samples) * 1000
+                speedup = f"{totals['default'] / totals[name]:.1f}x" if name == "fast" else ""
+                print(
+                    f"{size:>8}{name:>9}" + "".join(f"{ms:>10.1f}" for ms in medians[:2])
+                    + f"{medians[2]:>11.1f}{totals[name]:>10.1f}{len(bodies[name]) / 1024:>8.0f}{speedup:>9}"
+                )
+            if json.loads(bodies["default"]) != json.loads(bodies["fast"]):
+                failures.append(f"{size} entries: the two paths render different data")
+        db.close()
+        engine.dispose()
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
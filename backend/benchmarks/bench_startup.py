@@ -0,0 +1,93 @@
+"""Measure cold-start cost: importing app.main and serving the first request.
+
+Each sample runs in a fresh interpreter, as a new replica would. It records
+the time to import app.main, the first request to GET / (route compilation,
+middleware stack construction) and the first request that reaches the
+database (GET /health/db opens no connection, so /users/ is used), then
+checks the import itself was free of side effects:
+
+* no database connection was checked out while importing;
+* the mail stack (fastapi_mail, aiosmtplib) was not loaded.
+
+Exits non-zero if either check fails. The database is a throwaway SQLite
+file created with `python -m app.manage create-tables` before sampling.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.bench_startup --samples 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import json, sys, time
+started = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+from app.database import pool_stats
+checkouts = sum(pool.get("checkouts", 0) for pool in pool_stats().values())
+mail_loaded = sorted(name for name in ("fastapi_mail", "aiosmtplib") if name in sys.modules)
+from fastapi.testclient import TestClient
+client = TestClient(app.main.app)
+before = time.perf_counter()
+first = client.get("/")
+root = time.perf_counter()
+users = client.get("/users/")
+database = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "first_request_ms": (root - before) * 1000,
+    "first_db_request_ms": (database - root) * 1000,
+    "import_checkouts": checkouts,
+    "mail_loaded": mail_loaded,
+    "statuses": [first.status_code, users.status_code],
+}))
+"""
+
+
+def sample(env):
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=BACKEND, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=10)
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {**os.environ, "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'startup.db')}"}
+        subprocess.run([sys.executable, "-m", "app.manage", "create-tables"], cwd=BACKEND, env=env,
+                       check=True, capture_output=True)
+        samples = [sample(env) for _ in range(args.samples)]
+
+    print(f"{args.samples} fresh processes, median (min-max)")
+    for key in ("import_ms", "first_request_ms", "first_db_request_ms"):
+        values = [result[key] for result in samples]
+        print(f"{key:<22}{statistics.median(values):>9.1f}  ({min(values):.1f}-{max(values):.1f})")
+
+    if any(result["import_checkouts"] for result in samples):
+        failures.append("importing app.main checked out a database connection")
+    if any(result["mail_loaded"] for result in samples):
+        failures.append(f"importing app.main loaded the mail stack: {samples[0]['mail_loaded']}")
+    if any(result["statuses"] != [200, 200] for result in samples):
+        failures.append(f"unexpected statuses: {samples[0]['statuses']}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""An in-process SMTP server for benchmarks.
+
+Speaks just enough of RFC 5321 for aiosmtplib to deliver mail, adds a fixed
+delay to every new session (standing in for TLS and login round trips), and
+can fail on purpose: `reject` recipients are refused permanently (550), and
+every `defer_every`-th message is deferred (451) at the end of DATA unless
+its recipients were deferred before, the way greylisting behaves.
+"""
+import asyncio
+from collections import Counter
+from typing import Iterable
+
+
+class SMTPStandIn:
+    def __init__(self, session_delay: float = 0.0, reject: Iterable[str] = (), defer_every: int = 0):
+        self.session_delay = session_delay
+        self.reject = set(reject)
+        self.defer_every = defer_every
+        self.sessions = 0
+        self.messages = 0
+        self.deferred = 0
+        self.delivered = Counter()
+        self.greylisted = set()
+        self.server = None
+
+    @property
+    def port(self) -> int:
+        return self.server.sockets[0].getsockname()[1]
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        self.sessions += 1
+        await asyncio.sleep(self.session_delay)
+        writer.write(b"220 standin ESMTP\r\n")
+        recipients = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                writer.write(b"250-standin\r\n250 8BITMIME\r\n")
+            elif command == b"RCPT":
+                address = line.decode().partition(":")[2].strip().strip("<>")
+                if address in self.reject:
+                    writer.write(b"550 no such user\r\n")
+                else:
+                    recipients.append(address)
+                    writer.write(b"250 ok\r\n")
+            elif command == b"DATA":
+                writer.write(b"354 go ahead\r\n")
+                await writer.drain()
+                while (await reader.readline()) not in (b".\r\n", b""):
+                    pass
+                self.messages += 1
+                if self.defer_every and self.messages % self.defer_every == 0 and not self.greylisted.issuperset(recipients):
+                    self.greylisted.update(recipients)
+                    self.deferred += 1
+                    writer.write(b"451 try again later\r\n")
+                else:
+                    self.delivered.update(recipients)
+                    writer.write(b"250 queued\r\n")
+                recipients = []
+            elif command == b"RSET":
+                recipients = []
+                writer.write(b"250 ok\r\n")
+            elif command == b"QUIT":
+                writer.write(b"221 bye\r\n")
+                await writer.drain()
+                break
+            else:
+                writer.write(b"250 ok\r\n")
+            await writer.drain()
+        writer.close()
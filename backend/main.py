@@ -1,15 +1,8 @@
-import logging
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.routers import auth, users
-from app.database import engine, Base
-
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
-
-# Create database tables
-Base.metadata.create_all(bind=engine)
+from app.metrics import MetricsMiddleware
+from app.routers import auth, metrics, users
+from app.pagination import NEXT_CURSOR_HEADER, PREV_CURSOR_HEADER
 
 app = FastAPI(title="Emotional Diary API")
 
@@ -20,19 +13,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, PREV_CURSOR_HEADER],
 )
 
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    logger.info(f"Request path: {request.url.path}")
-    logger.info(f"Request method: {request.method}")
-    response = await call_next(request)
-    return response
+# Per-route latency, status and SQL metrics, served at /metrics
+app.add_middleware(MetricsMiddleware)
 
 # Include routers
 app.include_router(auth.router)
 app.include_router(users.router)
+app.include_router(metrics.router)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="debug")
+    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")